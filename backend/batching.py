@@ -0,0 +1,136 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+import settings
+from telemetry import BATCH_QUEUE_SECONDS, BATCH_ROWS
+
+log = logging.getLogger(__name__)
+
+# =====================================================
+# Micro-batching of scorer calls across concurrent requests
+# =====================================================
+#
+# Every request used to run its own forward pass over one or two rows.  Under
+# concurrent load the scheduler thread collects the pending feature arrays of
+# all in-flight requests and runs them as one batch, flushed as soon as
+# max_batch rows are waiting or the oldest one has waited max_wait_ms.  Each
+# caller gets its own rows back through a Future.
+#
+# Waiting only pays off if somebody else is about to submit: requests announce
+# themselves with `with batcher.caller():` as soon as they start (before
+# landmarking), and a batch is flushed early once every announced caller is
+# in it.  A lone request is therefore scored without any added delay.
+
+
+class MicroBatcher:
+    def __init__(self, predict, max_batch=settings.BATCH_MAX_ROWS, max_wait_ms=settings.BATCH_MAX_WAIT_MS):
+        """predict : (N, V, 42) float32 features -> (N, 12) scores"""
+        self.predict_fn = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self._callers = 0
+        self._callers_lock = threading.Lock()
+        self.counters = {"batches": 0, "rows": 0, "requests": 0, "early_flushes": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, features):
+        """Queues (n, V, 42) features, returns a Future of their (n, 12) scores."""
+        if self._closed:
+            raise RuntimeError("batcher is closed")
+        self._ensure_started()
+        future = Future()
+        self._queue.put((np.asarray(features, dtype=np.float32), future, time.perf_counter()))
+        return future
+
+    def predict(self, features):
+        return self.submit(features).result()
+
+    @contextmanager
+    def caller(self):
+        """Marks a request that will submit() soon, so batches wait for it."""
+        with self._callers_lock:
+            self._callers += 1
+        try:
+            yield self
+        finally:
+            with self._callers_lock:
+                self._callers -= 1
+
+    # -----------------------------
+    # scheduler thread
+    # -----------------------------
+    def _collect(self, first):
+        """first + whatever else arrives until the batch is full or the wait is over."""
+        pending = [first]
+        rows = len(first[0])
+        deadline = first[2] + self.max_wait
+        while rows < self.max_batch:
+            if len(pending) >= self._callers and self._queue.empty():
+                self.counters["early_flushes"] += 1
+                break
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)       # let the loop see the stop marker
+                break
+            pending.append(item)
+            rows += len(item[0])
+        return pending
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            pending = self._collect(first)
+
+            flushed_at = time.perf_counter()
+            for _, _, queued_at in pending:
+                BATCH_QUEUE_SECONDS.observe(flushed_at - queued_at)
+            batch = np.concatenate([features for features, _, _ in pending])
+            BATCH_ROWS.observe(len(batch))
+            self.counters["batches"] += 1
+            self.counters["rows"] += len(batch)
+            self.counters["requests"] += len(pending)
+
+            try:
+                scores = self.predict_fn(batch)
+            except Exception as e:
+                log.exception("batched scoring failed (%d requests)", len(pending))
+                for _, future, _ in pending:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for features, future, _ in pending:
+                future.set_result(scores[start:start + len(features)])
+                start += len(features)
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+
+    def stats(self):
+        out = dict(self.counters, max_batch=self.max_batch, max_wait_ms=self.max_wait * 1000.0)
+        out["mean_rows"] = round(out["rows"] / out["batches"], 3) if out["batches"] else 0.0
+        return out
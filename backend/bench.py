@@ -0,0 +1,554 @@
+"""
+Benchmark harness for the analysis pipeline.
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json --max-regression 0.25     # fail on regressions
+    python bench.py --concurrency 1,4,16 --requests 64 --backends eager,onnx
+
+Times every stage on its own, then whole requests through the FastAPI app:
+  - face_mesh.refine / face_mesh.lite   MediaPipe landmarking of one image
+                      with / without refine_landmarks (plus how far the
+                      features of the sample faces move between the two)
+  - features.b1/b256  the 42-feature kernel for 1 / 256 images
+  - scoring.<backend>.b1/b256   scaler + the three classifiers (fused)
+  - scoring.{direct,batched}.c<N>   N threads scoring one case each, every
+                      call on its own vs through the micro-batcher
+  - roi.detect        the shared face detection of one image
+  - face_mesh.roi     FaceMesh on the face crop instead of the full photo
+  - reconstruction / reconstruction.roi   one 3DDFA_V2 fit through the
+                      resident worker, full photo vs face crop + box
+                      (both ROI stages report saved_ms_per_image: how much
+                      faster the image is than on the full-photo path,
+                      detection included)
+  - similar.exact.n<N>[.b64] / similar.ivf.n<N>   top-10 similar cases among
+                      N synthetic cases for 1 (64) query vectors, exact vs the
+                      IVF index (with its recall@10 against exact and build time)
+  - video.tracking / video.static   one view of a --video-seconds clip (the
+                      front sample, jittered) through video.track_view, FaceMesh
+                      in tracking mode vs a full detection on every frame:
+                      ms_per_frame and realtime_factor (> 1 = faster than the
+                      clip plays)
+  - e2e.upload.c<N>   POST /api/upload with N requests in flight
+
+The sample faces are the front/right/left/basal pictures shipped with the
+frontend (--images to use another folder).  When 3DDFA_V2 is not installed a
+stub tree is generated and run through the same worker protocol, taking
+--stub-recon-ms per fit; stages that need a missing package (mediapipe) are
+reported as skipped.  Results are JSON; with --baseline every stage whose p50
+got slower by more than --max-regression fails the run (exit code 1).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "m-frontend-rhino", "src", "assets")
+
+
+# =====================================================
+# 1. Measurement helpers
+# =====================================================
+
+def summarize(samples_ms, items=1):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    out = {
+        "n": int(a.size),
+        "mean_ms": round(float(a.mean()), 4),
+        "p50_ms": round(float(np.percentile(a, 50)), 4),
+        "p95_ms": round(float(np.percentile(a, 95)), 4),
+        "p99_ms": round(float(np.percentile(a, 99)), 4),
+        "min_ms": round(float(a.min()), 4),
+    }
+    if items > 1:
+        out["items_per_sec"] = round(items * 1000.0 / out["p50_ms"], 1) if out["p50_ms"] else None
+    return out
+
+
+def time_calls(fn, repeat, warmup=3, items=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return summarize(samples, items)
+
+
+# =====================================================
+# 2. Environment: sample faces + 3DDFA stub
+# =====================================================
+
+STUB_FILES = {
+    "FaceBoxes/__init__.py": "",
+    "FaceBoxes/FaceBoxes_ONNX.py": (
+        "class FaceBoxes_ONNX:\n"
+        "    def __call__(self, img):\n"
+        "        h, w = img.shape[:2]\n"
+        "        return [[0, 0, w, h, 1.0]]\n"
+    ),
+    # a 200 x 190 vertex grid: same vertex / triangle count as the dense BFM mesh
+    "TDDFA_ONNX.py": (
+        "import os, time\n"
+        "import numpy as np\n"
+        "class TDDFA_ONNX:\n"
+        "    def __init__(self, **kwargs):\n"
+        "        self.delay = float(os.environ.get('BENCH_STUB_RECON_MS', '0')) / 1000.0\n"
+        "        q = np.arange(200 * 190).reshape(190, 200)[:-1, :-1].ravel()\n"
+        "        self.tri = np.concatenate([np.stack([q, q + 1, q + 200], 1), np.stack([q + 1, q + 201, q + 200], 1)])\n"
+        "    def __call__(self, img, boxes):\n"
+        "        time.sleep(self.delay)\n"
+        "        return [None], boxes\n"
+        "    def recon_vers(self, param_lst, roi_box_lst, dense_flag=True):\n"
+        "        x0, y0, x1, y1 = roi_box_lst[0][:4]\n"
+        "        x, y = np.meshgrid(np.linspace(x0, x1, 200), np.linspace(y0, y1, 190))\n"
+        "        z = 50 * np.exp(-((x - (x0 + x1) / 2) ** 2 + (y - (y0 + y1) / 2) ** 2) / (x1 - x0) ** 2)\n"
+        "        return [np.stack([x.ravel(), y.ravel(), z.ravel()]).astype(np.float32)]\n"
+    ),
+    "utils/__init__.py": "",
+    "utils/serialization.py": (
+        "def ser_to_obj(img, ver_lst, tri, height, wfp):\n"
+        "    open(wfp, 'w').write('v 0 0 0\\nv 1 0 0\\nv 0 1 0\\nf 1 2 3\\n')\n"
+    ),
+    "utils/uv.py": (
+        "def uv_tex(img, ver_lst, tri, show_flag=False, wfp=None):\n"
+        "    open(wfp, 'wb').write(b'')\n"
+    ),
+    "configs/mb1_120x120.yml": "{}\n",
+}
+
+
+def write_tddfa_stub(root):
+    for rel, content in STUB_FILES.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+    return root
+
+
+def configure(args):
+    """Sets the env the backend modules read at import time. Returns run metadata."""
+    work = tempfile.mkdtemp(prefix="nose_bench_")
+    tddfa_dir = os.path.expanduser(os.environ.get("TDDFA_DIR", "~/3DDFA_V2"))
+    use_stub = args.stub_3ddfa or not os.path.isdir(tddfa_dir)
+    if use_stub:
+        os.environ["TDDFA_DIR"] = write_tddfa_stub(os.path.join(work, "3ddfa_stub"))
+        os.environ["TDDFA_PYTHON"] = sys.executable
+        os.environ["TDDFA_CONFIG"] = "configs/mb1_120x120.yml"
+        os.environ["BENCH_STUB_RECON_MS"] = str(args.stub_recon_ms)
+
+    os.environ["RESULTS_DIR"] = os.path.join(work, "results")
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.warm_cache:
+        os.environ["CACHE_ENTRIES"] = "0"
+        os.environ["CACHE_DIR"] = ""
+    return {"tddfa_stub": use_stub, "stub_recon_ms": args.stub_recon_ms if use_stub else None,
+            "cache": args.warm_cache}
+
+
+def load_samples(folder):
+    import cv2
+
+    images = {}
+    for view in ("front", "right", "left", "basal"):
+        for ext in (".png", ".jpg", ".jpeg"):
+            path = os.path.join(folder, view + ext)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                images[view] = (os.path.basename(path), data, cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR))
+                break
+        else:
+            raise FileNotFoundError(f"no {view} image in {folder}")
+    return images
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# =====================================================
+# 3. Stage benchmarks
+# =====================================================
+
+def bench_face_mesh(samples, repeat):
+    from geometry import features_from_landmarks
+
+    try:
+        from landmarks import create_face_mesh, detect_landmarks
+        meshes = {"refine": create_face_mesh(True), "lite": create_face_mesh(False)}
+    except ImportError as e:
+        return {"face_mesh": {"skipped": str(e)}}
+
+    images = [img for _, _, img in samples.values()]
+    out = {}
+    for mode, face_mesh in meshes.items():
+        i = iter(range(10 ** 9))
+        out[f"face_mesh.{mode}"] = time_calls(lambda: detect_landmarks(images[next(i) % len(images)], face_mesh),
+                                              repeat)
+
+    # does dropping the refinement change what the classifiers see?
+    features = {mode: features_from_landmarks(np.stack([detect_landmarks(img, fm) for img in images]))
+                for mode, fm in meshes.items()}
+    a, b = features["refine"], features["lite"]
+    if (np.isnan(a) != np.isnan(b)).any():
+        max_diff = None         # a landmark was found in one mode only
+    else:
+        max_diff = round(float(np.nan_to_num(np.abs(a - b)).max()), 6)
+    out["face_mesh.lite"]["feature_max_abs_diff"] = max_diff
+    for face_mesh in meshes.values():
+        face_mesh.close()
+    return out
+
+
+def bench_roi(samples, repeat):
+    import settings
+
+    try:
+        from landmarks import create_face_mesh, detect_landmarks
+        from roi import create_face_detector, crop_face, detect_face_box
+        detector = create_face_detector()
+        face_mesh = create_face_mesh()
+    except ImportError as e:
+        return {"roi": {"skipped": str(e)}}, {}
+
+    images = [img for _, _, img in samples.values()]
+    boxes = {view: detect_face_box(img, detector) for view, (_, _, img) in samples.items()}
+    if any(box is None for box in boxes.values()):
+        return {"roi": {"skipped": f"no face found in {[v for v, b in boxes.items() if b is None]}"}}, {}
+    box_list = list(boxes.values())
+
+    i = iter(range(10 ** 9))
+    out = {"roi.detect": time_calls(lambda: detect_face_box(images[next(i) % len(images)], detector), repeat)}
+
+    def landmarks_on_crop():
+        k = next(i) % len(images)
+        crop = crop_face(images[k], box_list[k], settings.FACE_MESH_ROI_MARGIN, settings.FACE_MESH_ROI_SIDE)
+        return crop.to_full(detect_landmarks(crop.image, face_mesh))
+
+    out["face_mesh.roi"] = time_calls(landmarks_on_crop, repeat)
+    detector.close()
+    face_mesh.close()
+    return out, boxes
+
+
+def bench_features(repeat):
+    from geometry import NUM_LANDMARKS, features_from_landmarks
+
+    rng = np.random.default_rng(0)
+    out = {}
+    for b in (1, 256):
+        landmarks = rng.uniform(0, 500, (b, NUM_LANDMARKS, 2))
+        out[f"features.b{b}"] = time_calls(lambda: features_from_landmarks(landmarks), repeat, items=b)
+    return out
+
+
+def bench_scoring(backends, repeat, threads):
+    from registry import ModelRegistry
+    from scoring import VIEW_ORDER
+
+    out = {}
+    for backend in backends:
+        try:
+            scorer = ModelRegistry(backend=backend, threads=threads).scorer
+        except (ImportError, FileNotFoundError) as e:
+            out[f"scoring.{backend}"] = {"skipped": str(e)}
+            continue
+        rng = np.random.default_rng(0)
+        for b in (1, 256):
+            features = rng.normal(0, 1, (b, len(VIEW_ORDER), 42)).astype(np.float32)
+            out[f"scoring.{backend}.b{b}"] = time_calls(lambda: scorer.predict(features), repeat, items=b)
+    return out
+
+
+def bench_batching(levels, requests, repeat):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import settings
+    from batching import MicroBatcher
+    from registry import ModelRegistry
+    from scoring import VIEW_ORDER
+
+    scorer = ModelRegistry().scorer
+    features = np.random.default_rng(0).normal(0, 1, (1, len(VIEW_ORDER), 42)).astype(np.float32)
+    out = {}
+    for c in levels:
+        batcher = MicroBatcher(scorer.predict)
+        with ThreadPoolExecutor(max_workers=c) as pool:
+            for name, predict in (("direct", scorer.predict), ("batched", batcher.predict)):
+                def one(_):
+                    with batcher.caller():
+                        return predict(features)
+
+                def run():
+                    list(pool.map(one, range(requests)))
+                out[f"scoring.{name}.c{c}"] = time_calls(run, max(repeat // 10, 3), items=requests)
+        out[f"scoring.batched.c{c}"]["mean_batch_rows"] = batcher.stats()["mean_rows"]
+        batcher.close()
+    return out
+
+
+def bench_reconstruction(samples, repeat, box=None):
+    import settings
+    from reconstruction import ReconstructionPool
+
+    pool = ReconstructionPool(size=1)
+    img = samples["front"][2]
+    out = {}
+    try:
+        pool.start()
+        i = iter(range(10 ** 9))
+        out["reconstruction"] = time_calls(lambda: pool.reconstruct(img, f"bench_{next(i)}", settings.RESULTS_DIR),
+                                           repeat, warmup=1)
+        if box is not None:
+            out["reconstruction.roi"] = time_calls(
+                lambda: pool.reconstruct(img, f"bench_{next(i)}", settings.RESULTS_DIR, box=box), repeat, warmup=1,
+            )
+    except Exception as e:
+        out["reconstruction"] = {"skipped": str(e)}
+    finally:
+        pool.close()
+    return out
+
+
+def bench_similar(n_cases, repeat, k=10):
+    """Exact and IVF similar-case search over n_cases synthetic clustered vectors."""
+    from case_index import DIMENSIONS, CaseIndex
+
+    if n_cases <= 0:
+        return {}
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(256, DIMENSIONS)).astype(np.float32)
+    index = CaseIndex(tempfile.mkdtemp(prefix="nose_bench_index_"))
+    for start in range(0, n_cases, 100000):
+        n = min(100000, n_cases - start)
+        vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, DIMENSIONS)).astype(np.float32)
+        index.add([{"case_id": str(start + i), "kind": "bench"} for i in range(n)], vectors)
+    queries = centers[rng.integers(0, len(centers), 64)] + 0.5 * rng.normal(size=(64, DIMENSIONS)).astype(np.float32)
+
+    out = {}
+    i = iter(range(10 ** 9))
+    out[f"similar.exact.n{n_cases}"] = time_calls(
+        lambda: index.search(queries[next(i) % len(queries)], k, approximate=False), repeat)
+    out[f"similar.exact.n{n_cases}.b64"] = time_calls(lambda: index.search(queries, k, approximate=False),
+                                                      max(3, repeat // 10), items=len(queries))
+
+    t0 = time.perf_counter()
+    index.build_ivf()
+    build_s = time.perf_counter() - t0
+    stats = time_calls(lambda: index.search(queries[next(i) % len(queries)], k, approximate=True), repeat)
+    _, exact = index.search(queries, k, approximate=False)
+    _, approx = index.search(queries, k, approximate=True)
+    stats["recall_at_k"] = round(float(np.mean([len(set(a) & set(e)) / k for a, e in zip(approx, exact)])), 4)
+    stats["build_s"] = round(build_s, 2)
+    out[f"similar.ivf.n{n_cases}"] = stats
+    return out
+
+
+def bench_video(samples, seconds, fps=30):
+    """track_view on a synthetic clip of the front sample, tracking vs static FaceMesh."""
+    if seconds <= 0:
+        return {}
+    try:
+        import cv2
+        from video import FrameSource, track_view
+        import mediapipe  # noqa: F401
+    except ImportError as e:
+        return {"video": {"skipped": str(e)}}
+
+    _, _, front = samples["front"]
+    path = os.path.join(tempfile.mkdtemp(prefix="nose_bench_video_"), "front.mp4")
+    h, w = front.shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+    rng = np.random.default_rng(0)
+    for _ in range(int(seconds * fps)):
+        # small head motion, and now and then a blurred frame
+        dx, dy = rng.integers(-4, 5, 2)
+        frame = np.roll(front, (int(dy), int(dx)), axis=(0, 1))
+        if rng.random() < 0.2:
+            frame = cv2.GaussianBlur(frame, (9, 9), 0)
+        writer.write(frame)
+    writer.release()
+
+    out = {}
+    for mode, static in (("tracking", False), ("static", True)):
+        try:
+            stats = track_view(FrameSource(video_path=path), "front", static=static)["stats"]
+        except ValueError as e:
+            return {"video": {"skipped": str(e)}}
+        out[f"video.{mode}"] = {key: stats[key] for key in
+                                ("frames_read", "frames_with_face", "ms_per_frame", "realtime_factor")}
+    return out
+
+
+def roi_savings(stages):
+    """saved_ms_per_image on the ROI stages, detection cost included."""
+    import settings
+
+    detect = stages.get("roi.detect", {}).get("p50_ms")
+    if detect is None:
+        return
+    full_mesh = "face_mesh.refine" if settings.REFINE_LANDMARKS else "face_mesh.lite"
+    for roi_stage, full_stage in (("face_mesh.roi", full_mesh), ("reconstruction.roi", "reconstruction")):
+        full = stages.get(full_stage, {}).get("p50_ms")
+        if full is not None and "p50_ms" in stages.get(roi_stage, {}):
+            stages[roi_stage]["saved_ms_per_image"] = round(full - stages[roi_stage]["p50_ms"] - detect, 4)
+
+
+async def _run_requests(client, files, n_requests, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post("/api/upload", files=files)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            if r.status_code != 200:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n_requests)))
+    return latencies, errors, time.perf_counter() - t0
+
+
+def bench_e2e(samples, levels, n_requests):
+    try:
+        import httpx
+        import landmarks
+        landmarks.create_face_mesh().close()
+    except ImportError as e:
+        return {"e2e.upload": {"skipped": str(e)}}
+
+    import main
+
+    main.registry.warm_up()
+    main.reconstructor.start()
+    files = {view: (name, data, "image/png") for view, (name, data, _) in samples.items()}
+
+    async def run_all():
+        out = {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            await _run_requests(client, files, 2, 1)     # warm-up (thread-local FaceMesh etc.)
+            for c in levels:
+                latencies, errors, wall = await _run_requests(client, files, n_requests, c)
+                stats = summarize(latencies)
+                stats["requests_per_sec"] = round(n_requests / wall, 2)
+                stats["errors"] = errors
+                out[f"e2e.upload.c{c}"] = stats
+        return out
+
+    try:
+        return asyncio.run(run_all())
+    finally:
+        main.reconstructor.close()
+        main.pipeline_pool.shutdown(wait=False)
+        main.recon_pool.shutdown(wait=False)
+
+
+# =====================================================
+# 4. Regression check
+# =====================================================
+
+def compare(results, baseline, max_regression, noise_ms):
+    """Returns the stages whose p50 grew by more than max_regression (and noise_ms)."""
+    regressions = []
+    for name, stats in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or "p50_ms" not in base or "p50_ms" not in stats:
+            continue
+        delta = stats["p50_ms"] - base["p50_ms"]
+        if delta > noise_ms and stats["p50_ms"] > base["p50_ms"] * (1.0 + max_regression):
+            regressions.append({"stage": name, "baseline_p50_ms": base["p50_ms"], "p50_ms": stats["p50_ms"],
+                                "change": round(delta / base["p50_ms"], 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the nose analysis pipeline stage by stage.")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--images", default=SAMPLE_DIR, help="folder with front/right/left/basal images")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--concurrency", default="1,4,8", help="comma separated in-flight request counts")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--backends", default="eager", help="comma separated SCORER_BACKEND values")
+    parser.add_argument("--stub-3ddfa", action="store_true", help="use the stub even if 3DDFA_V2 is installed")
+    parser.add_argument("--stub-recon-ms", type=float, default=0.0, help="simulated time per stub fit")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the image cache on (repeat images hit it)")
+    parser.add_argument("--similar-cases", type=int, default=300000, help="case index size (0 skips)")
+    parser.add_argument("--video-seconds", type=float, default=10.0, help="length of the clip (0 skips)")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p50 slowdown (0.25 = 25%%)")
+    parser.add_argument("--noise-ms", type=float, default=0.05, help="ignore p50 changes smaller than this")
+    args = parser.parse_args(argv)
+
+    meta = configure(args)
+    sys.path.insert(0, BACKEND_DIR)
+    import settings
+    import torch
+
+    samples = load_samples(args.images)
+    stages = bench_face_mesh(samples, args.repeat)
+    stages.update(bench_features(args.repeat))
+    stages.update(bench_scoring(args.backends.split(","), args.repeat, settings.SCORER_THREADS))
+    stages.update(bench_batching([int(c) for c in args.concurrency.split(",")], args.requests, args.repeat))
+    roi_stages, boxes = bench_roi(samples, args.repeat)
+    stages.update(roi_stages)
+    stages.update(bench_reconstruction(samples, max(5, args.repeat // 5), boxes.get("front")))
+    roi_savings(stages)
+    stages.update(bench_similar(args.similar_cases, args.repeat))
+    stages.update(bench_video(samples, args.video_seconds))
+    if not args.skip_e2e:
+        stages.update(bench_e2e(samples, [int(c) for c in args.concurrency.split(",")], args.requests))
+
+    meta.update({
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": settings.CPU_COUNT,
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "scorer_threads": settings.SCORER_THREADS,
+        "pipeline_threads": settings.PIPELINE_THREADS,
+        "repeat": args.repeat,
+    })
+    results = {"meta": meta, "stages": stages}
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(results, json.load(f), args.max_regression, args.noise_ms)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for r in results.get("regressions", []):
+        print(f"REGRESSION {r['stage']}: p50 {r['baseline_p50_ms']} -> {r['p50_ms']} ms ({r['change']:+.0%})",
+              file=sys.stderr)
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Memory and throughput of serve.py against the number of web workers.
+
+    python bench_workers.py --workers 1,2,4 --requests 64 --concurrency 8
+    python bench_workers.py --workers 1,2,4 --no-preload     # every worker loads its own copy
+    python bench_workers.py --endpoint features --rows 16    # scoring only, no MediaPipe needed
+
+For every worker count serve.py is started on a free port (with the 3DDFA
+stub of bench.py when 3DDFA_V2 is not installed), every worker is waited for
+through /api/ready, and --requests requests are sent --concurrency at a time.
+Reported per worker count:
+  - per web worker, once idle and once after the load: rss_mb (shared pages
+    counted in every process), pss_mb (shared pages split between the
+    processes sharing them) and private_mb (what one more worker costs)
+  - the same summed over the 3DDFA processes
+  - requests_per_sec and the latency percentiles
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench import BACKEND_DIR, SAMPLE_DIR, configure, git_revision, load_samples, summarize
+
+SERVE_SCRIPT = os.path.join(BACKEND_DIR, "serve.py")
+
+
+# =====================================================
+# 1. Process memory (/proc)
+# =====================================================
+
+def child_pids(pid):
+    out = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            out.append(int(entry))
+    return sorted(out)
+
+
+def memory_mb(pid):
+    """{rss_mb, pss_mb, private_mb} of one process."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    private = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return {"rss_mb": round(values.get("Rss", 0) / 1024.0, 1), "pss_mb": round(values.get("Pss", 0) / 1024.0, 1),
+            "private_mb": round(private / 1024.0, 1)}
+
+
+def server_memory(server_pid):
+    """Memory of every web worker (children of serve.py) and of their 3DDFA processes."""
+    workers, tddfa = [], []
+    for pid in child_pids(server_pid):
+        try:
+            workers.append(memory_mb(pid))
+            tddfa += [memory_mb(child) for child in child_pids(pid)]
+        except OSError:
+            continue
+    out = {"master": memory_mb(server_pid)}
+    for name, procs in (("per_worker", workers), ("tddfa", tddfa)):
+        if procs:
+            out[name] = {key: round(float(np.mean([p[key] for p in procs])), 1) for key in procs[0]}
+            out[name]["processes"] = len(procs)
+    out["total_pss_mb"] = round(out["master"]["pss_mb"] + sum(p["pss_mb"] for p in workers + tddfa), 1)
+    return out
+
+
+# =====================================================
+# 2. Server lifecycle + load
+# =====================================================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, port, threads=None, preload=True):
+    cmd = [sys.executable, SERVE_SCRIPT, "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    if threads:
+        cmd += ["--threads", str(threads)]
+    if not preload:
+        cmd.append("--no-preload")
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR)
+
+
+def wait_ready(base_url, workers, timeout):
+    """Polls /api/ready on fresh connections until every worker has answered 200."""
+    import httpx
+
+    ready = set()
+    deadline = time.monotonic() + timeout
+    while len(ready) < workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"only {len(ready)} of {workers} workers became ready")
+        try:
+            with httpx.Client(base_url=base_url, timeout=5) as client:
+                r = client.get("/api/ready")
+            if r.status_code == 200:
+                ready.add(r.json()["pid"])
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+
+
+def request_factory(endpoint, samples, rows):
+    if endpoint == "upload":
+        files = {view: (name, data, "image/png") for view, (name, data, _) in samples.items()}
+        return lambda client: client.post("/api/upload", files=files)
+
+    from payloads import NPY_MEDIA_TYPE, to_npy
+
+    body = to_npy(np.random.default_rng(0).normal(size=(rows, 4, 42)).astype(np.float32))
+    return lambda client: client.post("/api/score/features", content=body, headers={"Content-Type": NPY_MEDIA_TYPE})
+
+
+def run_load(base_url, send, n_requests, concurrency):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(base_url=base_url, timeout=300, limits=limits) as client:
+        for _ in range(concurrency):
+            send(client)                # warm-up
+
+        def one(_):
+            t0 = time.perf_counter()
+            ok = send(client).status_code == 200
+            return (time.perf_counter() - t0) * 1000.0, ok
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(n_requests)))
+        wall = time.perf_counter() - t0
+
+    stats = summarize([ms for ms, _ in results])
+    stats["requests_per_sec"] = round(n_requests / wall, 2)
+    stats["errors"] = sum(not ok for _, ok in results)
+    return stats
+
+
+def bench_worker_count(workers, args, send):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = start_server(workers, port, args.threads, not args.no_preload)
+    try:
+        wait_ready(base_url, workers, args.startup_timeout)
+        out = {"memory_idle": server_memory(proc.pid)}
+        out["load"] = run_load(base_url, send, args.requests, args.concurrency)
+        out["memory_loaded"] = server_memory(proc.pid)
+        return out
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RSS per worker and throughput against the web worker count.")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated web worker counts")
+    parser.add_argument("--threads", type=int, help="THREAD_BUDGET passed to serve.py (default: all cores)")
+    parser.add_argument("--no-preload", action="store_true", help="load the models in every worker")
+    parser.add_argument("--endpoint", choices=("upload", "features"), default="upload")
+    parser.add_argument("--rows", type=int, default=1, help="cases per /api/score/features request")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--images", default=SAMPLE_DIR, help="folder with front/right/left/basal images")
+    parser.add_argument("--stub-3ddfa", action="store_true", help="use the stub even if 3DDFA_V2 is installed")
+    parser.add_argument("--stub-recon-ms", type=float, default=0.0, help="simulated time per stub fit")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the image cache on (repeat images hit it)")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    args = parser.parse_args(argv)
+
+    meta = configure(args)
+    os.environ["WARMUP_ON_STARTUP"] = "1"          # /api/ready only turns 200 after warm-up
+    sys.path.insert(0, BACKEND_DIR)
+
+    if args.endpoint == "upload":
+        try:
+            import mediapipe  # noqa: F401
+        except ImportError:
+            print("mediapipe is not installed, benchmarking --endpoint features instead", file=sys.stderr)
+            args.endpoint = "features"
+    send = request_factory(args.endpoint, load_samples(args.images), args.rows)
+
+    runs = {}
+    for n in [int(w) for w in args.workers.split(",")]:
+        runs[f"workers.{n}"] = bench_worker_count(n, args, send)
+
+    meta.update({
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": git_revision(),
+        "cpu_count": os.cpu_count(),
+        "thread_budget": args.threads or os.cpu_count(),
+        "preload": not args.no_preload,
+        "endpoint": args.endpoint,
+        "rows": args.rows if args.endpoint == "features" else None,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+    })
+    text = json.dumps({"meta": meta, "runs": runs}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Bulk offline scoring of front/right/left/basal image sets.
+
+    python bulk_score.py --input /data/archive --output scores.csv
+    python bulk_score.py --manifest cases.jsonl --output scores.parquet --workers 8
+
+Input is either a directory with one sub-folder per case (front.jpg,
+right.jpg, left.jpg, basal.jpg, any image extension) or a CSV / JSONL
+manifest with case_id,front,right,left,basal columns (relative paths are
+resolved against the manifest's folder).
+
+Decoding + landmarking run in a process pool with one FaceMesh per worker
+(plus a face detector with FACE_ROI=1, so the crops match the server's),
+features and scores are computed in batches (one fused forward pass per
+batch) and rows are streamed to CSV or Parquet.  Cases already scored in
+the output are skipped, so an interrupted run resumes where it stopped
+(use a new output path to rescore everything).  Cases whose row has an
+error are tried again; a later row for the same case_id supersedes it.
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import settings
+from geometry import NUM_LANDMARKS, features_from_landmarks
+from nose_models import INPUT_FEATURES, SCORE_NAMES, load_scorer
+from scoring import VIEW_ORDER
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# =====================================================
+# 1. Case sources (generators, nothing is loaded up front)
+# =====================================================
+
+def iter_directory(root):
+    for case_id in sorted(os.listdir(root)):
+        case_dir = os.path.join(root, case_id)
+        if not os.path.isdir(case_dir):
+            continue
+        paths = {}
+        for view in VIEW_ORDER:
+            matches = [p for p in glob.glob(os.path.join(case_dir, view + ".*")) if p.lower().endswith(IMAGE_EXTS)]
+            paths[view] = matches[0] if matches else None
+        yield case_id, paths
+
+
+def iter_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        return os.path.join(base, p) if p and not os.path.isabs(p) else p
+
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            yield str(row["case_id"]), {view: resolve(row.get(view)) for view in VIEW_ORDER}
+
+
+# =====================================================
+# 2. Process pool: decode + landmark (one FaceMesh per worker)
+# =====================================================
+
+_face_mesh = None
+_face_detector = None
+
+
+def init_worker(refine, roi=settings.FACE_ROI):
+    """roi: landmark a crop around the detected face, as the server does with FACE_ROI on."""
+    global _face_mesh, _face_detector
+    from landmarks import create_face_mesh
+    from roi import create_face_detector
+
+    cv2.setNumThreads(1)
+    _face_mesh = create_face_mesh(refine)
+    _face_detector = create_face_detector() if roi else None
+
+
+def landmark_case(task):
+    """(case_id, {view: path}, views) -> (case_id, (V, 15, 2) landmarks, error)"""
+    from roi import detect_face_box, landmarks_in_box
+
+    case_id, paths, views = task
+    landmarks = np.full((len(VIEW_ORDER), NUM_LANDMARKS, 2), np.nan)
+    try:
+        for v in views:
+            path = paths.get(VIEW_ORDER[v])
+            if not path:
+                raise ValueError(f"missing {VIEW_ORDER[v]} image")
+            img = cv2.imread(path)
+            if img is None:
+                raise ValueError(f"could not read {path}")
+            box = detect_face_box(img, _face_detector) if _face_detector is not None else None
+            landmarks[v] = landmarks_in_box(img, box, _face_mesh)
+    except Exception as e:
+        return case_id, None, str(e)
+    return case_id, landmarks, None
+
+
+# =====================================================
+# 3. Output writers (append-only, so they double as checkpoints)
+# =====================================================
+
+COLUMNS = ["case_id", "error"] + SCORE_NAMES
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._f = open(path, "a", newline="")
+        self._w = csv.writer(self._f)
+        if not exists:
+            self._w.writerow(COLUMNS)
+
+    def done_ids(self):
+        """Cases scored without an error (failed ones are tried again)."""
+        with open(self.path, newline="") as f:
+            return {row["case_id"] for row in csv.DictReader(f) if not row.get("error")}
+
+    def write(self, rows):
+        self._w.writerows([[r.get(c, "") for c in COLUMNS] for r in rows])
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class ParquetSink:
+    """A folder of part-NNNNN.parquet files, one per flushed batch."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow (pip install pyarrow), or write to a .csv file")
+        self.pa, self.pq = pa, pq
+        # fixed, so a batch of failed cases does not write its scores as null type
+        self.schema = pa.schema([("case_id", pa.string()), ("error", pa.string())]
+                                + [(name, pa.int64()) for name in SCORE_NAMES])
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._part = len(glob.glob(os.path.join(path, "part-*.parquet")))
+
+    def done_ids(self):
+        ids = set()
+        for part in glob.glob(os.path.join(self.path, "part-*.parquet")):
+            table = self.pq.read_table(part, columns=["case_id", "error"]).to_pydict()
+            ids.update(case_id for case_id, error in zip(table["case_id"], table["error"]) if not error)
+        return ids
+
+    def write(self, rows):
+        if not rows:
+            return
+        table = self.pa.Table.from_pylist([{c: r.get(c) for c in COLUMNS} for r in rows], schema=self.schema)
+        tmp = os.path.join(self.path, f".part-{self._part:05d}.tmp")
+        self.pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(self.path, f"part-{self._part:05d}.parquet"))
+        self._part += 1
+
+    def close(self):
+        pass
+
+
+def open_sink(path):
+    return ParquetSink(path) if path.endswith(".parquet") else CsvSink(path)
+
+
+# =====================================================
+# 4. Batched scoring
+# =====================================================
+
+def score_batch(scorer, batch):
+    """batch: list of (case_id, landmarks or None, error) -> output rows"""
+    ok = [(case_id, lms) for case_id, lms, err in batch if err is None]
+    rows = [{"case_id": case_id, "error": err} for case_id, _, err in batch if err is not None]
+    if not ok:
+        return rows
+
+    landmarks = np.stack([lms for _, lms in ok])                    # (B, V, 15, 2)
+    b, v = landmarks.shape[:2]
+    features = np.zeros((b, v, INPUT_FEATURES), dtype=np.float32)
+    views = scorer.views_used
+    features[:, views] = features_from_landmarks(
+        landmarks[:, views].reshape(-1, NUM_LANDMARKS, 2)
+    ).reshape(b, len(views), INPUT_FEATURES)
+
+    scores = scorer.predict(features)
+    for (case_id, _), s in zip(ok, scores):
+        row = {"case_id": case_id, "error": ""}
+        row.update(zip(SCORE_NAMES, (int(x) for x in s)))
+        rows.append(row)
+    return rows
+
+
+def scored(rows):
+    """Rows that were landmarked and scored (failed cases only have an error)."""
+    return sum(1 for r in rows if not r["error"])
+
+
+def run(cases, output, model_dir, workers, batch_size, refine=settings.REFINE_LANDMARKS, roi=settings.FACE_ROI):
+    scorer = load_scorer(model_dir)
+    sink = open_sink(output)
+    done = sink.done_ids()
+    if done:
+        print(f"resuming: {len(done)} cases already scored", file=sys.stderr)
+
+    views = list(scorer.views_used)
+    tasks = ((case_id, paths, views) for case_id, paths in cases if case_id not in done)
+
+    n_cases = n_images = 0
+    t0 = last = time.perf_counter()
+    batch = []
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(workers, initializer=init_worker, initargs=(refine, roi)) as pool:
+        for result in pool.imap(landmark_case, tasks, chunksize=4):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                rows = score_batch(scorer, batch)
+                sink.write(rows)
+                n_cases += len(batch)
+                n_images += scored(rows) * len(views)
+                batch = []
+
+                now = time.perf_counter()
+                if now - last > 5:
+                    print(f"{n_cases} cases, {n_images / (now - t0):.1f} images/sec", file=sys.stderr)
+                    last = now
+
+        if batch:
+            rows = score_batch(scorer, batch)
+            sink.write(rows)
+            n_cases += len(batch)
+            n_images += scored(rows) * len(views)
+    sink.close()
+
+    elapsed = time.perf_counter() - t0
+    rate = n_images / elapsed if elapsed > 0 else 0.0
+    print(f"done: {n_cases} cases, {n_images} images in {elapsed:.1f}s ({rate:.1f} images/sec)", file=sys.stderr)
+    return {"cases": n_cases, "images": n_images, "seconds": elapsed, "images_per_sec": rate}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score archived nose image sets in bulk.")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--input", help="folder with one sub-folder per case")
+    src.add_argument("--manifest", help="CSV or JSONL manifest (case_id,front,right,left,basal)")
+    parser.add_argument("--output", required=True, help=".csv file or .parquet folder")
+    parser.add_argument("--model-dir", default=settings.MODEL_DIR)
+    parser.add_argument("--workers", type=int, default=settings.CPU_COUNT)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--no-refine", action="store_true", help="FaceMesh without iris/lip/eye refinement (faster)")
+    args = parser.parse_args(argv)
+
+    cases = iter_directory(args.input) if args.input else iter_manifest(args.manifest)
+    run(cases, args.output, args.model_dir, args.workers, args.batch_size,
+        refine=settings.REFINE_LANDMARKS and not args.no_refine)
+
+
+if __name__ == "__main__":
+    main()
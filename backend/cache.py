@@ -0,0 +1,187 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# =====================================================
+# Content-addressed cache for per-image results
+# =====================================================
+#
+# Entries are keyed by a hash of the uploaded bytes and hold whatever has been
+# computed for that image so far (landmarks, 42-feature vector, mesh name...).
+#   - tier 1: in-memory LRU with a fixed number of entries
+#   - tier 2: optional on-disk pickles, evicted oldest-first past a size cap
+# Disk reads and writes happen outside the cache lock (one writer per key at a
+# time), so a slow disk never blocks lookups of other images.  Every lookup
+# counts as one hit or one miss of the field asked for.  The disk tier may be shared by several
+# serve.py workers: its size is re-read from the directory at least every
+# DISK_SCAN_SECONDS and before anything is evicted.
+
+DISK_SCAN_SECONDS = 5.0
+
+
+def content_key(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ContentCache:
+    def __init__(self, max_entries=512, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._write_locks = [threading.Lock() for _ in range(64)]     # striped by key
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "memory_evictions": 0, "disk_evictions": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_scan()
+
+    # -----------------------------
+    # memory tier
+    # -----------------------------
+    def _mem_put(self, key, entry):
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    # -----------------------------
+    # disk tier
+    # -----------------------------
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".pkl")
+
+    def _disk_files(self):
+        return [os.path.join(self.disk_dir, f) for f in os.listdir(self.disk_dir) if f.endswith(".pkl")]
+
+    def _disk_scan(self):
+        """Re-reads the tier's size (other processes write to it too).  Call with _disk_lock held."""
+        total = 0
+        for path in self._disk_files():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        self._disk_bytes = total
+        self._last_scan = time.monotonic()
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)      # keep recently used entries away from eviction
+        except OSError:         # evicted by another worker meanwhile
+            pass
+        return entry
+
+    def _disk_put(self, key, entry):
+        """Writes key's entry, outside the cache lock; writes of one key are serialized."""
+        with self._write_locks[hash(key) % len(self._write_locks)]:
+            # a later update may have landed while we waited: write the newest entry
+            with self._lock:
+                entry = self._mem.get(key, entry)
+            path = self._disk_path(key)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+
+        with self._disk_lock:
+            self._disk_bytes += size - old_size
+            if self._disk_bytes > self.disk_max_bytes or time.monotonic() - self._last_scan > DISK_SCAN_SECONDS:
+                self._disk_scan()
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_evict(self):
+        files = []
+        for path in self._disk_files():
+            try:
+                st = os.stat(path)
+            except OSError:         # removed by another worker meanwhile
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        for _, size, path in sorted(files):
+            if self._disk_bytes <= self.disk_max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            with self._lock:
+                self.counters["disk_evictions"] += 1
+
+    # -----------------------------
+    # public API
+    # -----------------------------
+    def _count(self, tier, entry, field):
+        """One hit of tier, or one miss when entry lacks field.  Call with _lock held."""
+        if entry is None or (field is not None and field not in entry):
+            self.counters["misses"] += 1
+        else:
+            self.counters[tier] += 1
+
+    def get(self, key, field=None):
+        """
+        Returns the entry dict for key, or None.  With field, only an entry
+        holding that field counts as a hit (the caller still gets the entry).
+        """
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None or not self.disk_dir:
+                if entry is not None:
+                    self._mem.move_to_end(key)
+                self._count("memory_hits", entry, field)
+                return entry
+
+        loaded = self._disk_get(key)
+        with self._lock:
+            entry = self._mem.get(key)      # an update may have landed while we read
+            if entry is None and loaded is not None:
+                entry = loaded
+                self._mem_put(key, entry)
+            self._count("disk_hits", entry, field)
+            return entry
+
+    def update(self, key, **fields):
+        """Merges fields into the entry for key (creating it if needed)."""
+        loaded = None
+        if self.disk_dir:
+            with self._lock:
+                cached = key in self._mem
+            if not cached:
+                loaded = self._disk_get(key)
+        with self._lock:
+            entry = self._mem.get(key, loaded)
+            entry = dict(entry or {})
+            entry.update(fields)
+            self._mem_put(key, entry)
+        if self.disk_dir:
+            self._disk_put(key, entry)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out["memory_entries"] = len(self._mem)
+            if self.disk_dir:
+                out["disk_bytes"] = self._disk_bytes        # as of the last write or scan
+            lookups = out["memory_hits"] + out["disk_hits"] + out["misses"]
+            out["hit_rate"] = round((out["memory_hits"] + out["disk_hits"]) / lookups, 4) if lookups else 0.0
+            return out
@@ -0,0 +1,332 @@
+"""
+Similar-case index over the scaled nasal feature vectors of every analysis.
+
+    python case_index.py stats
+    python case_index.py build-ivf --nlist 1024      # approximate index for large stores
+
+Every analysis appends one row per analyzed face to an append-only store in
+CASE_INDEX_DIR:
+  vectors.f32   (N, D) float32: the scaler-normalized 42 features of each of
+                INDEX_VIEWS side by side, read through np.memmap
+  cases.jsonl   one line per row: case id (= job id), kind, scores, outcome
+Rows are never rewritten.  A row counts once both files have it; a crash
+between the two writes is cut off by the next append.  Appends hold an flock
+and readers pick up rows added by other processes, so the serve.py workers
+share one store.
+
+search() is exact by default: squared L2 distances |q|^2 - 2 q.x + |x|^2 as
+matrix products over CHUNK_ROWS rows at a time, keeping a running top-k.  For
+large stores build_ivf() clusters the rows (k-means, about sqrt(N) lists);
+the approximate search then only scans the nprobe closest lists plus the rows
+appended since the build.
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import settings
+from nose_models import INPUT_FEATURES, MODEL_VIEWS
+from scoring import VIEW_ORDER
+
+# views the classifiers use (front, basal): the other photos never get features
+INDEX_VIEWS = [v for v in VIEW_ORDER if v in MODEL_VIEWS]
+DIMENSIONS = len(INDEX_VIEWS) * INPUT_FEATURES
+ROW_BYTES = DIMENSIONS * 4
+CHUNK_ROWS = 65536
+
+
+def case_vectors(features, scaler_mean, scaler_scale):
+    """
+    (N, 4, 42) raw features in VIEW_ORDER -> (N, D) index vectors.  Features
+    that could not be measured (NaN) are put at the population mean (0).
+    """
+    features = np.asarray(features, dtype=np.float32)[:, [VIEW_ORDER.index(v) for v in INDEX_VIEWS]]
+    scaled = (features - np.asarray(scaler_mean, dtype=np.float32)) / np.asarray(scaler_scale, dtype=np.float32)
+    return np.nan_to_num(scaled, nan=0.0, posinf=0.0, neginf=0.0).reshape(len(features), DIMENSIONS)
+
+
+# =====================================================
+# Exact top-k kernels
+# =====================================================
+
+def _merge_top_k(best_d, best_i, d, rows, k):
+    """Running top-k: (Q, k) best so far + (Q, n) new candidates -> (Q, k)."""
+    all_d = np.concatenate([best_d, d], axis=1)
+    all_i = np.concatenate([best_i, np.broadcast_to(rows, d.shape)], axis=1)
+    if all_d.shape[1] > k:
+        part = np.argpartition(all_d, k - 1, axis=1)[:, :k]
+        all_d = np.take_along_axis(all_d, part, axis=1)
+        all_i = np.take_along_axis(all_i, part, axis=1)
+    return all_d, all_i
+
+
+def _distances(queries, query_norms, block, block_norms):
+    return np.maximum(query_norms[:, None] - 2.0 * (queries @ block.T) + block_norms[None, :], 0.0)
+
+
+def _sorted_top_k(best_d, best_i):
+    order = np.argsort(best_d, axis=1, kind="stable")
+    return np.take_along_axis(best_d, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+
+def kmeans(x, n_clusters, iters=10, seed=0):
+    """Plain Lloyd's k-means on (n, D) float32, returns (n_clusters, D) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)].copy()
+    x_norms = np.einsum("ij,ij->i", x, x)
+    for _ in range(iters):
+        labels = np.empty(len(x), dtype=np.int64)
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        for start in range(0, len(x), CHUNK_ROWS):
+            stop = start + CHUNK_ROWS
+            labels[start:stop] = _distances(x[start:stop], x_norms[start:stop], centroids, c_norms).argmin(axis=1)
+        counts = np.bincount(labels, minlength=n_clusters)
+        for j in range(x.shape[1]):
+            centroids[:, j] = np.bincount(labels, weights=x[:, j], minlength=n_clusters)
+        filled = counts > 0
+        centroids[filled] /= counts[filled, None]
+        # empty clusters restart from random points
+        centroids[~filled] = x[rng.choice(len(x), int((~filled).sum()), replace=False)]
+    return centroids
+
+
+# =====================================================
+# The store
+# =====================================================
+
+class CaseIndex:
+    def __init__(self, root=settings.CASE_INDEX_DIR):
+        self.root = root
+        self.vectors_path = os.path.join(root, "vectors.f32")
+        self.cases_path = os.path.join(root, "cases.jsonl")
+        self.ivf_path = os.path.join(root, "ivf.npz")
+
+        self._lock = threading.Lock()
+        self._cases = []                # one dict per complete line of cases.jsonl
+        self._cases_offset = 0          # bytes of cases.jsonl already parsed
+        self._rows_of = {}              # case id -> its rows
+        self._vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._ivf = None
+        self._ivf_mtime = None
+
+    # -----------------------------
+    # reading
+    # -----------------------------
+    def _refresh(self):
+        """Picks up rows appended since the last call (by any process).  Needs self._lock."""
+        if not os.path.exists(self.cases_path):
+            return
+        with open(self.cases_path, "rb") as f:
+            f.seek(self._cases_offset)
+            chunk = f.read()
+        complete = chunk.rfind(b"\n") + 1
+        for line in chunk[:complete].splitlines():
+            if line.strip():
+                case = json.loads(line)
+                self._rows_of.setdefault(case["case_id"], []).append(len(self._cases))
+                self._cases.append(case)
+        self._cases_offset += complete
+
+        on_disk = os.path.getsize(self.vectors_path) // ROW_BYTES if os.path.exists(self.vectors_path) else 0
+        n = min(len(self._cases), on_disk)
+        if n > len(self._vectors):
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, DIMENSIONS))
+            new = vectors[len(self._norms):]
+            self._norms = np.concatenate([self._norms, np.einsum("ij,ij->i", new, new)])
+            self._vectors = vectors
+
+    def _snapshot(self):
+        with self._lock:
+            self._refresh()
+            return self._vectors, self._norms
+
+    def __len__(self):
+        return len(self._snapshot()[0])
+
+    def case(self, row):
+        return self._cases[row]
+
+    def rows(self, case_id):
+        with self._lock:
+            self._refresh()
+            return [r for r in self._rows_of.get(case_id, []) if r < len(self._vectors)]
+
+    def vectors(self, rows):
+        return np.asarray(self._snapshot()[0][rows])
+
+    # -----------------------------
+    # appending
+    # -----------------------------
+    @contextmanager
+    def _exclusive(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def add(self, cases, vectors):
+        """
+        cases   : list of dicts with at least "case_id"
+        vectors : matching (N, D) rows (case_vectors)
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(cases), DIMENSIONS)
+        with self._lock, self._exclusive():
+            self._refresh()
+            n = len(self._cases)
+            # cut off a half-written append (vectors without their lines, a partial line)
+            for path, size in ((self.vectors_path, n * ROW_BYTES), (self.cases_path, self._cases_offset)):
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    os.truncate(path, size)
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            now = time.time()
+            lines = "".join(json.dumps(dict(case, created_at=case.get("created_at", now))) + "\n" for case in cases)
+            with open(self.cases_path, "ab") as f:
+                f.write(lines.encode())
+            self._refresh()
+        return list(range(n, n + len(cases)))
+
+    # -----------------------------
+    # search
+    # -----------------------------
+    def _current_ivf(self):
+        try:
+            mtime = os.stat(self.ivf_path).st_mtime_ns
+        except FileNotFoundError:
+            self._ivf = self._ivf_mtime = None
+            return None
+        if mtime != self._ivf_mtime:
+            with np.load(self.ivf_path) as data:
+                self._ivf = {name: data[name] for name in data.files}
+            self._ivf_mtime = mtime
+        return self._ivf
+
+    def search(self, queries, k=10, exclude=None, approximate=None, nprobe=settings.SIMILAR_NPROBE):
+        """
+        queries     : (Q, D) vectors
+        exclude     : per query, rows that must not be returned (the case itself)
+        approximate : True / False, None = use the IVF index once the store
+                      has SIMILAR_IVF_MIN_CASES rows and one has been built
+        Returns (distances, rows), both (Q, k) sorted nearest first (k capped
+        at the store size); distances are RMS differences per feature, in
+        standard deviations, and inf where fewer than k rows qualified.
+        """
+        vectors, norms = self._snapshot()
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, DIMENSIONS)
+        exclude = exclude or [()] * len(queries)
+        k = min(k, len(vectors))
+        if k == 0:
+            return np.zeros((len(queries), 0)), np.zeros((len(queries), 0), dtype=np.int64)
+
+        ivf = self._current_ivf()
+        if approximate is None:
+            approximate = len(vectors) >= settings.SIMILAR_IVF_MIN_CASES
+        if approximate and ivf is not None:
+            best_d, best_i = self._search_ivf(queries, vectors, norms, k, exclude, ivf, nprobe)
+        else:
+            best_d, best_i = self._search_exact(queries, vectors, norms, k, exclude)
+
+        best_d, best_i = _sorted_top_k(best_d, best_i)
+        return np.sqrt(best_d / DIMENSIONS), best_i
+
+    def _search_exact(self, queries, vectors, norms, k, exclude):
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        best_d = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_i = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, len(vectors))
+            d = _distances(queries, q_norms, vectors[start:stop], norms[start:stop])
+            for q, rows in enumerate(exclude):
+                rows = [r - start for r in rows if start <= r < stop]
+                d[q, rows] = np.inf
+            best_d, best_i = _merge_top_k(best_d, best_i, d, np.arange(start, stop), k)
+        return best_d, best_i
+
+    def _search_ivf(self, queries, vectors, norms, k, exclude, ivf, nprobe):
+        centroids, order, offsets = ivf["centroids"], ivf["order"], ivf["offsets"]
+        tail = np.arange(min(int(ivf["rows"]), len(vectors)), len(vectors))
+        probes = np.argsort(_distances(queries, np.einsum("ij,ij->i", queries, queries), centroids,
+                                       np.einsum("ij,ij->i", centroids, centroids)), axis=1)[:, :nprobe]
+
+        best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_i = np.zeros((len(queries), k), dtype=np.int64)
+        for q in range(len(queries)):
+            # rows of the probed lists, sorted for a forward pass over the memmap
+            rows = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes[q]] + [tail]))
+            rows = rows[rows < len(vectors)]
+            if exclude[q]:
+                rows = rows[~np.isin(rows, list(exclude[q]))]
+            d = _distances(queries[q:q + 1], np.einsum("ij,ij->i", queries[q:q + 1], queries[q:q + 1]),
+                           vectors[rows], norms[rows])
+            d_q, i_q = _merge_top_k(best_d[q:q + 1, :0], best_i[q:q + 1, :0], d, rows, k)
+            best_d[q, :d_q.shape[1]], best_i[q, :i_q.shape[1]] = d_q[0], i_q[0]
+        return best_d, best_i
+
+    def build_ivf(self, nlist=None, iters=10, sample=None, seed=0):
+        """Clusters the current rows into nlist lists and saves ivf.npz (atomically)."""
+        vectors, norms = self._snapshot()
+        n = len(vectors)
+        nlist = min(n, nlist or max(1, int(round(np.sqrt(n)))))
+        rng = np.random.default_rng(seed)
+        sample = min(n, sample or max(nlist * 64, 50000))
+        training = np.asarray(vectors[np.sort(rng.choice(n, sample, replace=False))])
+        centroids = kmeans(training, nlist, iters, seed)
+
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        labels = np.empty(n, dtype=np.int64)
+        for start in range(0, n, CHUNK_ROWS):
+            stop = start + CHUNK_ROWS
+            labels[start:stop] = _distances(vectors[start:stop], norms[start:stop], centroids, c_norms).argmin(axis=1)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(nlist + 1))
+
+        tmp = self.ivf_path + ".tmp.npz"
+        np.savez(tmp, centroids=centroids, order=order.astype(np.int64), offsets=offsets.astype(np.int64),
+                 rows=np.int64(n))
+        os.replace(tmp, self.ivf_path)
+        return {"rows": n, "nlist": nlist, "sample": sample}
+
+    def stats(self):
+        vectors, _ = self._snapshot()
+        ivf = self._current_ivf()
+        return {
+            "cases": len(vectors),
+            "dimensions": DIMENSIONS,
+            "views": INDEX_VIEWS,
+            "bytes": len(vectors) * ROW_BYTES,
+            "ivf": None if ivf is None else {"nlist": len(ivf["centroids"]), "rows": int(ivf["rows"]),
+                                             "unindexed_rows": max(0, len(vectors) - int(ivf["rows"]))},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect / index the similar-case store.")
+    parser.add_argument("command", choices=("stats", "build-ivf"))
+    parser.add_argument("--dir", default=settings.CASE_INDEX_DIR)
+    parser.add_argument("--nlist", type=int, help="number of lists (default: sqrt of the row count)")
+    parser.add_argument("--iters", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    index = CaseIndex(args.dir)
+    if args.command == "build-ivf":
+        t0 = time.perf_counter()
+        built = index.build_ivf(args.nlist, args.iters)
+        built["seconds"] = round(time.perf_counter() - t0, 2)
+        print(json.dumps(built))
+    else:
+        print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
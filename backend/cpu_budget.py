@@ -0,0 +1,52 @@
+import os
+
+import settings
+
+# =====================================================
+# CPU thread budget of one web worker
+# =====================================================
+#
+# Left alone, torch, OpenCV, the BLAS behind numpy and ONNX Runtime each start
+# one thread per core in every process, so N web workers (plus their 3DDFA
+# processes) stack N * (4 + TDDFA_WORKERS) pools on the same cores.  Every
+# pool is sized from this worker's share of THREAD_BUDGET instead:
+#   - torch intra-op        SCORER_THREADS (the MLPs are tiny)
+#   - OpenCV                OPENCV_THREADS
+#   - MediaPipe             FACE_MESH_POOL_SIZE graphs, one caller each at a time
+#   - 3DDFA_V2              TDDFA_WORKERS processes x TDDFA_THREADS ONNX threads
+# PIPELINE_THREADS (detection, landmarking) and the TDDFA_WORKERS reconstruction
+# threads only fan work out to those, they mostly wait.
+
+NATIVE_THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def limit_native_threads():
+    """Caps the OpenMP / BLAS pools.  Only works before numpy and torch are imported."""
+    for name in NATIVE_THREAD_ENV:
+        os.environ.setdefault(name, str(settings.SCORER_THREADS))
+
+
+def apply_thread_budget():
+    import cv2
+    import torch
+
+    cv2.setNumThreads(settings.OPENCV_THREADS)
+    torch.set_num_threads(settings.SCORER_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass        # can only be set once, before any inter-op work
+
+
+def thread_budget():
+    """How this worker's share of the cores is split, for /api/ready."""
+    return {
+        "budget": settings.THREAD_BUDGET,
+        "web_workers": settings.WEB_WORKERS,
+        "worker_cpus": settings.WORKER_CPUS,
+        "torch_intra_op": settings.SCORER_THREADS,
+        "opencv": settings.OPENCV_THREADS,
+        "face_mesh_pool": settings.FACE_MESH_POOL_SIZE,
+        "pipeline": settings.PIPELINE_THREADS,
+        "reconstruction": {"workers": settings.TDDFA_WORKERS, "threads_each": settings.TDDFA_THREADS},
+    }
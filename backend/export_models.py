@@ -0,0 +1,160 @@
+"""
+Export the fused nose scorer for the TorchScript / ONNX Runtime backends.
+
+    python export_models.py                       # write nose_scorer.ts.pt + nose_scorer.onnx
+    python export_models.py --quantize            # also nose_scorer.int8.onnx (dynamic int8)
+    python export_models.py --check               # only compare existing exports to eager
+
+The three classifiers (front, lateral, basal) and the scaler are exported as
+one graph: raw (N, V, 42) features in, (N, 12, 4) logits out.  Every export
+is compared against the eager FusedNoseScorer afterwards; the fp32 exports
+must match to within --atol and give identical scores, the int8 model only
+reports how far its scores drift (see SCORER_BACKEND in settings.py).
+
+Without labelled data the check runs on features sampled around the scaler
+mean; pass --eval-features / --eval-labels (.npy, (N, V, 42) and (N, 12) in
+1-4) to report real per-task accuracy instead.
+"""
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+import torch
+
+import settings
+from nose_models import EXPORT_FILES, SCORE_NAMES, load_exported_scorer, load_scorer
+from scoring import VIEW_ORDER
+
+
+# =====================================================
+# 1. Export
+# =====================================================
+
+def example_input(scorer, n=8):
+    return scorer.scaler_mean.float().expand(n, len(VIEW_ORDER), -1).contiguous()
+
+
+def export_torchscript(scorer, path):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced = torch.jit.trace(scorer, example_input(scorer))
+    traced.save(path)
+
+
+def export_onnx(scorer, path):
+    import onnx
+
+    torch.onnx.export(
+        scorer, example_input(scorer), path,
+        input_names=["features"], output_names=["logits"],
+        dynamic_axes={"features": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17, dynamo=False,
+    )
+    set_views_used(path, scorer.views_used)
+    onnx.checker.check_model(path)
+
+
+def quantize_onnx(src, dst, views_used):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    set_views_used(dst, views_used)
+
+
+def set_views_used(path, views_used):
+    """OnnxScorer reads the consumed view indices back from the model metadata."""
+    import onnx
+
+    model = onnx.load(path)
+    del model.metadata_props[:]
+    model.metadata_props.add(key="views_used", value=",".join(str(v) for v in views_used))
+    onnx.save(model, path)
+
+
+# =====================================================
+# 2. Parity / accuracy check
+# =====================================================
+
+def sample_features(scorer, n, seed=0):
+    rng = np.random.default_rng(seed)
+    mean = scorer.scaler_mean.numpy()
+    scale = scorer.scaler_scale.numpy()
+    return (mean + rng.standard_normal((n, len(VIEW_ORDER), mean.size)) * scale).astype(np.float32)
+
+
+def check(eager, model_dir, backends, features, labels=None, atol=1e-4, threads=1):
+    """Prints one line per backend, returns False if an fp32 export diverges."""
+    with torch.no_grad():
+        ref_logits = eager(torch.from_numpy(features)).numpy()
+    ref = ref_logits.argmax(axis=2) + 1
+    target = labels if labels is not None else ref
+    ref_acc = (ref == target).mean(axis=0)
+
+    ok = True
+    for backend in backends:
+        scorer = load_exported_scorer(backend, model_dir, threads)
+        scores = scorer.predict(features)
+        agree = (scores == ref).mean()
+
+        if backend == "torchscript":
+            with torch.no_grad():
+                logits = scorer.module(torch.from_numpy(features)).numpy()
+        else:
+            logits = scorer.session.run(None, {"features": features})[0]
+        max_diff = float(np.abs(logits - ref_logits).max())
+
+        line = f"{backend:12s} max|dlogit|={max_diff:.2e}  score agreement={agree:.4f}"
+        if backend == "onnx-int8":
+            delta = (scores == target).mean(axis=0) - ref_acc
+            kind = "accuracy" if labels is not None else "agreement"
+            line += f"  mean {kind} delta={delta.mean():+.4f}  worst={SCORE_NAMES[delta.argmin()]} ({delta.min():+.4f})"
+        elif max_diff > atol or agree < 1.0:
+            ok = False
+            line += "  MISMATCH"
+        print(line)
+
+    if labels is not None:
+        print(f"eager accuracy per task: {np.round(ref_acc, 4).tolist()}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the fused nose scorer to TorchScript / ONNX.")
+    parser.add_argument("--model-dir", default=settings.MODEL_DIR)
+    parser.add_argument("--quantize", action="store_true", help="also write a dynamic int8 ONNX model")
+    parser.add_argument("--check", action="store_true", help="skip exporting, only check existing files")
+    parser.add_argument("--samples", type=int, default=4096)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--threads", type=int, default=settings.SCORER_THREADS)
+    parser.add_argument("--eval-features", help=".npy of raw (N, V, 42) features")
+    parser.add_argument("--eval-labels", help=".npy of (N, 12) scores in 1-4")
+    args = parser.parse_args(argv)
+
+    eager = load_scorer(args.model_dir)
+    path = {name: os.path.join(args.model_dir, f) for name, f in EXPORT_FILES.items()}
+
+    if not args.check:
+        export_torchscript(eager, path["torchscript"])
+        export_onnx(eager, path["onnx"])
+        written = ["torchscript", "onnx"]
+        if args.quantize:
+            quantize_onnx(path["onnx"], path["onnx-int8"], eager.views_used)
+            written.append("onnx-int8")
+        for name in written:
+            print(f"wrote {path[name]}", file=sys.stderr)
+
+    if args.eval_features:
+        features = np.load(args.eval_features).astype(np.float32)
+        labels = np.load(args.eval_labels) if args.eval_labels else None
+    else:
+        features, labels = sample_features(eager, args.samples), None
+
+    backends = [name for name, p in path.items() if os.path.exists(p)]
+    if not check(eager, args.model_dir, backends, features, labels, args.atol, args.threads):
+        sys.exit("exported scorer does not match the eager models")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import numpy as np
+
+# =====================================================
+# Vectorized nasal geometry kernel (landmarks -> 42 features)
+# =====================================================
+#
+# The 15 landmarks of an image are held as one (15, 2) pixel array (NaN rows
+# for landmarks that were not found) and any number of images as (B, 15, 2).
+# Every distance / angle the 42 features need is listed once in an index
+# table, so the whole vector is a handful of batched NumPy expressions.
+#
+# Missing landmarks follow the original per-feature rules:
+#   - the 30 handcrafted distance/angle/ratio/symmetry features become 0.0
+#   - the 12 classic features become NaN
+
+# ---------------------------
+# Landmark Mapping
+# ---------------------------
+landmarks_to_index = {
+    1: 168, 2: 4, 3: 94, 4: 115, 5: 279, 6: 59, 7: 439,
+    8: 60, 9: 290, 10: 0, 11: 9, 12: 362, 13: 133, 14: 454, 15: 234
+}
+
+labelnum_to_name = {
+    1: "N", 2: "Prn", 3: "Sn", 4: "Al_R", 5: "Al_L", 6: "Ac_R", 7: "Ac_L",
+    8: "Sbal_R", 9: "Sbal_L", 10: "Ls", 11: "G", 12: "En_R", 13: "En_L",
+    14: "Tr_R", 15: "Tr_L"
+}
+
+LANDMARK_NAMES = [labelnum_to_name[num] for num in sorted(labelnum_to_name)]
+NUM_LANDMARKS = len(LANDMARK_NAMES)
+
+# the two derived midpoints are appended after the 15 landmarks
+POINT_NAMES = LANDMARK_NAMES + ["Sbal_mid", "N_Prn_mid"]
+_P = {name: i for i, name in enumerate(POINT_NAMES)}
+
+# ---------------------------
+# Feature tables (in feature vector order)
+# ---------------------------
+
+# === 1. Distances (10 features) ===
+DISTANCES = [
+    ("N", "Prn"), ("Prn", "Sn"), ("Al_L", "Al_R"), ("Ac_L", "Prn"), ("Ac_R", "Prn"),
+    ("Sbal_L", "Sbal_R"), ("G", "N"), ("G", "Prn"), ("N", "Sn"), ("Prn", "Ls"),
+]
+
+# === 2. Angles at the middle point (8 features) ===
+ANGLES = [
+    ("G", "N", "Prn"), ("N", "Prn", "Sn"), ("Al_L", "Prn", "Al_R"), ("Ac_L", "Prn", "Ac_R"),
+    ("Sbal_L", "Sn", "Sbal_R"), ("G", "Prn", "Sn"), ("G", "Sn", "Prn"), ("N", "Sn", "Prn"),
+]
+
+# === 3. Ratios, numerator / (denominator + 1e-6) (6 features) ===
+RATIOS = [
+    (("N", "Prn"), ("N", "Sn")),
+    (("Prn", "Sn"), ("Al_L", "Al_R")),
+    (("G", "Prn"), ("G", "Sn")),
+    (("G", "N"), ("G", "Sn")),
+    (("Sbal_L", "Sbal_R"), ("Al_L", "Al_R")),
+    (("Ac_L", "Ac_R"), ("Al_L", "Al_R")),
+]
+
+# === 4. Symmetry |d(a, center) - d(b, center)| (6 features) ===
+SYMMETRY = [
+    ("Al_L", "Al_R", "N"), ("Ac_L", "Ac_R", "Prn"), ("Sbal_L", "Sbal_R", "Sn"),
+    ("En_L", "En_R", "G"), ("Tr_L", "Tr_R", "N_Prn_mid"), ("Ac_L", "Ac_R", "Sn"),
+]
+
+# === 5. The 12 classic features ===
+# ("angle", (a, b, c, d)) -> angle between (a - b) and (c - d)
+# ("dist", (a, b))        -> distance
+# ("ratio", (p, q))       -> dist(p) / dist(q), NaN when dist(q) == 0
+CLASSIC = [
+    ("Nasofrontal_angle_deg", "angle", ("G", "N", "Prn", "N")),
+    ("Dorsal_angle_deg", "angle", ("G", "N", "Prn", "N")),
+    ("Nasal_dorsum_angle_deg", "angle", ("N", "Prn", "Sn", "Prn")),
+    ("Nasolabial_angle_deg", "angle", ("Sn", "Ls", "Sbal_mid", "Sn")),
+    ("Columellar_angle_deg", "angle", ("Sn", "Prn", "Sbal_mid", "Sn")),
+    ("Nasal_tip_angle_deg", "angle", ("Ac_L", "Prn", "Ac_R", "Prn")),
+    ("Interalar_angle_deg", "angle", ("Ac_L", "Prn", "Ac_R", "Prn")),
+    ("Alar_base_width_px", "dist", ("Al_L", "Al_R")),
+    ("Nasal_width_index", "ratio", (("Al_L", "Al_R"), ("N", "Sn"))),
+    ("Nasal_height_ratio", "ratio", (("G", "Sn"), ("Al_L", "Al_R"))),
+    ("Projection_ratio", "ratio", (("N", "Prn"), ("N", "Sn"))),
+    ("Tip_projection_index", "ratio", (("Prn", "Sn"), ("Al_L", "Al_R"))),
+]
+
+CLASSIC_NAMES = [name for name, _, _ in CLASSIC]
+NUM_FEATURES = len(DISTANCES) + len(ANGLES) + len(RATIOS) + len(SYMMETRY) + len(CLASSIC)
+
+
+# ---------------------------
+# Index tables: every distinct distance / angle is computed exactly once
+# ---------------------------
+def _build_tables():
+    pairs, quads = [], []
+
+    def pair(a, b):
+        key = tuple(sorted((_P[a], _P[b])))
+        if key not in pairs:
+            pairs.append(key)
+        return pairs.index(key)
+
+    def quad(a, b, c, d):
+        key = (_P[a], _P[b], _P[c], _P[d])
+        if key not in quads:
+            quads.append(key)
+        return quads.index(key)
+
+    t = {
+        "dist": [pair(a, b) for a, b in DISTANCES],
+        "angle": [quad(a, b, c, b) for a, b, c in ANGLES],
+        "angle_pts": [[_P[a], _P[b], _P[c]] for a, b, c in ANGLES],
+        "ratio_num": [pair(*num) for num, _ in RATIOS],
+        "ratio_den": [pair(*den) for _, den in RATIOS],
+        "sym_a": [pair(a, c) for a, _, c in SYMMETRY],
+        "sym_b": [pair(b, c) for _, b, c in SYMMETRY],
+        "sym_pts": [[_P[a], _P[b], _P[c]] for a, b, c in SYMMETRY],
+        "classic_angle": [], "classic_angle_col": [],
+        "classic_dist": [], "classic_dist_col": [],
+        "classic_num": [], "classic_den": [], "classic_ratio_col": [],
+    }
+    for col, (_, kind, args) in enumerate(CLASSIC):
+        if kind == "angle":
+            t["classic_angle"].append(quad(*args))
+            t["classic_angle_col"].append(col)
+        elif kind == "dist":
+            t["classic_dist"].append(pair(*args))
+            t["classic_dist_col"].append(col)
+        else:
+            t["classic_num"].append(pair(*args[0]))
+            t["classic_den"].append(pair(*args[1]))
+            t["classic_ratio_col"].append(col)
+
+    t["pairs"] = np.array(pairs, dtype=np.intp)
+    t["quads"] = np.array(quads, dtype=np.intp)
+    return {k: np.asarray(v, dtype=np.intp) for k, v in t.items()}
+
+
+_T = _build_tables()
+_SBAL_R, _SBAL_L, _N, _PRN = (_P[n] for n in ("Sbal_R", "Sbal_L", "N", "Prn"))
+
+
+def features_from_landmarks(landmarks):
+    """
+    landmarks : (15, 2) or (B, 15, 2) pixel coordinates in labelnum order,
+                NaN rows for landmarks that were not found
+    Returns the 42 features as a float32 (42,) or (B, 42) array.
+    """
+    L = np.asarray(landmarks, dtype=np.float64)
+    single = L.ndim == 2
+    if single:
+        L = L[None]
+
+    # (B, 17, 2): landmarks + derived midpoints (NaN if a parent is missing)
+    P = np.concatenate([
+        L,
+        (L[:, [_SBAL_R]] + L[:, [_SBAL_L]]) / 2.0,
+        (L[:, [_N]] + L[:, [_PRN]]) / 2.0,
+    ], axis=1)
+    missing = np.isnan(P).any(axis=2)                       # (B, 17)
+
+    # all distinct distances and angles at once
+    pairs, quads = _T["pairs"], _T["quads"]
+    D = np.linalg.norm(P[:, pairs[:, 0]] - P[:, pairs[:, 1]], axis=2)
+    D0 = np.where(np.isnan(D), 0.0, D)                      # safe_dist: missing -> 0
+
+    U = P[:, quads[:, 0]] - P[:, quads[:, 1]]
+    V = P[:, quads[:, 2]] - P[:, quads[:, 3]]
+    nu = np.linalg.norm(U, axis=2)
+    nv = np.linalg.norm(V, axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos = np.einsum("bkj,bkj->bk", U, V) / (nu * nv)
+        A = np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+    A[(nu == 0) | (nv == 0)] = np.nan                       # degenerate angle
+
+    out = np.empty((P.shape[0], NUM_FEATURES), dtype=np.float64)
+    col = 0
+
+    # === 1. Distances ===
+    n = len(DISTANCES)
+    out[:, col:col + n] = D0[:, _T["dist"]]
+    col += n
+
+    # === 2. Angles ===
+    n = len(ANGLES)
+    out[:, col:col + n] = np.where(missing[:, _T["angle_pts"]].any(axis=2), 0.0, A[:, _T["angle"]])
+    col += n
+
+    # === 3. Ratios ===
+    n = len(RATIOS)
+    out[:, col:col + n] = D0[:, _T["ratio_num"]] / (D0[:, _T["ratio_den"]] + 1e-6)
+    col += n
+
+    # === 4. Symmetry ===
+    n = len(SYMMETRY)
+    sym = np.abs(D[:, _T["sym_a"]] - D[:, _T["sym_b"]])
+    out[:, col:col + n] = np.where(missing[:, _T["sym_pts"]].any(axis=2), 0.0, sym)
+    col += n
+
+    # === 5. Classic 12 (NaN propagates for missing landmarks) ===
+    classic = out[:, col:]
+    classic[:, _T["classic_angle_col"]] = A[:, _T["classic_angle"]]
+    classic[:, _T["classic_dist_col"]] = D[:, _T["classic_dist"]]
+    den = D[:, _T["classic_den"]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        classic[:, _T["classic_ratio_col"]] = np.where(den != 0, D[:, _T["classic_num"]] / den, np.nan)
+
+    out = out.astype(np.float32)
+    return out[0] if single else out
+
+
+def points_to_array(pts):
+    """{name: (x, y) or None} -> (15, 2) array with NaN rows for missing points."""
+    arr = np.full((NUM_LANDMARKS, 2), np.nan)
+    for i, name in enumerate(LANDMARK_NAMES):
+        if pts.get(name) is not None:
+            arr[i] = pts[name]
+    return arr
+
+
+def compute_features(landmarks):
+    """The 12 classic nasal geometry features of one image, by name."""
+    classic = features_from_landmarks(landmarks)[-len(CLASSIC):]
+    return {name: float(v) for name, v in zip(CLASSIC_NAMES, classic)}
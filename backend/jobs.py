@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from telemetry import STAGE_SECONDS, request_id_var
+
+log = logging.getLogger(__name__)
+
+# =====================================================
+# Background analysis jobs
+# =====================================================
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Timings:
+    """
+    Per-stage wall clock timings (milliseconds) of one analysis.
+    Spans of the same stage add up; every span is also logged at DEBUG level
+    under the request id and observed by the nose_stage_seconds histogram.
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or request_id_var.get()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            with self._lock:
+                self.stages[name] = round(self.stages.get(name, 0.0) + seconds * 1000.0, 3)
+            STAGE_SECONDS.observe(seconds, stage=name)
+            log.debug("span stage=%s ms=%.3f", name, seconds * 1000.0, extra={"request_id": self.request_id})
+
+
+class Job:
+    def __init__(self, kind, timings=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"          # queued -> running -> done | failed
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = timings or Timings()
+        self.result = None
+        self.error = None
+
+    def to_dict(self, with_result=False):
+        out = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timings_ms": dict(self.timings.stages),
+        }
+        if self.started_at is not None:
+            out["timings_ms"]["queued"] = round((self.started_at - self.submitted_at) * 1000.0, 3)
+        if self.error is not None:
+            out["error"] = self.error
+        if with_result and self.status == "done":
+            out["result"] = self.result
+        return out
+
+
+class JobManager:
+    """
+    Bounded worker pool for analysis jobs.
+
+    At most `max_workers` jobs run at once and at most `max_queued` more wait
+    for a worker; submit() raises QueueFull beyond that so the API can answer
+    429 instead of piling up work.  Finished jobs are kept for `result_ttl`
+    seconds so clients can poll their result.
+    """
+
+    def __init__(self, max_workers=2, max_queued=8, result_ttl=600):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def is_full(self):
+        with self._lock:
+            return self._pending >= self.max_workers + self.max_queued
+
+    def submit(self, kind, fn, *args, timings=None, on_finish=None, job_id=None):
+        """
+        Runs fn(*args, timings) in the pool and stores its return value as
+        the job result.  on_finish (optional) runs after the job, success or not.
+        job_id (optional) reuses an existing id, e.g. the job's results directory.
+        """
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_workers + self.max_queued:
+                raise QueueFull()
+            job = Job(kind, timings, job_id)
+            self._jobs[job.id] = job
+            self._pending += 1
+
+        self._executor.submit(self._run, job, fn, args, on_finish)
+        return job
+
+    def _run(self, job, fn, args, on_finish):
+        job.started_at = time.time()
+        job.status = "running"
+        try:
+            job.result = fn(*args, job.timings)
+            job.status = "done"
+        except Exception as e:
+            log.exception("job failed job_id=%s kind=%s", job.id, job.kind,
+                          extra={"request_id": job.timings.request_id})
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+            if on_finish is not None:
+                on_finish()
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at is not None and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._pending, "max_workers": self.max_workers, "max_queued": self.max_queued}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,139 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import settings
+from geometry import landmarks_to_index
+
+# =====================================================
+# MediaPipe landmarking (15 mapped nasal landmarks)
+# =====================================================
+
+
+def create_face_mesh(refine=settings.REFINE_LANDMARKS, static_image_mode=True):
+    """
+    refine=False skips the attention (iris / lips / eyes) refinement: none of
+    the 15 mapped landmarks is an iris point, but the lip and eye corners can
+    move slightly, so check with bench.py before switching a deployment.
+    static_image_mode=False tracks the face across consecutive frames of one
+    video (see video.py); such an instance must not be shared between streams.
+    """
+    # imported here so processes that never landmark don't load MediaPipe
+    import mediapipe as mp
+
+    return mp.solutions.face_mesh.FaceMesh(static_image_mode=static_image_mode, max_num_faces=1,
+                                           refine_landmarks=refine)
+
+
+class MediaPipePool:
+    """
+    A MediaPipe graph must not run process() from two threads at once, so
+    callers check an instance out, use it alone and hand it back.  Up to
+    `size` instances are created on demand by factory(); further callers
+    wait for one.
+    """
+
+    def __init__(self, factory, size=settings.FACE_MESH_POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()      # most recently used first (warm caches)
+        self._created = 0
+        self._waits = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                self._waits += 1
+                create = False
+        if not create:
+            return self._idle.get()
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def checkout(self):
+        face_mesh = self._acquire()
+        try:
+            yield face_mesh
+        finally:
+            self._idle.put(face_mesh)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "created": self._created, "idle": self._idle.qsize(),
+                    "waits": self._waits}
+
+
+class FaceMeshPool(MediaPipePool):
+    def __init__(self, size=settings.FACE_MESH_POOL_SIZE, refine=settings.REFINE_LANDMARKS):
+        super().__init__(lambda: create_face_mesh(refine), size)
+        self.refine = refine
+
+    def stats(self):
+        return dict(super().stats(), refine_landmarks=self.refine)
+
+
+def point_from_landmark(landmark, img_w, img_h):
+    return np.array([landmark.x * img_w, landmark.y * img_h], dtype=float)
+
+
+def detect_face(img, face_mesh, with_mesh=True):
+    """
+    detect_landmarks, plus the whole FaceMesh mesh as an (N, 2) pixel array
+    (None when no face was found or with_mesh is False).
+    """
+    h, w = img.shape[:2]
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    results = face_mesh.process(rgb)
+
+    landmarks = np.full((len(landmarks_to_index), 2), np.nan)
+    mesh = None
+
+    if results.multi_face_landmarks:
+        lmset = results.multi_face_landmarks[0]
+        for num, mp_idx in landmarks_to_index.items():
+            try:
+                lm = lmset.landmark[mp_idx]
+                landmarks[num - 1] = point_from_landmark(lm, w, h)
+            except:
+                pass
+        if with_mesh:
+            mesh = np.array([(lm.x * w, lm.y * h) for lm in lmset.landmark], dtype=np.float32)
+
+    return landmarks, mesh
+
+
+def detect_landmarks(img, face_mesh):
+    """
+    Runs Mediapipe on a decoded BGR image (a file path is still accepted).
+    face_mesh must not be used by another thread at the same time.
+    Returns the 15 mapped landmarks as a (15, 2) pixel array in labelnum
+    order, with NaN rows for landmarks that were not found.
+    """
+    if isinstance(img, str):
+        img = cv2.imread(img)
+    return detect_face(img, face_mesh, with_mesh=False)[0]
@@ -1,498 +1,656 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from typing import Dict
+from typing import Dict, List, Optional
+import asyncio
+import json
+import logging
 import os
-import shutil
-import subprocess
+import re
+import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 import cv2
-import glob
 import numpy as np
-import math
-import torch
-import mediapipe as mp
-import torch.nn as nn
-INPUT_FEATURES = 42
-NUM_CLASSES = 4
-NUM_TASKS = 12
-OUTPUT_FEATURES = NUM_TASKS * NUM_CLASSES
-
-BATCH_SIZE = 16
-EPOCHS = 200
-LR = 0.001
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
+from scoring import VIEW_ORDER
+from nose_models import INPUT_FEATURES, MODEL_VIEWS, SCORE_NAMES
+from registry import ModelRegistry
+from batching import MicroBatcher
+from geometry import LANDMARK_NAMES, NUM_LANDMARKS, features_from_landmarks
+from landmarks import FaceMeshPool, MediaPipePool
+from roi import create_face_detector, detect_face_box, landmarks_in_box
+from reconstruction import ReconstructionPool
+from meshes import decimate, read_glb, write_glb
+from mesh_diff import mesh_difference
+from jobs import JobManager, QueueFull, Timings
+from cache import ContentCache, content_key
+from payloads import NPY_MEDIA_TYPE, cases_from_json, cases_from_npy, to_npy
+from store import JOB_ID_RE, ResultStore
+from sessions import MODEL_NAMES, SessionManager, dirty_nodes, model_slices
+from case_index import CaseIndex, case_vectors
+from video import FrameSource, is_video, track_view
+from telemetry import REQUEST_SECONDS, render_metrics, request_id_var, setup_logging
+from cpu_budget import apply_thread_budget, thread_budget
+import settings
+
+setup_logging(settings.LOG_LEVEL)
+log = logging.getLogger("backend")
+
+# torch / OpenCV pools sized from this worker's share of the cores (see cpu_budget.py)
+apply_thread_budget()
 
 # =====================================================
-# 1. Load scaler + trained model
+# 1. Scaler + trained models (loaded lazily, see registry.py)
 # =====================================================
+registry = ModelRegistry()
 
-scaler_mean = np.load(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend/scaler_mean.npy")          # shape: (42,)
-scaler_scale = np.load(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend/scaler_scale.npy") 
-
-# =====================================================
-# Frontal view model
-
-# -----------------------------
-# CONFIG
-# -----------------------------
-INPUT_FEATURES2 = 42
-NUM_CLASSES2 = 4
-NUM_TASKS2 = 2   # <---- ONLY TWO OUTPUTS NOW
-
-BATCH_SIZE2 = 16
-EPOCHS2 = 200
-LR2 = 0.001
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
+# scorer calls of concurrent requests are merged into one forward pass
+batcher = MicroBatcher(lambda features: registry.scorer.predict(features))
 
+# ---------------------------
+# MediaPipe Setup
+# ---------------------------
+# FaceMesh instances are checked out of a pool, one caller at a time each
+face_meshes = FaceMeshPool()
+
+# one face detection per image, shared by FaceMesh and 3DDFA (see roi.py)
+face_detectors = MediaPipePool(create_face_detector)
+
+# landmarks (and so features) depend on the refine_landmarks mode and on
+# whether FaceMesh saw a crop, keep the modes apart in the cache
+_MODE = ("" if face_meshes.refine else "_lite") + ("_roi" if settings.FACE_ROI else "")
+LANDMARKS_FIELD = "landmarks" + _MODE
+FEATURES_FIELD = "features" + _MODE
+
+# landmarks / features / meshes of images we have already seen
+image_cache = ContentCache(
+    max_entries=settings.CACHE_ENTRIES,
+    disk_dir=settings.CACHE_DIR or None,
+    disk_max_bytes=int(settings.CACHE_DISK_MAX_MB * 1024 * 1024),
+)
 
-class NoseScoreClassifier2(nn.Module):
-    def __init__(self):
-        super().__init__()
-
-        self.backbone = nn.Sequential(
-            nn.Linear(INPUT_FEATURES2, 64),
-            nn.ReLU(),
-            nn.Linear(64, 128),
-            nn.ReLU(),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-        )
-
-        # ONLY TWO HEADS NOW
-        self.heads = nn.ModuleList([nn.Linear(64, NUM_CLASSES2) for _ in range(NUM_TASKS2)])
-
-        self.apply(self._init_weights)
+# per-job directories (inputs, landmarks, result.json, meshes) with retention
+results = ResultStore()
 
-    def _init_weights(self, m):
-        if isinstance(m, nn.Linear):
-            nn.init.kaiming_normal_(m.weight)
-            nn.init.zeros_(m.bias)
+# scaled feature vectors of every analyzed face, for similar-case search
+case_index = CaseIndex()
 
-    def forward(self, x):
-        shared = self.backbone(x)
-        return [head(shared) for head in self.heads]
-    
-front_model = NoseScoreClassifier2()
-front_model.load_state_dict(torch.load(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend/nose_twohead_model.pth", map_location="cpu"))
-front_model.eval()
+# threads used to fan out per-image work (face detection, landmarking)
+pipeline_pool = ThreadPoolExecutor(max_workers=settings.PIPELINE_THREADS, thread_name_prefix="pipeline")
+# one thread per 3DDFA worker: a reconstruction waiting for a free worker only holds one of these
+recon_pool = ThreadPoolExecutor(max_workers=settings.TDDFA_WORKERS, thread_name_prefix="reconstruction")
 
 # =====================================================
-# Lateral view model
+# 2. Feature Extraction (output = 42-dim vector)
+# =====================================================
+def get_face_box(img, key=None, timings=None):
+    """roi.detect_face_box (None when FACE_ROI is off or no face), cached per image."""
+    if not settings.FACE_ROI:
+        return None
+    if key is not None:
+        entry = image_cache.get(key, "face_box")
+        if entry is not None and "face_box" in entry:
+            return entry["face_box"]
+
+    timings = timings or Timings()
+    with timings.stage("detect"), face_detectors.checkout() as detector:
+        box = detect_face_box(img, detector)
+    if key is not None:
+        image_cache.update(key, face_box=box)
+    return box
+
+
+def roi_views():
+    """The views that are landmarked or reconstructed: the ones the models use + front."""
+    return {VIEW_ORDER[v] for v in registry.scorer.views_used} | {"front"}
+
+
+def detect_boxes(images, keys=None, timings=None):
+    """{name: image} -> {name: face box or None}, all images in parallel."""
+    names = list(images)
+    keys = keys or {}
+    boxes = pipeline_pool.map(get_face_box, [images[n] for n in names], [keys.get(n) for n in names],
+                              [timings] * len(names))
+    return dict(zip(names, boxes))
+
+
+def get_landmarks(img, key=None, timings=None, box=None):
+    """
+    FaceMesh landmarks, served from / stored in the image cache when key is given.
+    box : face box from get_face_box; FaceMesh then only sees a crop around
+          it (landmarks are still full-image pixels)
+    """
+    if key is not None:
+        entry = image_cache.get(key, LANDMARKS_FIELD)
+        if entry is not None and LANDMARKS_FIELD in entry:
+            return entry[LANDMARKS_FIELD]
 
-# -----------------------------
-# CONFIG
-# -----------------------------
-INPUT_FEATURES3 = 42
-NUM_CLASSES3 = 4
-NUM_TASKS3 = 8   # <---- NOW 8 OUTPUTS
+    timings = timings or Timings()
+    with timings.stage("face_mesh"), face_meshes.checkout() as face_mesh:
+        landmarks = landmarks_in_box(img, box, face_mesh)
+    if key is not None:
+        image_cache.update(key, **{LANDMARKS_FIELD: landmarks})
+    return landmarks
 
-BATCH_SIZE3 = 16
-EPOCHS3 = 200
-LR3 = 0.001
-device = "cuda" if torch.cuda.is_available() else "cpu"
 
+def extract_42_features(img, key=None):
+    """
+    Extract the full 42 handcrafted nasal features using Mediapipe.
+    key : content hash of the image; when given, landmarks and features are
+          served from / stored in the image cache.
+    Returns a 42-length numpy vector.
+    """
+    if key is not None:
+        entry = image_cache.get(key, FEATURES_FIELD)
+        if entry is not None and FEATURES_FIELD in entry:
+            return entry[FEATURES_FIELD]
 
+    features = features_from_landmarks(get_landmarks(img, key))
 
-class NoseScoreClassifier3(nn.Module):
-    def __init__(self):
-        super().__init__()
+    if key is not None:
+        image_cache.update(key, **{FEATURES_FIELD: features})
+    return features
 
-        self.backbone = nn.Sequential(
-            nn.Linear(INPUT_FEATURES3, 64),
-            nn.ReLU(),
-            nn.Linear(64, 128),
-            nn.ReLU(),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-        )
 
-        # ---------- 8 output heads ----------
-        self.heads = nn.ModuleList(
-            [nn.Linear(64, NUM_CLASSES3) for _ in range(NUM_TASKS3)]
-        )
+def extract_features_batch(images, keys=None, timings=None, return_landmarks=False, boxes=None, on_landmarks=None):
+    """
+    Landmarks for all images in parallel, then the 42 features of all of
+    them in one vectorized kernel call.
+    boxes        : optional matching face boxes (get_face_box)
+    on_landmarks : optional callback(i, landmarks), called (from the pipeline
+                   threads) as soon as image i is landmarked
+    Returns a (len(images), 42) float32 array (and the stacked landmarks
+    when return_landmarks).
+    """
+    timings = timings or Timings()
+    keys = keys or [None] * len(images)
+    boxes = boxes or [None] * len(images)
 
-        self.apply(self._init_weights)
+    def landmark(i):
+        lm = get_landmarks(images[i], keys[i], timings, boxes[i])
+        if on_landmarks is not None:
+            on_landmarks(i, lm)
+        return lm
 
-    def _init_weights(self, m):
-        if isinstance(m, nn.Linear):
-            nn.init.kaiming_normal_(m.weight)
-            nn.init.zeros_(m.bias)
+    with timings.stage("landmarks"):
+        landmarks = np.stack(list(pipeline_pool.map(landmark, range(len(images)))))
 
-    def forward(self, x):
-        shared = self.backbone(x)
-        return [head(shared) for head in self.heads]
-    
-lat_model = NoseScoreClassifier3()
-lat_model.load_state_dict(torch.load(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend/nose_8head_model.pth", map_location="cpu"))
-lat_model.eval()
+    with timings.stage("features"):
+        features = features_from_landmarks(landmarks)
 
-# =====================================================
-# Basal view model
-
-# -----------------------------
-# CONFIG
-# -----------------------------
-INPUT_FEATURES4 = 42        # 7 angles + 5 ratios + 30 landmark coords
-NUM_CLASSES4 = 4            # scores 1–4
-NUM_TASKS4 = 2              # Basal view has 2 output scores
-BATCH_SIZE4 = 16
-EPOCHS4 = 200
-LR4 = 0.001
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# -----------------------------
-# MODEL
-# -----------------------------
-class NoseBasalClassifier(nn.Module):
-    def __init__(self):
-        super().__init__()
-
-        # shared backbone
-        self.backbone = nn.Sequential(
-            nn.Linear(INPUT_FEATURES4, 64),
-            nn.ReLU(),
-            nn.Linear(64, 128),
-            nn.ReLU(),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-        )
+    for key, f in zip(keys, features):
+        if key is not None:
+            image_cache.update(key, **{FEATURES_FIELD: f})
+    if return_landmarks:
+        return features, landmarks
+    return features
 
-        # ---- 2 output heads ----
-        self.heads = nn.ModuleList([
-            nn.Linear(64, NUM_CLASSES4) for _ in range(NUM_TASKS4)
-        ])
 
-        self.apply(self._init_weights)
+# =====================================================
+# 3. Full Prediction Pipeline
+# =====================================================
 
-    def _init_weights(self, m):
-        if isinstance(m, nn.Linear):
-            nn.init.kaiming_normal_(m.weight)
-            nn.init.zeros_(m.bias)
+def score_features(features):
+    """(N, 4, 42) raw features in VIEW_ORDER -> (N, 12) scores, through the micro-batcher."""
+    predict = batcher.predict if settings.BATCHING else registry.scorer.predict
+    return predict(features)
 
-    def forward(self, x):
-        shared = self.backbone(x)
-        return [head(shared) for head in self.heads]
-    
-basal_model = NoseBasalClassifier()
-basal_model.load_state_dict(torch.load(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend/nose_basal_model.pth", map_location="cpu"))
-basal_model.eval()
 
-# ---------------------------
-# MediaPipe Setup
-# ---------------------------
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
+def landmark_features(landmarks):
+    """(N, 4, 15, 2) landmarks in VIEW_ORDER -> (N, 4, 42) features, zeros for the unused views."""
+    used = registry.scorer.views_used
+    n = len(landmarks)
+    features = np.zeros((n, len(VIEW_ORDER), INPUT_FEATURES), dtype=np.float32)
+    features[:, used] = features_from_landmarks(
+        landmarks[:, used].reshape(-1, *landmarks.shape[2:])
+    ).reshape(n, len(used), INPUT_FEATURES)
+    return features
 
-# ---------------------------
-# Landmark Mapping
-# ---------------------------
-landmarks_to_index = {
-    1: 168, 2: 4, 3: 94, 4: 115, 5: 279, 6: 59, 7: 439,
-    8: 60, 9: 290, 10: 0, 11: 9, 12: 362, 13: 133, 14: 454, 15: 234
-}
 
-labelnum_to_name = {
-    1: "N", 2: "Prn", 3: "Sn", 4: "Al_R", 5: "Al_L", 6: "Ac_R", 7: "Ac_L",
-    8: "Sbal_R", 9: "Sbal_L", 10: "Ls", 11: "G", 12: "En_R", 13: "En_L",
-    14: "Tr_R", 15: "Tr_L"
-}
+def score_landmarks(landmarks, timings=None):
+    """(N, 4, 15, 2) landmarks in VIEW_ORDER -> (N, 12) scores, features only for the used views."""
+    timings = timings or Timings()
+    with timings.stage("features"):
+        features = landmark_features(landmarks)
+    with timings.stage("scoring"):
+        return score_features(features)
 
-# ---------------------------
-# Helper Functions
-# ---------------------------
-def point_from_landmark(landmark, img_w, img_h):
-    return np.array([landmark.x * img_w, landmark.y * img_h], dtype=float)
 
-def dist(a, b):
-    return float(np.linalg.norm(a - b))
+def landmarks_json(landmarks):
+    """(15, 2) landmarks -> {name: [x, y] or None}"""
+    return {name: None if np.isnan(p).any() else [round(float(p[0]), 2), round(float(p[1]), 2)]
+            for name, p in zip(LANDMARK_NAMES, landmarks)}
 
-def angle_between(u, v):
-    u = np.array(u, dtype=float)
-    v = np.array(v, dtype=float)
-    nu, nv = np.linalg.norm(u), np.linalg.norm(v)
-    if nu == 0 or nv == 0:
-        return float("nan")
-    cosang = np.dot(u, v) / (nu * nv)
-    cosang = np.clip(cosang, -1.0, 1.0)
-    return float(math.degrees(math.acos(cosang)))
 
-def midpoint(a, b):
-    return (a + b) / 2.0
+def predict_scores_batch(cases, timings=None, keys=None, return_landmarks=False, boxes=None, emit=None):
+    """
+    cases : list of (img_front, img_right, img_left, img_basal) tuples
+    keys  : optional matching tuples of image content hashes (for the cache)
+    boxes : optional matching tuples of face boxes (get_face_box)
+    emit  : optional callback(event, data) told about every stage as it
+            completes: "landmarks" per image, "features" and "scores" per
+            model, data["case"] being the index into cases
+    Extracts features only for the views the models consume and scores all
+    cases with one fused forward pass.
+    Returns a list of 12-score lists, one per case (and, when
+    return_landmarks, a list of {view: landmarks} of the views that were used).
+    """
+    timings = timings or Timings()
+    scorer = registry.scorer
+    features = np.zeros((len(cases), len(VIEW_ORDER), INPUT_FEATURES), dtype=np.float32)
+
+    # announced before landmarking, so a batch being collected waits for us
+    with batcher.caller():
+        # Step 1: extract handcrafted features, all images at once
+        slots = [(i, v) for i in range(len(cases)) for v in scorer.views_used]
+        images = [cases[i][v] for i, v in slots]
+        image_keys = [keys[i][v] if keys else None for i, v in slots]
+        image_boxes = [boxes[i][v] if boxes else None for i, v in slots]
+        on_landmarks = None
+        if emit is not None:
+            def on_landmarks(j, lm):
+                emit("landmarks", {"case": slots[j][0], "view": VIEW_ORDER[slots[j][1]],
+                                   "landmarks": landmarks_json(lm)})
+        extracted, landmarks = extract_features_batch(images, image_keys, timings, return_landmarks=True,
+                                                      boxes=image_boxes, on_landmarks=on_landmarks)
+        case_landmarks = [{} for _ in cases]
+        for (i, v), f, lm in zip(slots, extracted, landmarks):
+            features[i, v] = f
+            case_landmarks[i][VIEW_ORDER[v]] = lm
+        if emit is not None:
+            for i in range(len(cases)):
+                emit("features", {"case": i, "features": {VIEW_ORDER[v]: np.nan_to_num(features[i, v]).round(5).tolist()
+                                                          for v in scorer.views_used}})
+
+        # Step 2-4: scaling + all models + argmax for all 12 tasks in one go
+        # (one fused graph, shared with the other in-flight requests)
+        with timings.stage("scoring"):
+            final_scores = score_features(features).tolist()
+        if emit is not None:
+            for i, scores in enumerate(final_scores):
+                for name, part in model_slices().items():
+                    emit("scores", {"case": i, "model": name, "scores": dict(zip(SCORE_NAMES[part], scores[part]))})
+    log.debug("scores %s", final_scores, extra={"request_id": timings.request_id})
+
+    if return_landmarks:
+        return final_scores, case_landmarks
+    return final_scores
 
-def compute_features(pts):
-    """Compute 12 nasal geometry features from landmarks."""
-    def p(name): return pts.get(name, None)
-    Sbalmid = midpoint(p("Sbal_R"), p("Sbal_L")) if p("Sbal_R") is not None and p("Sbal_L") is not None else None
-    out = {}
 
-    try: out["Nasofrontal_angle_deg"] = angle_between(p("G") - p("N"), p("Prn") - p("N"))
-    except: out["Nasofrontal_angle_deg"] = float("nan")
+def predict_scores(img_front,img_right=None,img_left=None,img_basal=None):
+    return predict_scores_batch([(img_front, img_right, img_left, img_basal)])[0]  # length = 12
 
-    try: out["Nasolabial_angle_deg"] = angle_between(p("Sn") - p("Ls"), Sbalmid - p("Sn")) if Sbalmid is not None else float("nan")
-    except: out["Nasolabial_angle_deg"] = float("nan")
 
-    try: out["Nasal_tip_angle_deg"] = angle_between(p("Ac_L") - p("Prn"), p("Ac_R") - p("Prn"))
-    except: out["Nasal_tip_angle_deg"] = float("nan")
+# =====================================================
+# 4. 3D reconstruction (resident 3DDFA_V2 worker)
+# =====================================================
+reconstructor = ReconstructionPool()
 
-    try: out["Dorsal_angle_deg"] = angle_between(p("G") - p("N"), p("Prn") - p("N"))
-    except: out["Dorsal_angle_deg"] = float("nan")
 
-    try: out["Columellar_angle_deg"] = angle_between(p("Sn") - p("Prn"), Sbalmid - p("Sn")) if Sbalmid is not None else float("nan")
-    except: out["Columellar_angle_deg"] = float("nan")
+# file kind -> name suffix inside a job directory
+MESH_SUFFIXES = {"glb": ".glb", "uv_tex": "_uv_tex.jpg", "obj": "_obj.obj"}
 
-    try: out["Alar_base_width_px"] = dist(p("Al_L"), p("Al_R"))
-    except: out["Alar_base_width_px"] = float("nan")
 
-    try: out["Interalar_angle_deg"] = angle_between(p("Ac_L") - p("Prn"), p("Ac_R") - p("Prn"))
-    except: out["Interalar_angle_deg"] = float("nan")
+def generate_3d_obj(img, key=None, job_id=None, stem="front", box=None):
+    """
+    Runs 3DDFA_V2 on a decoded BGR image to produce <stem>.glb and
+    <stem>_uv_tex.jpg in the job's directory, through the warm
+    reconstruction worker.
+    key : content hash of the image; a mesh already built for the same
+          image (by any job) is linked in as long as its files are still there.
+    box : face box from get_face_box; the worker then gets a crop and skips
+          its own face detection.
+    Returns "<job_id>/<stem>.glb", the name /api/results/ serves it under.
+    """
+    job_id = job_id or results.create()
+
+    # 1️⃣ Same image seen before? link its mesh into this job
+    if key is not None:
+        entry = image_cache.get(key, "mesh")
+        if entry is not None and "mesh" in entry:
+            cached = entry["mesh"]["files"]
+            if "glb" in cached and all(os.path.exists(f) for f in cached.values()):
+                try:
+                    for kind, src in cached.items():
+                        results.link(job_id, stem + MESH_SUFFIXES[kind], src)
+                    return f"{job_id}/{stem}.glb"
+                except OSError:
+                    pass    # reaped in the meantime, build it again
+
+    # 2️⃣ One fit writes <stem>.glb + <stem>_uv_tex.jpg into the job directory
+    files = reconstructor.reconstruct(img, stem, results.job_dir(job_id), box=box)
+    if key is not None:
+        image_cache.update(key, mesh={"job_id": job_id, "files": files})
+
+    # 3️⃣ Return result name (served as /api/results/<job_id>/<stem>.glb)
+    return f"{job_id}/{stem}.glb"
+
+
+def compare_meshes(job_id, pre_stem, post_stem, timings=None):
+    """
+    Aligns the post-op mesh onto the pre-op one and writes the per-vertex
+    displacement (little-endian float32, pre-op vertex order) as
+    displacement.f32 in the job directory.
+    Returns the summary + buffer name, or None if the meshes don't share a topology.
+    """
+    timings = timings or Timings()
+    with timings.stage("mesh_diff"):
+        pre_vertices, _, faces = read_glb(results.path(job_id, pre_stem + ".glb"))
+        post_vertices, _, _ = read_glb(results.path(job_id, post_stem + ".glb"))
+        try:
+            displacement, summary = mesh_difference(pre_vertices, post_vertices, faces)
+        except ValueError as e:
+            log.warning("mesh difference skipped: %s", e)
+            return None
+        results.write_bytes(job_id, "displacement.f32", displacement.astype("<f4").tobytes())
+    return dict(summary, buffer=f"{job_id}/displacement.f32", dtype="float32")
 
-    try:
-        denom = dist(p("N"), p("Sn"))
-        out["Projection_ratio"] = dist(p("N"), p("Prn")) / denom if denom != 0 else float("nan")
-    except: out["Projection_ratio"] = float("nan")
 
-    try:
-        denom = dist(p("Al_L"), p("Al_R"))
-        out["Tip_projection_index"] = dist(p("Prn"), p("Sn")) / denom if denom != 0 else float("nan")
-    except: out["Tip_projection_index"] = float("nan")
+# =====================================================
+# 5. Image ingestion (uploads are decoded in memory)
+# =====================================================
 
-    try: out["Nasal_dorsum_angle_deg"] = angle_between(p("N") - p("Prn"), p("Sn") - p("Prn"))
-    except: out["Nasal_dorsum_angle_deg"] = float("nan")
+# the client's filename only contributes its extension, and only if it looks like one
+UPLOAD_EXT_RE = re.compile(r"^\.[A-Za-z0-9]{1,5}$")
 
-    try:
-        denom = dist(p("N"), p("Sn"))
-        out["Nasal_width_index"] = dist(p("Al_L"), p("Al_R")) / denom if denom != 0 else float("nan")
-    except: out["Nasal_width_index"] = float("nan")
 
-    try:
-        denom = dist(p("Al_L"), p("Al_R"))
-        out["Nasal_height_ratio"] = dist(p("G"), p("Sn")) / denom if denom != 0 else float("nan")
-    except: out["Nasal_height_ratio"] = float("nan")
+def decode_image(data):
+    """Decodes encoded image bytes (jpg/png/...) straight into a BGR array."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
 
-    return out
 
+async def read_uploads(files: Dict[str, UploadFile]) -> Dict[str, tuple]:
+    """Returns {name: (client filename, raw bytes)}, nothing touches disk."""
+    return {name: (file.filename, await file.read()) for name, file in files.items()}
 
 
-# =====================================================
-# 2. Feature Extraction (output = 42-dim vector)
-# =====================================================
-def extract_42_features(img):
+def persist_uploads(uploads: Dict[str, tuple], job_id) -> Dict[str, str]:
     """
-    Extract the full 42 handcrafted nasal features using Mediapipe.
-    Reuses the same 15 key landmarks and geometry functions from your pipeline.
-    Returns a 42-length numpy vector.
+    Only used when the client asks to keep its images: writes them into the
+    job's inputs/ folder, named after the form field (never the client's
+    filename), and returns {name: "<job_id>/inputs/<name><ext>"}.
     """
-    img = cv2.imread(img) 
-    h, w = img.shape[:2]
-    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    results = face_mesh.process(rgb)
+    saved_files = {}
+    for name, (filename, data) in uploads.items():
+        ext = os.path.splitext(filename or "")[1].lower()
+        if not UPLOAD_EXT_RE.match(ext):
+            ext = ".jpg"
+        relative = f"inputs/{name}{ext}"
+        results.write_bytes(job_id, relative, data)
+        saved_files[name] = f"{job_id}/{relative}"
+    return saved_files
 
-    # Initialize landmark dict
-    pts = {name: None for name in labelnum_to_name.values()}
 
-    if results.multi_face_landmarks:
-        lmset = results.multi_face_landmarks[0]
-        for num, mp_idx in landmarks_to_index.items():
-            name = labelnum_to_name[num]
-            try:
-                lm = lmset.landmark[mp_idx]
-                pts[name] = point_from_landmark(lm, w, h)
-            except:
-                pts[name] = None
-
-    # ------------------------------
-    # Compute your existing 12 features
-    # ------------------------------
-    f12 = compute_features(pts)
-
-    # ------------------------------
-    # Additional handcrafted features
-    # ------------------------------
-    feat_list = []
-
-    def safe_dist(a, b):
-        if a is None or b is None:
-            return 0.0
-        return dist(a, b)
-
-    def safe_ang(a, b, c):
-        """Angle at point b formed by (a-b) and (c-b)."""
-        if a is None or b is None or c is None:
-            return 0.0
-        return angle_between(a - b, c - b)
-
-    # === 1. Distances (10 features) ===
-    feat_list += [
-        safe_dist(pts["N"], pts["Prn"]),
-        safe_dist(pts["Prn"], pts["Sn"]),
-        safe_dist(pts["Al_L"], pts["Al_R"]),
-        safe_dist(pts["Ac_L"], pts["Prn"]),
-        safe_dist(pts["Ac_R"], pts["Prn"]),
-        safe_dist(pts["Sbal_L"], pts["Sbal_R"]),
-        safe_dist(pts["G"], pts["N"]),
-        safe_dist(pts["G"], pts["Prn"]),
-        safe_dist(pts["N"], pts["Sn"]),
-        safe_dist(pts["Prn"], pts["Ls"])
-    ]
-
-    # === 2. Angles (8 features) ===
-    feat_list += [
-        safe_ang(pts["G"], pts["N"], pts["Prn"]),
-        safe_ang(pts["N"], pts["Prn"], pts["Sn"]),
-        safe_ang(pts["Al_L"], pts["Prn"], pts["Al_R"]),
-        safe_ang(pts["Ac_L"], pts["Prn"], pts["Ac_R"]),
-        safe_ang(pts["Sbal_L"], pts["Sn"], pts["Sbal_R"]),
-        safe_ang(pts["G"], pts["Prn"], pts["Sn"]),
-        safe_ang(pts["G"], pts["Sn"], pts["Prn"]),
-        safe_ang(pts["N"], pts["Sn"], pts["Prn"])
-    ]
-
-    # === 3. Ratios (6 features) ===
-    denom1 = safe_dist(pts["N"], pts["Sn"])
-    denom2 = safe_dist(pts["Al_L"], pts["Al_R"])
-    denom3 = safe_dist(pts["G"], pts["Sn"])
-
-    feat_list += [
-        safe_dist(pts["N"], pts["Prn"]) / (denom1 + 1e-6),
-        safe_dist(pts["Prn"], pts["Sn"]) / (denom2 + 1e-6),
-        safe_dist(pts["G"], pts["Prn"]) / (denom3 + 1e-6),
-        safe_dist(pts["G"], pts["N"]) / (denom3 + 1e-6),
-        safe_dist(pts["Sbal_L"], pts["Sbal_R"]) / (denom2 + 1e-6),
-        safe_dist(pts["Ac_L"], pts["Ac_R"]) / (denom2 + 1e-6)
-    ]
-
-    # === 4. Symmetry features (6 features) ===
-    def sym(a, b, center):
-        if a is None or b is None or center is None:
-            return 0.0
-        return abs(dist(a, center) - dist(b, center))
-
-    mid_N_Prn = None
-    if pts["N"] is not None and pts["Prn"] is not None:
-        mid_N_Prn = midpoint(pts["N"], pts["Prn"])
-
-    feat_list += [
-        sym(pts["Al_L"], pts["Al_R"], pts["N"]),
-        sym(pts["Ac_L"], pts["Ac_R"], pts["Prn"]),
-        sym(pts["Sbal_L"], pts["Sbal_R"], pts["Sn"]),
-        sym(pts["En_L"], pts["En_R"], pts["G"]),
-        sym(pts["Tr_L"], pts["Tr_R"], mid_N_Prn),
-        sym(pts["Ac_L"], pts["Ac_R"], pts["Sn"])
-    ]
-
-    # === 5. Add your 12 existing features ===
-    for k in [
-        "Nasofrontal_angle_deg", "Dorsal_angle_deg", "Nasal_dorsum_angle_deg",
-        "Nasolabial_angle_deg", "Columellar_angle_deg",
-        "Nasal_tip_angle_deg", "Interalar_angle_deg",
-        "Alar_base_width_px", "Nasal_width_index", "Nasal_height_ratio",
-        "Projection_ratio", "Tip_projection_index"
-    ]:
-        feat_list.append(float(f12.get(k, 0.0)))
-
-    # ------------------------------
-    # Guarantee vector length = 42
-    # ------------------------------
-    while len(feat_list) < 42:
-        feat_list.append(0.0)
-
-    return np.array(feat_list[:42], dtype=np.float32)
+def ingest_uploads(uploads: Dict[str, tuple], persist=False, timings=None, job_id=None):
+    """Returns ({name: BGR array}, {name: content hash}, {name: persisted path})."""
+    timings = timings or Timings()
+    images, keys = {}, {}
+    for name, (filename, data) in uploads.items():
+        keys[name] = content_key(data)
+        try:
+            with timings.stage("decode"):
+                images[name] = decode_image(data)
+        except ValueError:
+            raise ValueError(f"Could not decode the '{name}' image")
+
+    saved_files = {}
+    if persist:
+        with timings.stage("upload_write"):
+            saved_files = persist_uploads(uploads, job_id)
+    return images, keys, saved_files
+
 
 # =====================================================
-# 3. Full Prediction Pipeline
+# 6. Analysis pipelines (blocking, run off the event loop)
 # =====================================================
 
-def predict_scores(img_front,img_right=None,img_left=None,img_basal=None):
-    # Step 1: extract handcrafted features
-    features_f = extract_42_features(img_front)
-    features_r = extract_42_features(img_right)
-    features_b = extract_42_features(img_basal)
+def reconstruct_async(img, key, job_id, timings, stem="front", stage="reconstruction", box=None):
+    """Starts generate_3d_obj on the reconstruction pool, timed as its own stage."""
+    def _run():
+        with timings.stage(stage):
+            return generate_3d_obj(img, key, job_id, stem, box)
+    return recon_pool.submit(_run)
 
-    # Step 2: apply manual scaling
-    features_scaled_f = (features_f - scaler_mean) / scaler_scale
-    features_scaled_r = (features_r - scaler_mean) / scaler_scale
-    features_scaled_b = (features_b - scaler_mean) / scaler_scale
 
-    # Step 3: convert to tensor
-    x1 = torch.tensor(features_scaled_f, dtype=torch.float32).unsqueeze(0)
-    x2 = torch.tensor(features_scaled_r, dtype=torch.float32).unsqueeze(0)
-    x3 = torch.tensor(features_scaled_b, dtype=torch.float32).unsqueeze(0)
+def save_job(job_id, result, landmarks, timings):
+    """landmarks.npz (<case>_<view> -> (15, 2)) + result.json in the job directory."""
+    with timings.stage("result_write"):
+        results.write_arrays(job_id, "landmarks.npz", **landmarks)
+        results.write_json(job_id, "result.json", result)
 
-    final_scores = []
 
-    # Step 4: predict
-    with torch.no_grad():
-        outputs_front = front_model(x1) 
-        outputs_lat = lat_model(x1)
-        outputs_basal = basal_model(x3)
+def index_cases(cases, case_landmarks, timings, features=None):
+    """
+    Appends analyzed faces to the similar-case index.  Never fails the analysis.
+    cases          : one dict per face (case_id, kind, nose_scores, outcome)
+    case_landmarks : matching {view: landmarks} of the views that were used
+    features       : (N, 4, 42) features to index instead of the landmarks' own
+    """
+    if not settings.CASE_INDEX:
+        return
+    try:
+        with timings.stage("case_index"):
+            if features is None:
+                landmarks = np.full((len(cases), len(VIEW_ORDER), NUM_LANDMARKS, 2), np.nan, dtype=np.float32)
+                for i, by_view in enumerate(case_landmarks):
+                    for view, lm in by_view.items():
+                        landmarks[i, VIEW_ORDER.index(view)] = lm
+                features = landmark_features(landmarks)
+            case_index.add(cases, case_vectors(features, *registry.get("scaler")))
+    except Exception:
+        log.exception("could not add %s to the case index", cases[0]["case_id"],
+                      extra={"request_id": timings.request_id})
+
+
+def case_emitter(emit, names):
+    """Wraps emit so that data["case"] is a name ("pre", "post") instead of an index."""
+    if emit is None:
+        return None
+    return lambda event, data: emit(event, dict(data, case=names[data["case"]]))
+
+
+def analyze_patient(images, keys=None, saved_files=None, job_id=None, timings=None, emit=None):
+    """emit : optional callback(event, data) for the streaming endpoint (section 12)."""
+    timings = timings or Timings()
+    keys = keys or {}
+    job_id = job_id or results.create()
 
-        print(outputs_front, outputs_lat, outputs_basal)
+    try:
+        # one face detection per photo, shared by FaceMesh and 3DDFA
+        boxes = detect_boxes({v: images[v] for v in roi_views()}, keys, timings)
+
+        # reconstruction runs in its own worker while the features are extracted
+        reconstruction = reconstruct_async(images["front"], keys.get("front"), job_id, timings,
+                                           box=boxes["front"])
+        scores, landmarks = predict_scores_batch(
+            [tuple(images[v] for v in VIEW_ORDER)], timings,
+            keys=[tuple(keys.get(v) for v in VIEW_ORDER)], return_landmarks=True,
+            boxes=[tuple(boxes.get(v) for v in VIEW_ORDER)], emit=case_emitter(emit, ["patient"]),
+        )
 
-        outputs = outputs_front + outputs_lat + outputs_basal  # total 12 outputs
+        filename = reconstruction.result()
+        log.debug("mesh %s", filename, extra={"request_id": timings.request_id})
+        if emit is not None:
+            emit("mesh", {"case": "patient", "3d_results": filename})
+
+        result = {
+            "message": "Images uploaded successfully",
+            "job_id": job_id,
+            "saved_files": saved_files or {},
+            "3d_results": filename,
+            "nose_scores": scores[0]
+        }
+        save_job(job_id, result, landmarks[0], timings)
+        index_cases([{"case_id": job_id, "kind": "patient", "nose_scores": scores[0], "outcome": None}],
+                    landmarks, timings)
+        return result
+    finally:
+        results.finish(job_id)
+
+
+def analyze_comparison(images, keys=None, saved_files=None, job_id=None, timings=None, emit=None):
+    timings = timings or Timings()
+    keys = keys or {}
+    job_id = job_id or results.create()
+    try:
+        return _analyze_comparison(images, keys, saved_files, job_id, timings, emit)
+    finally:
+        results.finish(job_id)
+
+
+def _analyze_comparison(images, keys, saved_files, job_id, timings, emit=None):
+    # one face detection per photo, shared by FaceMesh and 3DDFA
+    boxes = detect_boxes({p + v: images[p + v] for p in ("", "post_") for v in roi_views()}, keys, timings)
+
+    # -----------------------------
+    # 2️⃣ Generate both 3D meshes side by side (one resident worker each)
+    # -----------------------------
+    pre_reconstruction = reconstruct_async(images["front"], keys.get("front"), job_id, timings,
+                                           "front", "reconstruction_pre", boxes["front"])
+    post_reconstruction = reconstruct_async(images["post_front"], keys.get("post_front"), job_id, timings,
+                                            "post_front", "reconstruction_post", boxes["post_front"])
+
+    # -----------------------------
+    # 3️⃣ Predict nose scores (pre + post images in parallel, one scoring pass)
+    # -----------------------------
+    (pre_scores, post_scores), (pre_landmarks, post_landmarks) = predict_scores_batch([
+        tuple(images[v] for v in VIEW_ORDER),
+        tuple(images["post_" + v] for v in VIEW_ORDER),
+    ], timings, keys=[
+        tuple(keys.get(v) for v in VIEW_ORDER),
+        tuple(keys.get("post_" + v) for v in VIEW_ORDER),
+    ], return_landmarks=True, boxes=[
+        tuple(boxes.get(v) for v in VIEW_ORDER),
+        tuple(boxes.get("post_" + v) for v in VIEW_ORDER),
+    ], emit=case_emitter(emit, ["pre", "post"]))
+
+    obj_filename = pre_reconstruction.result()
+    if emit is not None:
+        emit("mesh", {"case": "pre", "3d_results": obj_filename})
+    obj_filename1 = post_reconstruction.result()
+    if emit is not None:
+        emit("mesh", {"case": "post", "3d_results": obj_filename1})
+
+    # -----------------------------
+    # 4️⃣ Per-vertex pre/post difference (both meshes share the 3DDFA topology)
+    # -----------------------------
+    mesh_diff = compare_meshes(job_id, "front", "post_front", timings)
+    if emit is not None:
+        emit("mesh_diff", mesh_diff)
+
+    result = {
+        "message": "Pre & Post images processed successfully",
+        "job_id": job_id,
+        "saved_files": saved_files or {},
+        "3d_results_pre": obj_filename,
+        "3d_results_post": obj_filename1,
+        "mesh_diff": mesh_diff,
+        "nose_scores": {
+            "pre": pre_scores,
+            "post": post_scores
+        }
+    }
+    landmarks = {f"pre_{v}": lm for v, lm in pre_landmarks.items()}
+    landmarks.update({f"post_{v}": lm for v, lm in post_landmarks.items()})
+    save_job(job_id, result, landmarks, timings)
+    # the pre-op face is indexed with its post-op scores as the outcome
+    index_cases([
+        {"case_id": job_id, "kind": "pre_op", "nose_scores": pre_scores, "outcome": post_scores},
+        {"case_id": job_id, "kind": "post_op", "nose_scores": post_scores, "outcome": None},
+    ], [pre_landmarks, post_landmarks], timings)
+    return result
 
-        for out in outputs:
-            probs = torch.softmax(out, dim=1)   # (1, 4)
-            pred_class = torch.argmax(probs, dim=1).item()  # 0–3
-            final_scores.append(pred_class + 1)  # → 1–4
-    print(final_scores)
 
-    return final_scores  # length = 12
+app = FastAPI()
 
 
-def generate_3d_obj(image_path):
+def preload():
     """
-    Runs 3DDFA_V2 pipeline on an input image to produce .obj and uv_tex.jpg
+    Loads the read-only artifacts in a parent that is about to fork web
+    workers (serve.py), so they share the pages copy-on-write.  Only things
+    that start no threads are loaded here: ONNX Runtime scorer sessions,
+    MediaPipe graphs and the 3DDFA workers are created by every worker after
+    the fork (warm_up below).  MediaPipe's model files are mmapped, so those
+    pages are shared anyway.
     """
+    names = ["scaler", "front_model", "lateral_model", "basal_model"]
+    if registry.backend in ("eager", "torchscript"):
+        names.append("scorer")
+    registry.warm_up(names)
 
-    # 1️⃣ Make sure the image exists
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    
-    win_results_dir = "/mnt/c/Amal/FYP_REPO/FYP-REPO-/m-frontend-rhino/public/results"
-    os.makedirs(win_results_dir, exist_ok=True)
 
-    # 2️⃣ Generate unique filename
-    image_name = f"{uuid.uuid4().hex}.jpg"
-    input_dir = os.path.expanduser("~/3DDFA_V2/examples/inputs")
-    os.makedirs(input_dir, exist_ok=True)
+@app.on_event("startup")
+def warm_up():
+    # load models + ONNX sessions in the background so the first upload doesn't pay for it
+    if not settings.WARMUP_ON_STARTUP:
+        return
 
-    # Copy or rename to inputs folder
-    new_image_path = os.path.join(input_dir, image_name)
-    subprocess.run(["cp", image_path, new_image_path], check=True)
+    def _warm():
+        try:
+            registry.warm_up()
+        except Exception as e:
+            log.warning("model warm-up failed (will retry on first request): %s", e)
+        try:
+            reconstructor.start()
+        except Exception as e:
+            log.warning("3DDFA worker warm-up failed (will retry on first request): %s", e)
 
-    # 3️⃣ Define working directory
-    work_dir = os.path.expanduser("~/3DDFA_V2")
+    threading.Thread(target=_warm, daemon=True).start()
 
-    # 4️⃣ Activate virtual environment and run demo twice (obj + uv_tex)
-    commands = [
-        f"source venv/bin/activate && python3 demo.py -f examples/inputs/{image_name} -o obj --onnx",
-        f"source venv/bin/activate && python3 demo.py -f examples/inputs/{image_name} -o uv_tex --onnx"
-    ]
 
-    for cmd in commands:
-        subprocess.run(cmd, cwd=work_dir, shell=True, executable="/bin/bash", check=True)
+@app.on_event("startup")
+def start_results_reaper():
+    results.start_reaper()
 
-    # 5️⃣ Return result paths
-    results_dir = os.path.join(work_dir, "examples")
-    results_dir = os.path.join(results_dir, "results")
-    for file in os.listdir(results_dir):
-        if file.startswith(os.path.splitext(image_name)[0]):
-            subprocess.run(["cp", os.path.join(results_dir, file), win_results_dir], check=True)
 
-    obj_file = os.path.join(win_results_dir, f"{os.path.splitext(image_name)[0]}.obj")
+@app.on_event("shutdown")
+def stop_reconstructor():
+    results.stop_reaper()
+    batcher.close()
+    jobs.shutdown()
+    pipeline_pool.shutdown(wait=False, cancel_futures=True)
+    recon_pool.shutdown(wait=False, cancel_futures=True)
+    video_pool.shutdown(wait=False, cancel_futures=True)
+    reconstructor.close()
+    face_meshes.close()
+    face_detectors.close()
 
-    return obj_file
-    
 
+# client supplied ids are kept if they look like ids, anything else is replaced
+REQUEST_ID_RE = re.compile(r"^[\w.-]{1,128}$")
 
 
-app = FastAPI()
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID", "")
+    if not REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # label by route template (/api/jobs/{job_id}), not by the raw path
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=status)
+        log.info("%s %s status=%d ms=%.1f", request.method, request.url.path, status,
+                 (time.perf_counter() - t0) * 1000.0)
+        request_id_var.reset(token)
+
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -500,10 +658,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
+)
+
+jobs = JobManager(
+    max_workers=settings.JOB_WORKERS,
+    max_queued=settings.JOB_QUEUE_SIZE,
+    result_ttl=settings.JOB_RESULT_TTL,
 )
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+async def ingest(files, persist, timings, job_id):
+    with timings.stage("upload_read"):
+        uploads = await read_uploads(files)
+    try:
+        return await run_in_threadpool(ingest_uploads, uploads, persist, timings, job_id)
+    except ValueError as e:
+        results.discard(job_id)
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def with_timings(result, timings, debug):
+    """Attaches the stage breakdown to a response when ?debug=true (or DEBUG_TIMINGS)."""
+    if debug or settings.DEBUG_TIMINGS:
+        result = dict(result, timings_ms=dict(timings.stages))
+    return result
+
 
 @app.post("/api/upload")
 async def upload_images(
@@ -511,50 +691,16 @@ async def upload_images(
     left: UploadFile = File(...),
     right: UploadFile = File(...),
     basal: UploadFile = File(...),
+    persist: bool = Form(False),
+    debug: bool = False,
 ):
-    saved_files: Dict[str, str] = {}
-
-    for name, file in [("front", front), ("left", left), ("right", right), ("basal", basal)]:
-        file_path = os.path.join(UPLOAD_DIR, file.filename or f"{name}.jpg")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        saved_files[name] = file_path
-    print(saved_files)   
-    result = generate_3d_obj(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['front'])
-    print(result)
-    scores = predict_scores(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['front'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['right'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['left'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['basal'])
-    filename = result.split('/')[-1]
-    print(filename)
-
-     # =============================
-    # DELETE ALL FILES IN UPLOAD_DIR
-    # =============================
-    
-    for f in glob.glob(os.path.join(UPLOAD_DIR, "*")):
-        try:
-            os.remove(f)
-        except Exception as e:
-            print("Failed to delete:", f, e)
-    
-    return {
-        "message": "Images uploaded successfully",
-        "saved_files": saved_files,
-        "3d_results": filename,
-        "nose_scores": scores
-    }
-
+    files = {"front": front, "left": left, "right": right, "basal": basal}
+    timings = Timings()
+    job_id = results.create()
+    images, keys, saved_files = await ingest(files, persist, timings, job_id)
+    result = await run_in_threadpool(analyze_patient, images, keys, saved_files, job_id, timings)
+    return with_timings(result, timings, debug)
 
-# ------------------------------
-# Helper to save uploaded files
-# ------------------------------
-def save_uploaded_files(files: Dict[str, UploadFile]) -> Dict[str, str]:
-    saved_files = {}
-    for name, file in files.items():
-        file_path = os.path.join(UPLOAD_DIR, file.filename or f"{name}.jpg")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        saved_files[name] = file_path
-    return saved_files
 
 #-----------------------------------------------------------------------
 
@@ -568,6 +714,8 @@ async def upload_comparison(
     post_left: UploadFile = File(...),
     post_right: UploadFile = File(...),
     post_basal: UploadFile = File(...),
+    persist: bool = Form(False),
+    debug: bool = False,
 ):
     """
     Accepts 8 images:
@@ -575,12 +723,13 @@ async def upload_comparison(
       - Post-Op: post_front, post_left, post_right, post_basal
     Returns:
       - nose scores for pre-op and post-op
-      - 3D OBJ filename (generated only for first pre-op image)
+      - 3D mesh filenames for the pre-op and post-op front images
+      - mesh_diff: per-vertex displacement buffer + nasal region summaries
     """
 
     try:
         # -----------------------------
-        # 1️⃣ Save all uploaded files
+        # 1️⃣ Decode all uploaded files in memory
         # -----------------------------
         files_dict = {
             "front": front,
@@ -592,44 +741,676 @@ async def upload_comparison(
             "post_right": post_right,
             "post_basal": post_basal,
         }
-        saved_files = save_uploaded_files(files_dict)
+        timings = Timings()
+        job_id = results.create()
+        images, keys, saved_files = await ingest(files_dict, persist, timings, job_id)
 
         # -----------------------------
-        # 2️⃣ Predict nose scores
-        # -----------------------------
-        pre_scores = predict_scores(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['front'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['right'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['left'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['basal'])
-        post_scores = predict_scores(r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['post_front'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['post_right'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['post_left'],r"/mnt/c/Amal/FYP_REPO/FYP-REPO-/backend" + "/" + saved_files['post_basal'])
-        # -----------------------------
-        # 3️⃣ Generate 3D OBJ 
+        # 2️⃣-4️⃣ Reconstruct, score, respond
         # -----------------------------
-        obj_file_path = generate_3d_obj(saved_files["front"])
-        obj_filename = os.path.basename(obj_file_path)
+        result = await run_in_threadpool(analyze_comparison, images, keys, saved_files, job_id, timings)
+        return with_timings(result, timings, debug)
 
-        obj_file_path1 = generate_3d_obj(saved_files["post_front"])
-        obj_filename1 = os.path.basename(obj_file_path1)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("comparison failed")
+        return {"error": str(e)}
 
-        # -----------------------------
-        # 4️⃣ Cleanup uploaded files
-        # -----------------------------
-        for f in glob.glob(os.path.join(UPLOAD_DIR, "*")):
+
+# =====================================================
+# 7. Asynchronous jobs: submit -> poll /api/jobs/{id}
+# =====================================================
+
+async def submit_job(kind, fn, files, persist):
+    if jobs.is_full():
+        raise HTTPException(status_code=429, detail="Too many analyses in progress, retry later",
+                            headers={"Retry-After": "5"})
+
+    timings = Timings()
+    job_id = results.create()
+    with timings.stage("ingest"):
+        images, keys, saved_files = await ingest(files, persist, timings, job_id)
+
+    try:
+        job = jobs.submit(kind, fn, images, keys, saved_files, job_id, timings=timings, job_id=job_id)
+    except QueueFull:
+        results.discard(job_id)
+        raise HTTPException(status_code=429, detail="Too many analyses in progress, retry later",
+                            headers={"Retry-After": "5"})
+
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+
+@app.post("/api/jobs/upload")
+async def submit_upload_job(
+    front: UploadFile = File(...),
+    left: UploadFile = File(...),
+    right: UploadFile = File(...),
+    basal: UploadFile = File(...),
+    persist: bool = Form(False),
+):
+    files = {"front": front, "left": left, "right": right, "basal": basal}
+    return await submit_job("upload", analyze_patient, files, persist)
+
+
+@app.post("/api/jobs/upload_comparison")
+async def submit_comparison_job(
+    front: UploadFile = File(...),
+    left: UploadFile = File(...),
+    right: UploadFile = File(...),
+    basal: UploadFile = File(...),
+    post_front: UploadFile = File(...),
+    post_left: UploadFile = File(...),
+    post_right: UploadFile = File(...),
+    post_basal: UploadFile = File(...),
+    persist: bool = Form(False),
+):
+    files = {
+        "front": front, "left": left, "right": right, "basal": basal,
+        "post_front": post_front, "post_left": post_left,
+        "post_right": post_right, "post_basal": post_basal,
+    }
+    return await submit_job("upload_comparison", analyze_comparison, files, persist)
+
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.to_dict()
+
+
+@app.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job.status == "failed":
+        return JSONResponse(status_code=500, content=job.to_dict())
+    if job.status != "done":
+        return JSONResponse(status_code=202, content=job.to_dict())
+    return job.to_dict(with_result=True)
+
+
+# =====================================================
+# 8. Result files (meshes + textures)
+# =====================================================
+
+RESULT_FILE_RE = re.compile(r"^([a-z0-9_]+)(\.glb|_uv_tex\.jpg|_obj\.obj|\.f32)$")
+RESULT_MEDIA_TYPES = {".glb": "model/gltf-binary", "_uv_tex.jpg": "image/jpeg", "_obj.obj": "text/plain",
+                      ".f32": "application/octet-stream"}
+
+
+def decimation_budget(max_triangles):
+    """The largest of DECIMATION_BUDGETS not above max_triangles (the smallest if none is)."""
+    fitting = [n for n in settings.DECIMATION_BUDGETS if n <= max_triangles]
+    return fitting[-1] if fitting else settings.DECIMATION_BUDGETS[0]
+
+
+def decimated_glb(job_id, stem, max_triangles):
+    """<stem>.t<N>.glb, built on first request and kept next to the full mesh."""
+    path = results.path(job_id, f"{stem}.t{max_triangles}.glb")
+    if not os.path.exists(path):
+        job_dir = results.job_dir(job_id)
+        st = os.stat(job_dir)
+        with Timings().stage("decimate"):
+            vertices, colors, faces = read_glb(results.path(job_id, stem + ".glb"))
+            write_glb(path, *decimate(vertices, colors, faces, max_triangles))
+        # a derived file is not new activity: keep the job's age for the reaper's TTL
+        os.utime(job_dir, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return path
+
+
+@app.get("/api/results/{job_id}/{filename}")
+def result_file(job_id: str, filename: str, request: Request, max_triangles: Optional[int] = None):
+    """
+    Serves a mesh / texture of one job.  Job directories are never rewritten
+    once finished, so responses are cacheable forever; Range requests are
+    answered by FileResponse.  ?max_triangles=N returns a decimated .glb
+    (which no longer matches the viewer's landmark anchors), N snapped to
+    one of DECIMATION_BUDGETS.
+    """
+    match = RESULT_FILE_RE.match(filename)
+    if match is None or not JOB_ID_RE.match(job_id) or not os.path.exists(results.path(job_id, filename)):
+        raise HTTPException(status_code=404, detail="Unknown result file")
+    path = results.path(job_id, filename)
+
+    stem, suffix = match.groups()
+    try:
+        if max_triangles is not None and suffix == ".glb":
+            path = decimated_glb(job_id, stem, decimation_budget(max_triangles))
+        st = os.stat(path)
+    except FileNotFoundError:       # reaped meanwhile
+        raise HTTPException(status_code=404, detail="Unknown result file")
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=RESULT_MEDIA_TYPES[suffix], headers=headers, stat_result=st)
+
+
+# =====================================================
+# 9. Scoring without images (landmarks / features from the client)
+# =====================================================
+
+async def read_cases(kind, request, views, timings):
+    """The (N, 4, ...) landmarks / features of a JSON or .npy body (see payloads.py)."""
+    with timings.stage("payload"):
+        body = await request.body()
+        content_type = request.headers.get("content-type", "").split(";")[0].strip()
+        try:
+            if content_type in (NPY_MEDIA_TYPE, "application/octet-stream"):
+                cases = cases_from_npy(kind, body, views)
+            else:
+                cases = cases_from_json(kind, json.loads(body))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if len(cases) > settings.SCORE_MAX_CASES:
+        raise HTTPException(status_code=413, detail=f"At most {settings.SCORE_MAX_CASES} cases per request")
+    return cases
+
+
+async def score_request(kind, request, views, debug):
+    timings = Timings()
+    cases = await read_cases(kind, request, views, timings)
+
+    if kind == "landmarks":
+        scores = await run_in_threadpool(score_landmarks, cases, timings)
+    else:
+        with timings.stage("scoring"):
+            scores = await run_in_threadpool(score_features, cases)
+
+    if NPY_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(to_npy(np.asarray(scores, dtype=np.uint8)), media_type=NPY_MEDIA_TYPE)
+    result = {
+        "count": len(scores),
+        "views_used": [VIEW_ORDER[v] for v in registry.scorer.views_used],
+        "scores": np.asarray(scores).tolist(),
+    }
+    return with_timings(result, timings, debug)
+
+
+@app.post("/api/score/landmarks")
+async def score_landmark_sets(request: Request, views: Optional[str] = None, debug: bool = False):
+    """
+    Scores 15-point landmark sets (geometry.LANDMARK_NAMES order / names) per view,
+    no FaceMesh or 3DDFA involved.  Body: JSON {"cases": [...]} or a
+    (N, V, 15, 2) .npy (application/x-npy).  Accept: application/x-npy
+    returns the (N, 12) scores as a uint8 .npy instead of JSON.
+    """
+    return await score_request("landmarks", request, views, debug)
+
+
+@app.post("/api/score/features")
+async def score_feature_vectors(request: Request, views: Optional[str] = None, debug: bool = False):
+    """Same as /api/score/landmarks with precomputed 42-feature vectors, (N, V, 42) as .npy."""
+    return await score_request("features", request, views, debug)
+
+
+# =====================================================
+# 10. Analysis sessions: replace one view, recompute only what depends on it
+# =====================================================
+
+# a session owns a results directory until it expires
+sessions = SessionManager(ttl=settings.SESSION_TTL, max_sessions=settings.SESSION_MAX, on_expire=results.finish)
+
+
+def update_session(session, images, keys, timings=None):
+    """
+    Applies new / replaced views to a session and recomputes only the nodes
+    downstream of the views whose image actually changed (see sessions.py).
+    Returns the list of recomputed nodes.
+    """
+    timings = timings or Timings()
+    with session.lock, batcher.caller():
+        changed = [v for v in images if session.views.get(v, {}).get("key") != keys[v]]
+        if not changed:
+            return []
+        dirty = dirty_nodes([f"image:{v}" for v in changed])
+        session.revision += 1
+        for v in changed:
+            session.views[v] = {"key": keys[v]}
+        recomputed = []
+        boxes = detect_boxes({v: images[v] for v in changed if v in roi_views()}, keys, timings)
+
+        # 1️⃣ new front photo: new mesh under a new name (old URLs stay cacheable)
+        mesh = None
+        if "mesh" in dirty:
+            mesh = reconstruct_async(images["front"], keys["front"], session.id, timings,
+                                     stem=f"front_r{session.revision}", box=boxes["front"])
+
+        # 2️⃣ landmarks + features of the replaced views only
+        views = [node.split(":", 1)[1] for node in dirty if node.startswith("features:")]
+        if views:
+            features, landmarks = extract_features_batch(
+                [images[v] for v in views], [keys[v] for v in views], timings, return_landmarks=True,
+                boxes=[boxes[v] for v in views],
+            )
+            for v, f, lm in zip(views, features, landmarks):
+                session.views[v].update(landmarks=lm, features=f)
+            recomputed += [node for node in dirty if node.split(":", 1)[0] in ("landmarks", "features")]
+
+        # 3️⃣ the models fed by those views, once their inputs are all there
+        models = [node.split(":", 1)[1] for node in dirty if node.startswith("model:")]
+        models = [m for m in models if "features" in session.views.get(MODEL_VIEWS[MODEL_NAMES.index(m)], {})]
+        if models:
+            features = np.zeros((1, len(VIEW_ORDER), INPUT_FEATURES), dtype=np.float32)
+            for v, state in session.views.items():
+                if "features" in state:
+                    features[0, VIEW_ORDER.index(v)] = state["features"]
+            with timings.stage("scoring"):
+                scores = score_features(features)[0]
+            slices = model_slices()
+            for m in models:
+                session.models[m] = np.asarray(scores[slices[m]]).tolist()
+            recomputed += [f"model:{m}" for m in models]
+
+        if mesh is not None:
+            session.mesh = mesh.result()
+            recomputed.append("mesh")
+
+        session.updated_at = time.time()
+        landmarks = {v: state["landmarks"] for v, state in session.views.items() if "landmarks" in state}
+        save_job(session.id, session.to_dict(), landmarks, timings)
+    return recomputed
+
+
+def session_files(front, left, right, basal):
+    files = {"front": front, "left": left, "right": right, "basal": basal}
+    return {name: f for name, f in files.items() if f is not None}
+
+
+@app.post("/api/sessions")
+async def create_session(
+    front: Optional[UploadFile] = File(None),
+    left: Optional[UploadFile] = File(None),
+    right: Optional[UploadFile] = File(None),
+    basal: Optional[UploadFile] = File(None),
+    persist: bool = Form(False),
+    debug: bool = False,
+):
+    """
+    Starts a session with any of the four views; scores appear once the views
+    the models need are in, the mesh once the front view is.
+    """
+    timings = Timings()
+    session_id = results.create()
+    images, keys, _ = await ingest(session_files(front, left, right, basal), persist, timings, session_id)
+    session = sessions.create(session_id)
+    recomputed = await run_in_threadpool(update_session, session, images, keys, timings)
+    return with_timings(dict(session.to_dict(), recomputed=recomputed), timings, debug)
+
+
+@app.get("/api/sessions/{session_id}")
+def get_session(session_id: str):
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return session.to_dict()
+
+
+@app.patch("/api/sessions/{session_id}")
+async def patch_session(
+    session_id: str,
+    front: Optional[UploadFile] = File(None),
+    left: Optional[UploadFile] = File(None),
+    right: Optional[UploadFile] = File(None),
+    basal: Optional[UploadFile] = File(None),
+    persist: bool = Form(False),
+    debug: bool = False,
+):
+    """Replaces some views; only landmarks / features / models / mesh depending on them are recomputed."""
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    files = session_files(front, left, right, basal)
+    if not files:
+        raise HTTPException(status_code=400, detail="No view to replace")
+
+    timings = Timings()
+    with timings.stage("upload_read"):
+        uploads = await read_uploads(files)
+    try:
+        images, keys, _ = await run_in_threadpool(ingest_uploads, uploads, persist, timings, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    recomputed = await run_in_threadpool(update_session, session, images, keys, timings)
+    return with_timings(dict(session.to_dict(), recomputed=recomputed), timings, debug)
+
+
+@app.delete("/api/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return {"deleted": session_id}
+
+
+# =====================================================
+# 11. Similar cases (scaled feature vectors of past analyses, see case_index.py)
+# =====================================================
+
+def similar_cases(distances, rows):
+    """One query's search() output -> the matching cases, nearest first."""
+    out = []
+    for distance, row in zip(distances, rows):
+        if not np.isfinite(distance):
+            break
+        case = case_index.case(int(row))
+        out.append({
+            "case_id": case["case_id"],
+            "kind": case["kind"],
+            "distance": round(float(distance), 4),
+            "nose_scores": case["nose_scores"],
+            "outcome": case["outcome"],
+            "created_at": case["created_at"],
+        })
+    return out
+
+
+def check_k(k):
+    if not 1 <= k <= settings.SIMILAR_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {settings.SIMILAR_MAX_K}")
+
+
+@app.get("/api/cases/{case_id}/similar")
+def similar_to_case(case_id: str, k: int = 10, approximate: Optional[bool] = None, debug: bool = False):
+    """
+    The k indexed faces closest to an analyzed one (a comparison's pre-op
+    face), itself excluded.  Distances are RMS differences per scaled
+    feature; "outcome" holds the post-op scores of pre-op cases.
+    """
+    check_k(k)
+    rows = case_index.rows(case_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Case not in the index")
+
+    timings = Timings()
+    with timings.stage("similar_search"):
+        distances, found = case_index.search(case_index.vectors(rows[:1]), k, exclude=[rows], approximate=approximate)
+    result = {"case_id": case_id, "similar": similar_cases(distances[0], found[0])}
+    return with_timings(result, timings, debug)
+
+
+@app.post("/api/similar/{kind}")
+async def similar_to_payload(kind: str, request: Request, k: int = 10, views: Optional[str] = None,
+                             approximate: Optional[bool] = None, debug: bool = False):
+    """
+    The k indexed faces closest to each posted case.  kind is "landmarks" or
+    "features", the body is the same as for /api/score/<kind>.
+    """
+    if kind not in ("landmarks", "features"):
+        raise HTTPException(status_code=404, detail="Unknown payload kind")
+    check_k(k)
+    timings = Timings()
+    cases = await read_cases(kind, request, views, timings)
+
+    def search():
+        features = landmark_features(cases) if kind == "landmarks" else cases
+        return case_index.search(case_vectors(features, *registry.get("scaler")), k, approximate=approximate)
+
+    with timings.stage("similar_search"):
+        distances, found = await run_in_threadpool(search)
+    result = {"count": len(cases), "similar": [similar_cases(d, r) for d, r in zip(distances, found)]}
+    return with_timings(result, timings, debug)
+
+
+# =====================================================
+# 12. Streaming uploads: Server-Sent Events as each stage completes
+# =====================================================
+#
+# Same inputs as /api/upload(_comparison), but the response is a
+# text/event-stream:
+#   job        {"job_id"}                                     right away
+#   landmarks  {"case", "view", "landmarks": {name: [x, y]}}  per image
+#   features   {"case", "features": {view: [42 floats]}}
+#   scores     {"case", "model", "scores": {name: score}}     per model
+#   mesh       {"case", "3d_results"}                         per mesh
+#   mesh_diff  (comparisons) same as the JSON response's mesh_diff
+#   result     the JSON response of the non-streaming endpoint, or
+#   error      {"job_id", "error"}
+# "case" is "patient", or "pre" / "post" for a comparison.  Upload errors
+# (missing / undecodable images) are still plain 400 responses.
+
+# analyses of streams whose client went away keep running to completion
+_stream_tasks = set()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_analysis(analyze, images, keys, saved_files, job_id, timings, debug):
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        # called from the pipeline threads
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def run():
+        try:
+            result = await run_in_threadpool(analyze, images, keys, saved_files, job_id, timings, emit=emit)
+            events.put_nowait(("result", with_timings(result, timings, debug)))
+        except Exception as e:
+            log.exception("streamed analysis failed")
+            events.put_nowait(("error", {"job_id": job_id, "error": str(e)}))
+        events.put_nowait(None)
+
+    task = asyncio.ensure_future(run())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def body():
+        yield sse("job", {"job_id": job_id})
+        while True:
             try:
-                os.remove(f)
-            except Exception as e:
-                print("Failed to delete:", f, e)
+                item = await asyncio.wait_for(events.get(), settings.SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            yield sse(*item)
 
-        # -----------------------------
-        # 5️⃣ Return structured response
-        # -----------------------------
-        return {
-            "message": "Pre & Post images processed successfully",
-            "3d_results_pre": obj_filename,
-            "3d_results_post": obj_filename1,
-            "nose_scores": {
-                "pre": pre_scores,   
-                "post": post_scores   
-            }
-        }
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    except Exception as e:
-        return {"error": str(e)}
 
+@app.post("/api/upload/stream")
+async def upload_images_stream(
+    front: UploadFile = File(...),
+    left: UploadFile = File(...),
+    right: UploadFile = File(...),
+    basal: UploadFile = File(...),
+    persist: bool = Form(False),
+    debug: bool = False,
+):
+    """/api/upload as Server-Sent Events: scores arrive while the mesh is still being built."""
+    files = {"front": front, "left": left, "right": right, "basal": basal}
+    timings = Timings()
+    job_id = results.create()
+    images, keys, saved_files = await ingest(files, persist, timings, job_id)
+    return stream_analysis(analyze_patient, images, keys, saved_files, job_id, timings, debug)
+
+
+@app.post("/api/upload_comparison/stream")
+async def upload_comparison_stream(
+    front: UploadFile = File(...),
+    left: UploadFile = File(...),
+    right: UploadFile = File(...),
+    basal: UploadFile = File(...),
+    post_front: UploadFile = File(...),
+    post_left: UploadFile = File(...),
+    post_right: UploadFile = File(...),
+    post_basal: UploadFile = File(...),
+    persist: bool = Form(False),
+    debug: bool = False,
+):
+    """/api/upload_comparison as Server-Sent Events (pre / post events, then mesh_diff)."""
+    files = {
+        "front": front, "left": left, "right": right, "basal": basal,
+        "post_front": post_front, "post_left": post_left, "post_right": post_right, "post_basal": post_basal,
+    }
+    timings = Timings()
+    job_id = results.create()
+    images, keys, saved_files = await ingest(files, persist, timings, job_id)
+    return stream_analysis(analyze_comparison, images, keys, saved_files, job_id, timings, debug)
+
+
+# =====================================================
+# 13. Video / multi-frame capture (FaceMesh tracking, see video.py)
+# =====================================================
+
+# one view is tracked per thread, each with its own FaceMesh in tracking mode
+# (on top of the FACE_MESH_POOL_SIZE instances), so this bounds how many run at once
+video_pool = ThreadPoolExecutor(max_workers=settings.VIDEO_TRACKERS, thread_name_prefix="video")
+
+
+async def read_frame_source(view, uploads, tmp_dir):
+    """
+    One view's uploads -> a FrameSource: one video or a burst of photos, both
+    spooled to disk so frames are decoded one at a time.  At most VIDEO_MAX_MB
+    per view and, for a burst, VIDEO_MAX_FRAMES * VIDEO_FRAME_STRIDE photos.
+    """
+    limit = settings.VIDEO_MAX_MB * 1024 * 1024
+    size = 0
+
+    async def spool(upload, stem, default_ext):
+        nonlocal size
+        ext = os.path.splitext(upload.filename or "")[1].lower()
+        path = os.path.join(tmp_dir, stem + (ext if UPLOAD_EXT_RE.match(ext) else default_ext))
+        with open(path, "wb") as f:
+            while chunk := await upload.read(1 << 20):
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(status_code=413,
+                                        detail=f"The {view} frames are larger than {settings.VIDEO_MAX_MB:g} MB")
+                f.write(chunk)
+        return path
+
+    upload = uploads[0]
+    if len(uploads) == 1 and is_video(upload.filename, upload.content_type):
+        return FrameSource(video_path=await spool(upload, view, ".mp4"))
+
+    max_photos = settings.VIDEO_MAX_FRAMES * settings.VIDEO_FRAME_STRIDE
+    if len(uploads) > max_photos:
+        raise HTTPException(status_code=413, detail=f"At most {max_photos} {view} photos per burst")
+    return FrameSource(images=[await spool(u, f"{view}_{i:04d}", ".jpg") for i, u in enumerate(uploads)])
+
+
+def analyze_video(sources, job_id, aggregate="features", timings=None):
+    """
+    sources : {view: FrameSource} for the views the models use
+    Tracks every view (side by side, one FaceMesh each), scores the averaged
+    features and reconstructs the best front frame.
+    """
+    timings = timings or Timings()
+    try:
+        def track(view):
+            with timings.stage(f"track_{view}"):
+                return track_view(sources[view], view, face_meshes.refine, aggregate=aggregate)
+
+        tracked = dict(zip(sources, video_pool.map(track, list(sources))))
+
+        features = np.zeros((1, len(VIEW_ORDER), INPUT_FEATURES), dtype=np.float32)
+        for view, out in tracked.items():
+            features[0, VIEW_ORDER.index(view)] = out["features"]
+        with timings.stage("scoring"):
+            scores = score_features(features).tolist()[0]
+
+        # the mesh is built from the best front frame, read again at full size
+        filename = None
+        front = sources["front"].frame(tracked["front"]["best_frame"]) if "front" in sources else None
+        if front is not None:
+            box = get_face_box(front, None, timings)
+            with timings.stage("reconstruction"):
+                filename = generate_3d_obj(front, None, job_id, "front", box)
+
+        result = {
+            "message": "Frames processed successfully",
+            "job_id": job_id,
+            "aggregate": aggregate,
+            "views": {view: out["stats"] for view, out in tracked.items()},
+            "3d_results": filename,
+            "nose_scores": scores,
+        }
+        save_job(job_id, result, {view: out["landmarks"] for view, out in tracked.items()}, timings)
+        index_cases([{"case_id": job_id, "kind": "patient", "nose_scores": scores, "outcome": None}],
+                    None, timings, features=features)
+        return result
+    finally:
+        results.finish(job_id)
+
+
+@app.post("/api/upload/video")
+async def upload_video(
+    front: Optional[List[UploadFile]] = File(None),
+    left: Optional[List[UploadFile]] = File(None),
+    right: Optional[List[UploadFile]] = File(None),
+    basal: Optional[List[UploadFile]] = File(None),
+    aggregate: str = Form("features"),
+    debug: bool = False,
+):
+    """
+    A short clip (one video file) or a burst of photos (several image files)
+    per view, for the views the models use (front, basal).  The face is
+    tracked through the frames, the sharpest and best posed ones are kept and
+    their features (aggregate="features") or landmarks ("landmarks")
+    averaged before scoring.  The response also has per-view frame stats.
+    """
+    if aggregate not in ("features", "landmarks"):
+        raise HTTPException(status_code=400, detail='aggregate must be "features" or "landmarks"')
+    given = {"front": front, "left": left, "right": right, "basal": basal}
+    needed = [VIEW_ORDER[v] for v in registry.scorer.views_used]
+    missing = [view for view in needed if not given[view]]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing frames for {missing}")
+
+    timings = Timings()
+    job_id = results.create()
+    with tempfile.TemporaryDirectory(prefix="frames_") as tmp_dir:
+        try:
+            with timings.stage("upload_read"):
+                sources = {view: await read_frame_source(view, given[view], tmp_dir) for view in needed}
+            result = await run_in_threadpool(analyze_video, sources, job_id, aggregate, timings)
+        except ValueError as e:
+            results.discard(job_id)
+            raise HTTPException(status_code=400, detail=str(e))
+        except HTTPException:
+            results.discard(job_id)
+            raise
+    return with_timings(result, timings, debug)
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache")
+def cache_stats():
+    return image_cache.stats()
+
+
+@app.get("/api/storage")
+def storage_stats():
+    return dict(results.stats(), sessions=sessions.stats(), case_index=case_index.stats())
+
+
+@app.get("/api/ready")
+def readiness():
+    """200 once the models are loaded and a 3DDFA worker is up, 503 before."""
+    status = {
+        "models": registry.status(),
+        "reconstruction": reconstructor.status(),
+        "face_mesh": face_meshes.stats(),
+        "batching": batcher.stats() if settings.BATCHING else None,
+        "threads": thread_budget(),
+        "pid": os.getpid(),
+    }
+    status["ready"] = status["models"]["ready"] and status["reconstruction"]["ready"]
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
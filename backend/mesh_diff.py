@@ -0,0 +1,115 @@
+import numpy as np
+
+# =====================================================
+# Pre / post-op mesh difference over the shared 3DDFA topology
+# =====================================================
+#
+# Both meshes come out of the same 3DDFA model, so vertex i of the pre-op mesh
+# and vertex i of the post-op mesh are the same point of the face.  The
+# post-op mesh is aligned onto the pre-op one with a weighted Kabsch /
+# Umeyama fit over the vertices *outside* the nose (the part surgery does not
+# move), then the displacement of every vertex is a single vectorized norm.
+#
+# Regions are spheres around the viewer's anchors (comparison.jsx), which are
+# corners of the old OBJ, i.e. vertex faces.ravel()[corner].  Radii are
+# fractions of the mesh bounding-box diagonal, matching the highlight spheres
+# the viewer draws (radius * scale / 1.8 in its normalized scene).
+
+NASAL_REGIONS = {
+    "radix": (48470, 0.035),
+    "dorsum": (48550, 0.06),
+    "tip": (48600, 0.035),
+    "alar": (48650, 0.04),
+}
+
+# fewer fixed vertices than this and the fit falls back to the whole mesh
+MIN_FIT_VERTICES = 100
+
+
+def anchor_vertices(faces, corners):
+    """OBJ corner indices -> vertex indices (None where the mesh is too small)."""
+    flat = np.asarray(faces).ravel()
+    return [int(flat[c]) if c < flat.size else None for c in corners]
+
+
+def region_masks(vertices, faces, regions=NASAL_REGIONS):
+    """{name: (N,) bool mask} of the vertices inside each region sphere."""
+    diagonal = float(np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)))
+    names = list(regions)
+    anchors = anchor_vertices(faces, [regions[n][0] for n in names])
+
+    masks = {}
+    for name, anchor in zip(names, anchors):
+        if anchor is None:
+            continue
+        radius = regions[name][1] * diagonal
+        masks[name] = np.sum((vertices - vertices[anchor]) ** 2, axis=1) <= radius * radius
+    return masks
+
+
+def kabsch(src, dst, weights=None, with_scale=True):
+    """
+    Best rotation R, uniform scale s and translation t with s * src @ R.T + t ~= dst
+    (least squares, optionally weighted).  Reflections are excluded.
+    """
+    w = np.ones(len(src)) if weights is None else np.asarray(weights, dtype=np.float64)
+    w = w / w.sum()
+    mu_src = w @ src
+    mu_dst = w @ dst
+    a = src - mu_src
+    b = dst - mu_dst
+
+    cov = (b * w[:, None]).T @ a
+    u, sigma, vt = np.linalg.svd(cov)
+    d = np.sign(np.linalg.det(u @ vt)) or 1.0
+    correction = np.array([1.0, 1.0, d])
+    rotation = (u * correction) @ vt
+
+    scale = 1.0
+    if with_scale:
+        var_src = w @ np.sum(a * a, axis=1)
+        scale = float((sigma * correction).sum() / var_src) if var_src > 0 else 1.0
+    translation = mu_dst - scale * mu_src @ rotation.T
+    return rotation, scale, translation
+
+
+def mesh_difference(pre_vertices, post_vertices, faces, with_scale=True):
+    """
+    pre_vertices, post_vertices : (N, 3) float, same vertex order
+    faces                       : (F, 3) shared triangles
+    Returns (displacement (N,) float32 in pre-op mesh units, summary dict).
+    """
+    pre = np.asarray(pre_vertices, dtype=np.float64)
+    post = np.asarray(post_vertices, dtype=np.float64)
+    if pre.shape != post.shape:
+        raise ValueError(f"Meshes do not share a topology: {pre.shape} vs {post.shape}")
+
+    masks = region_masks(pre, faces)
+    nasal = np.zeros(len(pre), dtype=bool)
+    for mask in masks.values():
+        nasal |= mask
+    fixed = ~nasal if (~nasal).sum() >= MIN_FIT_VERTICES else np.ones(len(pre), dtype=bool)
+
+    rotation, scale, translation = kabsch(post[fixed], pre[fixed], with_scale=with_scale)
+    aligned = scale * post @ rotation.T + translation
+    displacement = np.linalg.norm(aligned - pre, axis=1).astype(np.float32)
+
+    regions = {}
+    for name, mask in masks.items():
+        d = displacement[mask]
+        regions[name] = {
+            "vertices": int(mask.sum()),
+            "mean": float(d.mean()) if d.size else 0.0,
+            "max": float(d.max()) if d.size else 0.0,
+            "p95": float(np.percentile(d, 95)) if d.size else 0.0,
+        }
+
+    summary = {
+        "count": int(len(displacement)),
+        "max": float(displacement.max()),
+        "p95": float(np.percentile(displacement, 95)),
+        "fit_rmsd": float(np.sqrt(np.mean(displacement[fixed] ** 2))),
+        "scale": scale,
+        "regions": regions,
+    }
+    return displacement, summary
@@ -0,0 +1,189 @@
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+# =====================================================
+# Compact binary meshes for the 3D viewer (glTF 2.0 / .glb)
+# =====================================================
+#
+# The dense 3DDFA mesh used to reach the browser as a text OBJ.  It is now
+# written as a single .glb with
+#   - positions quantized to int16 (KHR_mesh_quantization), dequantized by
+#     the node's uniform scale + translation
+#   - per-vertex colours as normalized uint8 (this is the texture the viewer
+#     actually draws)
+#   - uint16 / uint32 indices, triangles kept in the OBJ's face order so the
+#     viewer's corner-based anchors (vertexIndex) still point at the same
+#     spots: corner c of the OBJ == vertex index[c] of the glb.
+
+GLB_MAGIC = 0x46546C67          # "glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+SHORT, UNSIGNED_BYTE, UNSIGNED_SHORT, UNSIGNED_INT = 5122, 5121, 5123, 5125
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+
+def _pad4(data, fill=b"\0"):
+    return data + fill * (-len(data) % 4)
+
+
+def quantize_positions(vertices):
+    """(N, 3) float -> (int16 (N, 3), scale, translation) with p = q * scale + translation."""
+    lo = vertices.min(axis=0)
+    extent = float((vertices.max(axis=0) - lo).max()) or 1.0
+    scale = extent / 65535.0
+    q = np.round((vertices - lo) / scale) - 32768
+    translation = lo + 32768 * scale
+    return np.clip(q, -32768, 32767).astype(np.int16), scale, translation
+
+
+def to_glb(vertices, colors, faces):
+    """
+    vertices : (N, 3) float positions
+    colors   : (N, 3) uint8 RGB
+    faces    : (F, 3) int vertex indices
+    Returns the .glb file as bytes.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+    n = len(vertices)
+
+    q, scale, translation = quantize_positions(vertices)
+
+    # vertex attributes must be 4-byte aligned per element: pad to 8 / 4 byte strides
+    pos = np.zeros((n, 4), dtype=np.int16)
+    pos[:, :3] = q
+    col = np.full((n, 4), 255, dtype=np.uint8)
+    col[:, :3] = colors
+    index_type = np.uint16 if n <= 65535 else np.uint32
+    idx = faces.astype(index_type).ravel()
+
+    views, blobs, offset = [], [], 0
+    for blob, stride, target in ((pos.tobytes(), 8, ARRAY_BUFFER),
+                                 (col.tobytes(), 4, ARRAY_BUFFER),
+                                 (idx.tobytes(), None, ELEMENT_ARRAY_BUFFER)):
+        view = {"buffer": 0, "byteOffset": offset, "byteLength": len(blob), "target": target}
+        if stride:
+            view["byteStride"] = stride
+        views.append(view)
+        blob = _pad4(blob)
+        blobs.append(blob)
+        offset += len(blob)
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "nose-backend"},
+        "extensionsUsed": ["KHR_mesh_quantization"],
+        "extensionsRequired": ["KHR_mesh_quantization"],
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "scale": [scale] * 3, "translation": [float(t) for t in translation]}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "COLOR_0": 1}, "indices": 2, "mode": 4}]}],
+        "accessors": [
+            {"bufferView": 0, "componentType": SHORT, "count": n, "type": "VEC3",
+             "min": q.min(axis=0).tolist(), "max": q.max(axis=0).tolist()},
+            {"bufferView": 1, "componentType": UNSIGNED_BYTE, "normalized": True, "count": n, "type": "VEC3"},
+            {"bufferView": 2, "componentType": UNSIGNED_SHORT if index_type is np.uint16 else UNSIGNED_INT,
+             "count": int(idx.size), "type": "SCALAR"},
+        ],
+        "bufferViews": views,
+        "buffers": [{"byteLength": offset}],
+    }
+
+    json_chunk = _pad4(json.dumps(gltf, separators=(",", ":")).encode(), b" ")
+    bin_chunk = b"".join(blobs)
+    total = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+    return b"".join([
+        struct.pack("<III", GLB_MAGIC, 2, total),
+        struct.pack("<II", len(json_chunk), CHUNK_JSON), json_chunk,
+        struct.pack("<II", len(bin_chunk), CHUNK_BIN), bin_chunk,
+    ])
+
+
+def write_glb(path, vertices, colors, faces):
+    data = to_glb(vertices, colors, faces)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+def read_glb(path):
+    """Reads back a .glb written by to_glb -> (vertices float32, colors uint8, faces)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, _, _ = struct.unpack_from("<III", data, 0)
+    if magic != GLB_MAGIC:
+        raise ValueError(f"{path} is not a glb file")
+    json_len, _ = struct.unpack_from("<II", data, 12)
+    gltf = json.loads(data[20:20 + json_len])
+    bin_start = 20 + json_len + 8
+
+    def accessor(i, dtype, width):
+        acc = gltf["accessors"][i]
+        view = gltf["bufferViews"][acc["bufferView"]]
+        itemsize = np.dtype(dtype).itemsize
+        stride = view.get("byteStride", itemsize * width) // itemsize
+        raw = np.frombuffer(data, dtype=dtype, count=view["byteLength"] // itemsize,
+                            offset=bin_start + view["byteOffset"])
+        return raw.reshape(-1, stride)[:acc["count"], :width]
+
+    node = gltf["nodes"][0]
+    q = accessor(0, np.int16, 3)
+    vertices = (q * np.float64(node["scale"][0]) + np.asarray(node["translation"])).astype(np.float32)
+    colors = accessor(1, np.uint8, 3)
+    index_dtype = np.uint16 if gltf["accessors"][2]["componentType"] == UNSIGNED_SHORT else np.uint32
+    faces = accessor(2, index_dtype, 1).reshape(-1, 3)
+    return vertices, colors.copy(), faces.astype(np.int64)
+
+
+# -----------------------------
+# Decimation (vertex clustering)
+# -----------------------------
+def cluster_vertices(vertices, colors, faces, resolution):
+    """Merges all vertices inside each cell of a resolution^3 grid."""
+    lo = vertices.min(axis=0)
+    extent = float((vertices.max(axis=0) - lo).max()) or 1.0
+    cell = np.minimum(((vertices - lo) / extent * resolution).astype(np.int64), resolution - 1)
+    key = (cell[:, 0] * resolution + cell[:, 1]) * resolution + cell[:, 2]
+    _, cluster, counts = np.unique(key, return_inverse=True, return_counts=True)
+
+    m = len(counts)
+    new_vertices = np.zeros((m, 3))
+    np.add.at(new_vertices, cluster, vertices)
+    new_vertices /= counts[:, None]
+    new_colors = np.zeros((m, 3))
+    np.add.at(new_colors, cluster, colors)
+    new_colors = np.round(new_colors / counts[:, None]).astype(np.uint8)
+
+    f = cluster[faces]
+    keep = (f[:, 0] != f[:, 1]) & (f[:, 1] != f[:, 2]) & (f[:, 0] != f[:, 2])
+    f = f[keep]
+    # drop duplicates but keep first-seen order and winding
+    _, first = np.unique(np.sort(f, axis=1), axis=0, return_index=True)
+    return new_vertices, new_colors, f[np.sort(first)]
+
+
+def decimate(vertices, colors, faces, max_triangles):
+    """
+    Binary search for the finest clustering grid that fits the triangle
+    budget.  Decimated meshes no longer match the viewer's vertex anchors.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if len(faces) <= max_triangles:
+        return vertices, colors, faces
+
+    best = None
+    lo, hi = 2, 1024
+    while lo <= hi:
+        res = (lo + hi) // 2
+        out = cluster_vertices(vertices, colors, faces, res)
+        if len(out[2]) <= max_triangles:
+            best, lo = out, res + 1
+        else:
+            hi = res - 1
+    return best if best is not None else cluster_vertices(vertices, colors, faces, 2)
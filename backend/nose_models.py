@@ -0,0 +1,244 @@
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from scoring import FusedNoseScorer, OnnxScorer, TorchScriptScorer, VIEW_ORDER
+
+# =====================================================
+# Nose score classifiers (one per view)
+# =====================================================
+
+INPUT_FEATURES = 42
+NUM_CLASSES = 4
+NUM_TASKS = 12
+OUTPUT_FEATURES = NUM_TASKS * NUM_CLASSES
+
+BATCH_SIZE = 16
+EPOCHS = 200
+LR = 0.001
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+# =====================================================
+# Frontal view model
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+INPUT_FEATURES2 = 42
+NUM_CLASSES2 = 4
+NUM_TASKS2 = 2   # <---- ONLY TWO OUTPUTS NOW
+
+BATCH_SIZE2 = 16
+EPOCHS2 = 200
+LR2 = 0.001
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class NoseScoreClassifier2(nn.Module):
+    def __init__(self):
+        super().__init__()
+
+        self.backbone = nn.Sequential(
+            nn.Linear(INPUT_FEATURES2, 64),
+            nn.ReLU(),
+            nn.Linear(64, 128),
+            nn.ReLU(),
+            nn.Linear(128, 64),
+            nn.ReLU(),
+        )
+
+        # ONLY TWO HEADS NOW
+        self.heads = nn.ModuleList([nn.Linear(64, NUM_CLASSES2) for _ in range(NUM_TASKS2)])
+
+        self.apply(self._init_weights)
+
+    def _init_weights(self, m):
+        if isinstance(m, nn.Linear):
+            nn.init.kaiming_normal_(m.weight)
+            nn.init.zeros_(m.bias)
+
+    def forward(self, x):
+        shared = self.backbone(x)
+        return [head(shared) for head in self.heads]
+    
+
+# =====================================================
+# Lateral view model
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+INPUT_FEATURES3 = 42
+NUM_CLASSES3 = 4
+NUM_TASKS3 = 8   # <---- NOW 8 OUTPUTS
+
+BATCH_SIZE3 = 16
+EPOCHS3 = 200
+LR3 = 0.001
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class NoseScoreClassifier3(nn.Module):
+    def __init__(self):
+        super().__init__()
+
+        self.backbone = nn.Sequential(
+            nn.Linear(INPUT_FEATURES3, 64),
+            nn.ReLU(),
+            nn.Linear(64, 128),
+            nn.ReLU(),
+            nn.Linear(128, 64),
+            nn.ReLU(),
+        )
+
+        # ---------- 8 output heads ----------
+        self.heads = nn.ModuleList(
+            [nn.Linear(64, NUM_CLASSES3) for _ in range(NUM_TASKS3)]
+        )
+
+        self.apply(self._init_weights)
+
+    def _init_weights(self, m):
+        if isinstance(m, nn.Linear):
+            nn.init.kaiming_normal_(m.weight)
+            nn.init.zeros_(m.bias)
+
+    def forward(self, x):
+        shared = self.backbone(x)
+        return [head(shared) for head in self.heads]
+    
+
+# =====================================================
+# Basal view model
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+INPUT_FEATURES4 = 42        # 7 angles + 5 ratios + 30 landmark coords
+NUM_CLASSES4 = 4            # scores 1–4
+NUM_TASKS4 = 2              # Basal view has 2 output scores
+BATCH_SIZE4 = 16
+EPOCHS4 = 200
+LR4 = 0.001
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+# -----------------------------
+# MODEL
+# -----------------------------
+class NoseBasalClassifier(nn.Module):
+    def __init__(self):
+        super().__init__()
+
+        # shared backbone
+        self.backbone = nn.Sequential(
+            nn.Linear(INPUT_FEATURES4, 64),
+            nn.ReLU(),
+            nn.Linear(64, 128),
+            nn.ReLU(),
+            nn.Linear(128, 64),
+            nn.ReLU(),
+        )
+
+        # ---- 2 output heads ----
+        self.heads = nn.ModuleList([
+            nn.Linear(64, NUM_CLASSES4) for _ in range(NUM_TASKS4)
+        ])
+
+        self.apply(self._init_weights)
+
+    def _init_weights(self, m):
+        if isinstance(m, nn.Linear):
+            nn.init.kaiming_normal_(m.weight)
+            nn.init.zeros_(m.bias)
+
+    def forward(self, x):
+        shared = self.backbone(x)
+        return [head(shared) for head in self.heads]
+
+
+# =====================================================
+# Fused scorer (front + lateral + basal in one pass)
+# =====================================================
+
+# NOTE: the lateral model has always been fed the *front* view features,
+# keep it that way so the shipped scores do not change.
+MODEL_VIEWS = ["front", "front", "basal"]
+# heads per model, same order: model i owns the next MODEL_TASKS[i] of the 12 scores
+MODEL_TASKS = [NUM_TASKS2, NUM_TASKS3, NUM_TASKS4]
+
+# the 12 scores in output order, as labelled in the 3D viewer
+SCORE_NAMES = [
+    "Dorsum", "Width of Dorsum", "Tip Shape and Symmetry", "Saddle", "Hump", "Nasal Length",
+    "Radix", "Alar Columellar Relation", "Tip Projection", "Tip Rotation", "Alar Flaring",
+    "Nostril Ratio",
+]
+
+MODEL_FILES = {
+    "front": "nose_twohead_model.pth",
+    "lateral": "nose_8head_model.pth",
+    "basal": "nose_basal_model.pth",
+}
+SCALER_FILES = {"mean": "scaler_mean.npy", "scale": "scaler_scale.npy"}
+
+
+def build_scorer(front_model, lat_model, basal_model, scaler_mean, scaler_scale):
+    return FusedNoseScorer(
+        [front_model, lat_model, basal_model],
+        view_index=[VIEW_ORDER.index(v) for v in MODEL_VIEWS],
+        scaler_mean=scaler_mean,
+        scaler_scale=scaler_scale,
+    )
+
+
+MODEL_CLASSES = {
+    "front": NoseScoreClassifier2,
+    "lateral": NoseScoreClassifier3,
+    "basal": NoseBasalClassifier,
+}
+
+
+def load_model(name, model_dir):
+    """Loads one of the "front" / "lateral" / "basal" classifiers from model_dir."""
+    model = MODEL_CLASSES[name]()
+    model.load_state_dict(torch.load(os.path.join(model_dir, MODEL_FILES[name]), map_location="cpu"))
+    model.eval()
+    return model
+
+
+def load_scaler(model_dir):
+    """Returns (scaler_mean, scaler_scale), both of shape (42,)."""
+    return (np.load(os.path.join(model_dir, SCALER_FILES["mean"])),
+            np.load(os.path.join(model_dir, SCALER_FILES["scale"])))
+
+
+def load_scorer(model_dir):
+    """Loads the three .pth files + scaler arrays from model_dir into a FusedNoseScorer."""
+    models = [load_model(name, model_dir) for name in ("front", "lateral", "basal")]
+    return build_scorer(*models, *load_scaler(model_dir))
+
+
+# -----------------------------
+# Exported runtimes (written by export_models.py)
+# -----------------------------
+EXPORT_FILES = {
+    "torchscript": "nose_scorer.ts.pt",
+    "onnx": "nose_scorer.onnx",
+    "onnx-int8": "nose_scorer.int8.onnx",
+}
+SCORER_BACKENDS = ["eager"] + list(EXPORT_FILES)
+
+
+def load_exported_scorer(backend, model_dir, threads=1):
+    """Loads the fused scorer exported for "torchscript" / "onnx" / "onnx-int8"."""
+    path = os.path.join(model_dir, EXPORT_FILES[backend])
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, run export_models.py first")
+    if backend == "torchscript":
+        return TorchScriptScorer(path, threads)
+    return OnnxScorer(path, threads)
@@ -0,0 +1,107 @@
+import io
+
+import numpy as np
+
+from geometry import LANDMARK_NAMES, NUM_LANDMARKS, labelnum_to_name
+from nose_models import INPUT_FEATURES
+from scoring import VIEW_ORDER
+
+# =====================================================
+# Landmark / feature payloads of the scoring API
+# =====================================================
+#
+# /api/score/landmarks and /api/score/features take either
+#   - JSON: {"cases": [{"front": ..., "basal": ...}, ...]} where a landmark set
+#     is a list of 15 [x, y] pairs in labelnum order or {"N": [x, y], ...}
+#     (labelnum_to_name names, or "1".."15"), null for a missing point; a
+#     feature vector is a list of 42 numbers
+#   - a .npy body (Content-Type application/x-npy) of shape (N, V, 15, 2) or
+#     (N, V, 42), V in VIEW_ORDER unless ?views=front,basal says otherwise
+# and are turned into one (N, 4, ...) float array in VIEW_ORDER.  Views that
+# are not sent are NaN landmarks (like a face FaceMesh could not find) or
+# zero features.
+
+NPY_MEDIA_TYPE = "application/x-npy"
+
+_LANDMARK_INDEX = {name: i for i, name in enumerate(LANDMARK_NAMES)}
+_LANDMARK_INDEX.update({str(num): num - 1 for num in labelnum_to_name})
+
+SHAPES = {"landmarks": (NUM_LANDMARKS, 2), "features": (INPUT_FEATURES,)}
+
+
+def parse_views(views):
+    """'front,basal' -> [0, 3] (default: all of VIEW_ORDER)."""
+    if not views:
+        return list(range(len(VIEW_ORDER)))
+    names = [v.strip() for v in views.split(",") if v.strip()]
+    unknown = [v for v in names if v not in VIEW_ORDER]
+    if unknown:
+        raise ValueError(f"Unknown views {unknown}, expected some of {list(VIEW_ORDER)}")
+    return [VIEW_ORDER.index(v) for v in names]
+
+
+def empty_cases(kind, n):
+    fill = np.nan if kind == "landmarks" else 0.0
+    return np.full((n, len(VIEW_ORDER)) + SHAPES[kind], fill, dtype=np.float32)
+
+
+def _landmark_set(value):
+    """One landmark set from JSON -> (15, 2), NaN rows for missing points."""
+    out = np.full((NUM_LANDMARKS, 2), np.nan, dtype=np.float32)
+    if isinstance(value, dict):
+        for name, point in value.items():
+            if name not in _LANDMARK_INDEX:
+                raise ValueError(f"Unknown landmark {name!r}")
+            if point is not None:
+                out[_LANDMARK_INDEX[name]] = point
+        return out
+    if len(value) != NUM_LANDMARKS:
+        raise ValueError(f"Expected {NUM_LANDMARKS} landmarks, got {len(value)}")
+    for i, point in enumerate(value):
+        if point is not None:
+            out[i] = point
+    return out
+
+
+def cases_from_json(kind, body):
+    cases = body.get("cases") if isinstance(body, dict) else None
+    if not isinstance(cases, list):
+        raise ValueError('Expected {"cases": [...]}')
+
+    out = empty_cases(kind, len(cases))
+    for i, case in enumerate(cases):
+        if not isinstance(case, dict):
+            raise ValueError(f"Case {i} is not an object")
+        for view, value in case.items():
+            if view not in VIEW_ORDER:
+                raise ValueError(f"Case {i}: unknown view {view!r}")
+            try:
+                if kind == "landmarks":
+                    out[i, VIEW_ORDER.index(view)] = _landmark_set(value)
+                else:
+                    out[i, VIEW_ORDER.index(view)] = np.asarray(value, dtype=np.float32).reshape(SHAPES[kind])
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Case {i}, {view}: {e}")
+    return out
+
+
+def cases_from_npy(kind, data, views=None):
+    try:
+        array = np.lib.format.read_array(io.BytesIO(data), allow_pickle=False)
+    except (ValueError, OSError) as e:
+        raise ValueError(f"Not a .npy array: {e}")
+
+    view_index = parse_views(views)
+    expected = (len(view_index),) + SHAPES[kind]
+    if array.ndim != len(expected) + 1 or array.shape[1:] != expected:
+        raise ValueError(f"Expected an (N, {', '.join(map(str, expected))}) array, got {array.shape}")
+
+    out = empty_cases(kind, len(array))
+    out[:, view_index] = array
+    return out
+
+
+def to_npy(array):
+    buf = io.BytesIO()
+    np.save(buf, array, allow_pickle=False)
+    return buf.getvalue()
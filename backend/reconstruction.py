@@ -0,0 +1,207 @@
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client
+
+import numpy as np
+
+import settings
+from meshes import write_glb
+from roi import crop_face
+
+# =====================================================
+# Client for the resident 3DDFA_V2 worker (tddfa_worker.py)
+# =====================================================
+
+WORKER_SCRIPT = os.path.join(settings.BACKEND_DIR, "tddfa_worker.py")
+
+
+class ReconstructionError(RuntimeError):
+    pass
+
+
+class ReconstructionWorker:
+    """
+    Keeps one 3DDFA_V2 process alive with its ONNX sessions loaded and talks
+    to it over a unix socket.  The process is started lazily on first use and
+    restarted if it dies.
+    """
+
+    def __init__(self, tddfa_dir=settings.TDDFA_DIR, python=settings.TDDFA_PYTHON,
+                 config=settings.TDDFA_CONFIG, startup_timeout=settings.TDDFA_STARTUP_TIMEOUT,
+                 threads=settings.TDDFA_THREADS):
+        self.tddfa_dir = tddfa_dir
+        self.python = python
+        self.config = config
+        self.startup_timeout = startup_timeout
+        self.threads = threads
+
+        self._proc = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._owner_pid = None
+
+    def _new_address(self):
+        # per process: web workers forked by serve.py must not share the socket
+        self._owner_pid = os.getpid()
+        self._authkey = os.urandom(16)
+        self._address = os.path.join(tempfile.mkdtemp(prefix="tddfa_"), "worker.sock")
+
+    # -----------------------------
+    # process management
+    # -----------------------------
+    def _alive(self):
+        return self._proc is not None and self._proc.poll() is None and self._conn is not None
+
+    def _start(self):
+        self._stop()
+        if self._owner_pid != os.getpid():
+            self._new_address()
+        if os.path.exists(self._address):
+            os.remove(self._address)
+
+        env = dict(os.environ, TDDFA_WORKER_AUTHKEY=self._authkey.hex(), OMP_NUM_THREADS=str(self.threads))
+        self._proc = subprocess.Popen(
+            [self.python, WORKER_SCRIPT, "--address", self._address, "--config", self.config],
+            cwd=self.tddfa_dir,
+            env=env,
+        )
+
+        # the worker opens its socket only after the models are loaded
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self._proc.poll() is not None:
+                raise ReconstructionError(f"3DDFA worker exited with code {self._proc.returncode}")
+            if os.path.exists(self._address):
+                try:
+                    self._conn = Client(self._address, family="AF_UNIX", authkey=self._authkey)
+                    return
+                except (ConnectionRefusedError, FileNotFoundError):
+                    pass
+            if time.monotonic() > deadline:
+                self._stop()
+                raise ReconstructionError("3DDFA worker did not become ready in time")
+            time.sleep(0.05)
+
+    def _stop(self):
+        if self._conn is not None:
+            try:
+                self._conn.send({"op": "shutdown"})
+            except (OSError, EOFError):
+                pass
+            self._conn.close()
+            self._conn = None
+        if self._proc is not None:
+            try:
+                self._proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+            self._proc = None
+
+    def start(self):
+        with self._lock:
+            if not self._alive():
+                self._start()
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def is_alive(self):
+        return self._alive()
+
+    # -----------------------------
+    # requests
+    # -----------------------------
+    def _call(self, msg):
+        with self._lock:
+            for attempt in range(2):
+                if not self._alive():
+                    self._start()
+                try:
+                    self._conn.send(msg)
+                    reply = self._conn.recv()
+                    break
+                except (OSError, EOFError):
+                    # worker died mid-request: restart once and retry
+                    self._conn = None
+                    if attempt == 1:
+                        raise ReconstructionError("3DDFA worker connection lost")
+
+        if not reply["ok"]:
+            raise ReconstructionError(reply["error"])
+        return reply
+
+    def reconstruct(self, image, stem, out_dir, write_obj=settings.WRITE_OBJ, box=None):
+        """
+        image : decoded BGR image (H, W, 3) uint8 array
+        box   : optional (x0, y0, x1, y1) face box from roi.detect_face_box;
+                only a crop around it is sent and FaceBoxes is skipped
+        Produces {out_dir}/{stem}.glb and {out_dir}/{stem}_uv_tex.jpg
+        (+ the legacy {out_dir}/{stem}_obj.obj when write_obj)
+        Returns {"glb": path, "uv_tex": path[, "obj": path]}
+        """
+        crop = None
+        msg = {"op": "reconstruct", "stem": stem, "out_dir": out_dir, "write_obj": write_obj}
+        if box is not None:
+            crop = crop_face(image, box, settings.RECON_ROI_MARGIN, settings.RECON_ROI_SIDE)
+            msg["box"] = crop.from_full(np.reshape(box, (2, 2))).ravel().tolist()
+        sent = crop.image if crop is not None else image
+        msg.update(image=sent.tobytes(), shape=sent.shape, dtype=str(sent.dtype))
+        reply = self._call(msg)
+
+        mesh = reply["mesh"]
+        vertices = np.frombuffer(mesh["vertices"], dtype=np.float32).reshape(mesh["n_vertices"], 3)
+        if crop is not None:
+            vertices = crop_to_full(vertices, crop, image.shape[0])
+        colors = np.frombuffer(mesh["colors"], dtype=np.uint8).reshape(mesh["n_vertices"], 3)
+        faces = np.frombuffer(mesh["faces"], dtype=np.uint32).reshape(mesh["n_faces"], 3)
+
+        files = dict(reply["files"])
+        files["glb"] = write_glb(os.path.join(out_dir, f"{stem}.glb"), vertices, colors, faces)
+        return files
+
+
+def crop_to_full(vertices, crop, height):
+    """Mesh vertices fitted on a crop (y flipped by the crop height) -> full image frame."""
+    v = vertices.astype(np.float64)
+    v[:, 1] = crop.image.shape[0] - v[:, 1]
+    v[:, :2] = crop.to_full(v[:, :2])
+    v[:, 2] /= crop.scale
+    v[:, 1] = height - v[:, 1]
+    return v.astype(np.float32)
+
+
+class ReconstructionPool:
+    """
+    A fixed set of resident workers; each reconstruct() call checks one out,
+    so up to `size` images are reconstructed in parallel.
+    """
+
+    def __init__(self, size=settings.TDDFA_WORKERS, **kwargs):
+        self.workers = [ReconstructionWorker(**kwargs) for _ in range(size)]
+        self._idle = queue.Queue()
+        for w in self.workers:
+            self._idle.put(w)
+
+    def start(self):
+        for w in self.workers:
+            w.start()
+
+    def close(self):
+        for w in self.workers:
+            w.close()
+
+    def status(self):
+        alive = sum(w.is_alive() for w in self.workers)
+        return {"ready": alive > 0, "workers": len(self.workers), "alive": alive}
+
+    def reconstruct(self, image, stem, out_dir, **kwargs):
+        worker = self._idle.get()
+        try:
+            return worker.reconstruct(image, stem, out_dir, **kwargs)
+        finally:
+            self._idle.put(worker)
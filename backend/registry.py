@@ -0,0 +1,92 @@
+import threading
+import time
+
+import torch
+
+import settings
+from nose_models import build_scorer, load_exported_scorer, load_model, load_scaler
+
+# =====================================================
+# Model registry: lazily loaded, shared read-only artifacts
+# =====================================================
+#
+# Nothing is loaded at import time.  Each artifact is loaded on first use
+# (or by warm_up()) from the configured MODEL_DIR, exactly once per process,
+# and its load time is recorded so cold starts can be compared across workers.
+
+# reference point for "how long until this worker could serve"
+IMPORTED_AT = time.time()
+
+
+class ModelRegistry:
+    def __init__(self, model_dir=settings.MODEL_DIR, backend=settings.SCORER_BACKEND,
+                 threads=settings.SCORER_THREADS):
+        self.model_dir = model_dir
+        self.backend = backend
+        self.threads = threads
+        self._loaders = {
+            "scaler": lambda: load_scaler(self.model_dir),
+            "front_model": lambda: load_model("front", self.model_dir),
+            "lateral_model": lambda: load_model("lateral", self.model_dir),
+            "basal_model": lambda: load_model("basal", self.model_dir),
+            "scorer": self._load_scorer,
+        }
+        self._items = {}
+        self._load_ms = {}
+        self._errors = {}
+        self._locks = {name: threading.Lock() for name in self._loaders}
+        self._ready_at = None
+
+    def _load_scorer(self):
+        if self.backend != "eager":
+            return load_exported_scorer(self.backend, self.model_dir, self.threads)
+        torch.set_num_threads(self.threads)
+        return build_scorer(
+            self.get("front_model"), self.get("lateral_model"), self.get("basal_model"),
+            *self.get("scaler"),
+        )
+
+    def get(self, name):
+        item = self._items.get(name)
+        if item is not None:
+            return item
+
+        with self._locks[name]:
+            if name not in self._items:
+                t0 = time.perf_counter()
+                try:
+                    self._items[name] = self._loaders[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._errors.pop(name, None)
+                self._load_ms[name] = round((time.perf_counter() - t0) * 1000.0, 3)
+                if self._ready_at is None and all(n in self._items for n in self._loaders):
+                    self._ready_at = time.time()
+        return self._items[name]
+
+    @property
+    def scorer(self):
+        return self.get("scorer")
+
+    def warm_up(self, names=None):
+        """Loads the given artifacts (default: all) now instead of on first use."""
+        for name in names or self._loaders:
+            self.get(name)
+
+    def is_ready(self):
+        return all(name in self._items for name in self._loaders)
+
+    def status(self):
+        out = {
+            "ready": self.is_ready(),
+            "model_dir": self.model_dir,
+            "backend": self.backend,
+            "loaded": sorted(self._items),
+            "load_ms": dict(self._load_ms),
+        }
+        if self._errors:
+            out["errors"] = dict(self._errors)
+        if self._ready_at is not None:
+            out["ready_after_import_ms"] = round((self._ready_at - IMPORTED_AT) * 1000.0, 3)
+        return out
@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+import settings
+from landmarks import detect_landmarks
+
+# =====================================================
+# One face detection per image, shared by landmarking and reconstruction
+# =====================================================
+#
+# The face box is found once on a downscaled copy of the photo.  Each
+# consumer then gets its own crop around it, rescaled to what it needs:
+#   - FaceMesh: a FACE_MESH_ROI_SIDE crop (its model works at 192 px anyway)
+#   - 3DDFA_V2: a RECON_ROI_SIDE crop plus the box, so FaceBoxes is skipped
+# and its results are mapped back to full-image pixels, so features, meshes
+# and anchors are in the same frame as before.  Crops are only ever
+# downscaled.  No face found -> None, and both consumers fall back to the
+# full photo.
+
+
+def create_face_detector():
+    import mediapipe as mp
+
+    # full-range model: clinical photos range from tight head shots to half body
+    return mp.solutions.face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
+
+
+def detect_face_box(img, detector, max_side=settings.DETECT_MAX_SIDE):
+    """
+    img : decoded BGR image
+    Returns the most confident face as an (x0, y0, x1, y1) float pixel box of
+    the full image, or None.
+    """
+    h, w = img.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    small = cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else img
+    results = detector.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+    if not results.detections:
+        return None
+
+    best = max(results.detections, key=lambda d: d.score[0])
+    box = best.location_data.relative_bounding_box
+    x0, y0 = max(box.xmin, 0.0) * w, max(box.ymin, 0.0) * h
+    x1, y1 = min(box.xmin + box.width, 1.0) * w, min(box.ymin + box.height, 1.0) * h
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1, y1)
+
+
+class Crop:
+    """A rescaled window of an image: full = crop_pixel / scale + origin."""
+
+    def __init__(self, image, origin, scale):
+        self.image = image
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.scale = scale
+
+    def to_full(self, points):
+        """(..., 2) crop pixel coordinates -> full image pixels."""
+        return np.asarray(points, dtype=np.float64) / self.scale + self.origin
+
+    def from_full(self, points):
+        return (np.asarray(points, dtype=np.float64) - self.origin) * self.scale
+
+
+def crop_face(img, box, margin, max_side):
+    """
+    Square window around box, grown by `margin` box sides on every side,
+    clipped to the image and downscaled to at most max_side pixels.
+    """
+    h, w = img.shape[:2]
+    x0, y0, x1, y1 = box
+    side = max(x1 - x0, y1 - y0) * (1.0 + 2.0 * margin)
+    cx, cy = (x0 + x1) / 2.0, (y0 + y1) / 2.0
+    left, top = int(max(cx - side / 2.0, 0)), int(max(cy - side / 2.0, 0))
+    right, bottom = int(min(cx + side / 2.0, w)), int(min(cy + side / 2.0, h))
+
+    window = img[top:bottom, left:right]
+    scale = min(1.0, max_side / max(window.shape[:2]))
+    if scale < 1.0:
+        window = cv2.resize(window, (round(window.shape[1] * scale), round(window.shape[0] * scale)),
+                            interpolation=cv2.INTER_AREA)
+    return Crop(np.ascontiguousarray(window), (left, top), scale)
+
+
+def landmarks_in_box(img, box, face_mesh):
+    """
+    FaceMesh landmarks (full-image pixels) of a FACE_MESH_ROI crop around box.
+    The full photo is used when box is None or FaceMesh finds nothing in the crop.
+    """
+    if box is not None:
+        crop = crop_face(img, box, settings.FACE_MESH_ROI_MARGIN, settings.FACE_MESH_ROI_SIDE)
+        landmarks = crop.to_full(detect_landmarks(crop.image, face_mesh))
+        if not np.isnan(landmarks).all():
+            return landmarks
+    return detect_landmarks(img, face_mesh)
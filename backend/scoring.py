@@ -0,0 +1,148 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+# =====================================================
+# Fused multi-view scoring engine
+# =====================================================
+#
+# The front, lateral and basal classifiers all share the same
+# 42 -> 64 -> 128 -> 64 backbone and only differ in how many 4-class heads
+# they carry (2 / 8 / 2).  Their weights are stacked once into batched
+# tensors so that:
+#   - the three backbones run as one bmm per layer,
+#   - all heads of all models run as one bmm,
+#   - the argmax for all 12 tasks is a single vectorized step,
+# for any number of patients at once.
+
+VIEW_ORDER = ("front", "right", "left", "basal")
+
+
+class FusedNoseScorer(nn.Module):
+    def __init__(self, models, view_index, scaler_mean, scaler_scale):
+        """
+        models      : list of NoseScoreClassifier2 / 3 / NoseBasalClassifier,
+                      in the order their heads appear in the 12 scores
+        view_index  : for every model, the index in VIEW_ORDER of the view
+                      whose features it consumes
+        scaler_mean, scaler_scale : the (42,) StandardScaler arrays
+        """
+        super().__init__()
+
+        num_tasks = [len(m.heads) for m in models]
+        num_classes = models[0].heads[0].out_features
+        max_tasks = max(num_tasks)
+
+        self.num_models = len(models)
+        self.num_classes = num_classes
+        self.max_tasks = max_tasks
+        self.num_tasks = sum(num_tasks)
+        self.views_used = sorted(set(view_index))
+
+        # ---------- stacked backbone weights: (M, in, out) ----------
+        for layer, idx in (("1", 0), ("2", 2), ("3", 4)):
+            w = torch.stack([m.backbone[idx].weight.detach().t() for m in models])
+            b = torch.stack([m.backbone[idx].bias.detach().unsqueeze(0) for m in models])
+            self.register_buffer("w" + layer, w.contiguous())
+            self.register_buffer("b" + layer, b.contiguous())
+
+        # ---------- all heads of one model concatenated, padded to max_tasks ----------
+        hidden = models[0].backbone[4].out_features
+        head_w = torch.zeros(self.num_models, hidden, max_tasks * num_classes)
+        head_b = torch.zeros(self.num_models, 1, max_tasks * num_classes)
+        task_index = []
+        for mi, m in enumerate(models):
+            for ti, head in enumerate(m.heads):
+                cols = slice(ti * num_classes, (ti + 1) * num_classes)
+                head_w[mi, :, cols] = head.weight.detach().t()
+                head_b[mi, 0, cols] = head.bias.detach()
+                task_index.append(mi * max_tasks + ti)
+        self.register_buffer("head_w", head_w)
+        self.register_buffer("head_b", head_b)
+        self.register_buffer("task_index", torch.tensor(task_index, dtype=torch.long))
+        self.register_buffer("view_index", torch.tensor(view_index, dtype=torch.long))
+
+        # float64, as StandardScaler.transform: a float32 subtraction can move
+        # a feature near a bin edge across it
+        self.register_buffer("scaler_mean", torch.as_tensor(np.asarray(scaler_mean), dtype=torch.float64))
+        self.register_buffer("scaler_scale", torch.as_tensor(np.asarray(scaler_scale), dtype=torch.float64))
+
+        self.eval()
+
+    def forward(self, x):
+        """
+        x : (N, V, 42) raw (unscaled) features, views in VIEW_ORDER
+        returns logits of shape (N, 12, 4)
+        """
+        n = x.shape[0]
+        x = ((x.to(torch.float64) - self.scaler_mean) / self.scaler_scale).to(self.w1.dtype)
+
+        # (M, N, 42): every model picks its own view
+        h = x.index_select(1, self.view_index).transpose(0, 1)
+        h = torch.relu(torch.baddbmm(self.b1, h, self.w1))
+        h = torch.relu(torch.baddbmm(self.b2, h, self.w2))
+        h = torch.relu(torch.baddbmm(self.b3, h, self.w3))
+        out = torch.baddbmm(self.head_b, h, self.head_w)      # (M, N, T*C)
+
+        out = out.view(self.num_models, n, self.max_tasks, self.num_classes)
+        out = out.transpose(0, 1).reshape(n, self.num_models * self.max_tasks, self.num_classes)
+        return out.index_select(1, self.task_index)
+
+    def predict(self, features):
+        """
+        features : array-like (N, V, 42) or (V, 42) of raw features
+        returns an (N, 12) int array of scores in 1-4
+        """
+        with torch.no_grad():
+            logits = self.forward(torch.from_numpy(as_batch(features)))
+        return scores_from_logits(logits.numpy())
+
+
+def as_batch(features):
+    """(N, V, 42) or (V, 42) array-like -> contiguous float32 (N, V, 42)"""
+    x = np.ascontiguousarray(features, dtype=np.float32)
+    return x[None] if x.ndim == 2 else x
+
+
+def scores_from_logits(logits):
+    # argmax of the logits == argmax of the softmax
+    return logits.argmax(axis=2) + 1
+
+
+# =====================================================
+# Exported runtimes (see export_models.py)
+# =====================================================
+#
+# Same predict() / views_used interface as FusedNoseScorer, but the graph is
+# run by the TorchScript interpreter or ONNX Runtime with a fixed number of
+# intra-op threads instead of eager PyTorch.
+
+class TorchScriptScorer:
+    def __init__(self, path, threads=1):
+        torch.set_num_threads(threads)
+        self.module = torch.jit.load(path, map_location="cpu").eval()
+        self.views_used = sorted(set(self.module.view_index.tolist()))
+
+    def predict(self, features):
+        with torch.no_grad():
+            logits = self.module(torch.from_numpy(as_batch(features)))
+        return scores_from_logits(logits.numpy())
+
+
+class OnnxScorer:
+    def __init__(self, path, threads=1):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.views_used = [int(v) for v in meta["views_used"].split(",")]
+
+    def predict(self, features):
+        logits = self.session.run(None, {"features": as_batch(features)})[0]
+        return scores_from_logits(logits)
@@ -0,0 +1,139 @@
+"""
+Production server: pre-forked uvicorn workers sharing the loaded models.
+
+    python serve.py --workers 4 --port 5000
+    python serve.py --workers 4 --threads 8      # the whole deployment gets 8 cores
+
+`uvicorn --workers` starts fresh interpreters that each load the classifiers
+and the scaler again.  Here the parent binds the socket, imports main, loads
+the read-only artifacts (main.preload), freezes the GC so collections don't
+write into the shared objects, and only then forks the workers: the weights
+stay in memory once, shared copy-on-write.  Each worker runs its own event
+loop, batcher, MediaPipe pool and 3DDFA workers, all sized from its share of
+the thread budget (cpu_budget.py).  A worker that dies is replaced; SIGTERM /
+SIGINT stop them all.
+
+Jobs (/api/jobs) and sessions (/api/sessions) are kept in the memory of the
+worker that created them, so with more than one worker they need a proxy
+with sticky routing.  bench_workers.py measures memory and throughput
+against the worker count.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+log = logging.getLogger("serve")
+
+
+def bind(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, app, log_level):
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if app is None:                 # --no-preload: everything is loaded in the worker
+        import main as backend
+        app = backend.app
+    config = uvicorn.Config(app, log_config=None, log_level=log_level.lower(), access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the backend with pre-forked workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", "1")))
+    parser.add_argument("--threads", type=int, help="THREAD_BUDGET: cores shared by all workers")
+    parser.add_argument("--no-preload", action="store_true", help="load the models in every worker instead")
+    args = parser.parse_args(argv)
+
+    # read by settings at import, before anything sizes its pools
+    os.environ["WEB_WORKERS"] = str(args.workers)
+    if args.threads:
+        os.environ["THREAD_BUDGET"] = str(args.threads)
+    sys.path.insert(0, BACKEND_DIR)
+    import cpu_budget
+    import settings
+
+    cpu_budget.limit_native_threads()
+    logging.basicConfig(level=settings.LOG_LEVEL)
+
+    sock = bind(args.host, args.port)
+    app = None
+    if not args.no_preload:
+        import main as backend
+
+        t0 = time.perf_counter()
+        backend.preload()
+        gc.collect()
+        gc.freeze()
+        log.info("preloaded %s in %.0f ms", backend.registry.status()["loaded"], (time.perf_counter() - t0) * 1000.0)
+        app = backend.app
+    if threading.active_count() > 1:
+        log.warning("forking with %d threads running, their locks may be held in the workers",
+                    threading.active_count())
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, app, settings.LOG_LEVEL)
+            except BaseException:
+                log.exception("worker %d crashed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(args.workers):
+        spawn(i)
+    log.info("serving on %s:%d with %d workers (pid %d, %s cpus each)", args.host, args.port, args.workers,
+             os.getpid(), settings.WORKER_CPUS)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            log.warning("worker %d (pid %d) exited with status %d, restarting", index, pid, status)
+            time.sleep(1.0)
+            spawn(index)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
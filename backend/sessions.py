@@ -0,0 +1,146 @@
+import threading
+import time
+
+from nose_models import MODEL_FILES, MODEL_TASKS, MODEL_VIEWS
+from scoring import VIEW_ORDER
+
+# =====================================================
+# Analysis sessions with per-view incremental recomputation
+# =====================================================
+#
+# A session keeps everything computed for one patient, per view, so replacing
+# one photo only recomputes what depends on it:
+#
+#   image:<view> -> landmarks:<view> -> features:<view> -> model:<name>
+#   image:front  -> mesh
+#
+# Landmarks / features only exist for the views a model consumes (MODEL_VIEWS);
+# the other photos are kept as image hashes only.  Model outputs are the
+# model's own slice of the 12 scores.
+
+MODEL_NAMES = list(MODEL_FILES)
+
+
+def _build_graph():
+    """node -> the nodes it is computed from, in a topological order."""
+    graph = {}
+    for view in VIEW_ORDER:
+        if view in MODEL_VIEWS:
+            graph[f"landmarks:{view}"] = [f"image:{view}"]
+            graph[f"features:{view}"] = [f"landmarks:{view}"]
+    for name, view in zip(MODEL_NAMES, MODEL_VIEWS):
+        graph[f"model:{name}"] = [f"features:{view}"]
+    graph["mesh"] = ["image:front"]
+    return graph
+
+
+DEPENDENCIES = _build_graph()
+
+
+def dirty_nodes(changed):
+    """Everything downstream of the changed nodes, in computation order."""
+    dirty = set(changed)
+    for node, inputs in DEPENDENCIES.items():
+        if any(i in dirty for i in inputs):
+            dirty.add(node)
+    return [node for node in DEPENDENCIES if node in dirty]
+
+
+def model_slices():
+    """{model name: slice of the 12 scores it produces}"""
+    out, start = {}, 0
+    for name, n in zip(MODEL_NAMES, MODEL_TASKS):
+        out[name] = slice(start, start + n)
+        start += n
+    return out
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.revision = 0
+        self.views = {}         # view -> {"key", "landmarks", "features"}
+        self.models = {}        # model name -> its scores
+        self.mesh = None        # "<session_id>/<stem>.glb"
+        self.lock = threading.Lock()
+
+    def scores(self):
+        """The 12 scores once every model has an output, else None."""
+        if not all(name in self.models for name in MODEL_NAMES):
+            return None
+        return [s for name in MODEL_NAMES for s in self.models[name]]
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "revision": self.revision,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "views": {view: state["key"] for view, state in self.views.items()},
+            "model_outputs": dict(self.models),
+            "nose_scores": self.scores(),
+            "3d_results": self.mesh,
+        }
+
+
+class SessionManager:
+    """
+    In-memory sessions, dropped `ttl` seconds after their last change (or
+    beyond max_sessions, least recently updated first).  on_expire(session_id)
+    runs for every dropped session.
+    """
+
+    def __init__(self, ttl=3600, max_sessions=256, on_expire=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.on_expire = on_expire
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, room=0):
+        """Drops expired sessions (and the oldest beyond max_sessions - room); returns their ids."""
+        cutoff = time.time() - self.ttl
+        by_age = sorted(self._sessions.values(), key=lambda s: s.updated_at)
+        expired = [s.id for s in by_age if s.updated_at < cutoff]
+        excess = len(by_age) - len(expired) - self.max_sessions + room
+        expired += [s.id for s in by_age[len(expired):len(expired) + max(0, excess)]]
+        for session_id in expired:
+            del self._sessions[session_id]
+        return expired
+
+    def _expire(self, session_ids):
+        """on_expire hooks, run outside the lock."""
+        if self.on_expire is not None:
+            for session_id in session_ids:
+                self.on_expire(session_id)
+
+    def create(self, session_id):
+        with self._lock:
+            expired = self._prune(room=1)       # room for the one being created
+            session = self._sessions[session_id] = Session(session_id)
+        self._expire(expired)
+        return session
+
+    def get(self, session_id):
+        """The live session, or None once it is past its ttl."""
+        with self._lock:
+            expired = self._prune()
+            session = self._sessions.get(session_id)
+        self._expire(expired)
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            expired = self._prune()
+            session = self._sessions.pop(session_id, None)
+        self._expire(expired + ([session_id] if session is not None else []))
+        return session is not None
+
+    def stats(self):
+        with self._lock:
+            expired = self._prune()
+            stats = {"sessions": len(self._sessions), "max_sessions": self.max_sessions, "ttl_seconds": self.ttl}
+        self._expire(expired)
+        return stats
@@ -0,0 +1,148 @@
+import os
+
+# =====================================================
+# Backend configuration (override through environment variables)
+# =====================================================
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "m-frontend-rhino")
+
+# -----------------------------
+# Model artifacts (.pth classifiers + scaler_mean.npy / scaler_scale.npy)
+# -----------------------------
+MODEL_DIR = os.environ.get("MODEL_DIR", BACKEND_DIR)
+# load everything at startup (in the background) instead of on first request
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") == "1"
+# eager | torchscript | onnx | onnx-int8 (the last three need export_models.py first)
+SCORER_BACKEND = os.environ.get("SCORER_BACKEND", "eager")
+# intra-op threads for the scorer, the MLPs are too small to gain from more
+SCORER_THREADS = int(os.environ.get("SCORER_THREADS", "1"))
+# concurrent requests are scored together: a batch is flushed at BATCH_MAX_ROWS
+# rows or after BATCH_MAX_WAIT_MS, whichever comes first (BATCHING=0 disables)
+BATCHING = os.environ.get("BATCHING", "1") == "1"
+BATCH_MAX_ROWS = int(os.environ.get("BATCH_MAX_ROWS", "64"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "2"))
+# largest request /api/score/{landmarks,features} accepts
+SCORE_MAX_CASES = int(os.environ.get("SCORE_MAX_CASES", "100000"))
+
+# -----------------------------
+# 3DDFA_V2 reconstruction
+# -----------------------------
+TDDFA_DIR = os.path.expanduser(os.environ.get("TDDFA_DIR", "~/3DDFA_V2"))
+TDDFA_PYTHON = os.environ.get("TDDFA_PYTHON", os.path.join(TDDFA_DIR, "venv", "bin", "python3"))
+TDDFA_CONFIG = os.environ.get("TDDFA_CONFIG", "configs/mb1_120x120.yml")
+TDDFA_STARTUP_TIMEOUT = float(os.environ.get("TDDFA_STARTUP_TIMEOUT", "120"))
+
+# where the .glb / uv texture end up (served to the viewer by /api/results/...)
+RESULTS_DIR = os.environ.get("RESULTS_DIR", os.path.join(FRONTEND_DIR, "public", "results"))
+# per-job result directories: kept RESULTS_TTL seconds, at most RESULTS_MAX_MB on disk
+RESULTS_TTL = float(os.environ.get("RESULTS_TTL", str(24 * 3600)))
+RESULTS_MAX_MB = float(os.environ.get("RESULTS_MAX_MB", "2048"))
+RESULTS_REAP_INTERVAL = float(os.environ.get("RESULTS_REAP_INTERVAL", "60"))
+# analysis sessions (/api/sessions) are dropped SESSION_TTL seconds after their last change
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "256"))
+# also write the old text <name>_obj.obj next to the .glb
+WRITE_OBJ = os.environ.get("WRITE_OBJ", "0") == "1"
+# triangle budgets of /api/results/<name>.glb?max_triangles=N: N is snapped down to
+# one of these (the smallest if below all), so a job holds at most one .glb per budget
+DECIMATION_BUDGETS = sorted(int(n) for n in os.environ.get("DECIMATION_BUDGETS", "2000,5000,10000,20000").split(","))
+
+# -----------------------------
+# Similar-case retrieval (case_index.py)
+# -----------------------------
+# every analysis appends its scaled feature vectors here (CASE_INDEX=0 disables)
+CASE_INDEX = os.environ.get("CASE_INDEX", "1") == "1"
+CASE_INDEX_DIR = os.environ.get("CASE_INDEX_DIR", os.path.join(BACKEND_DIR, "case_index"))
+SIMILAR_MAX_K = int(os.environ.get("SIMILAR_MAX_K", "100"))
+# searches switch to the IVF index (once built) from this many cases on
+SIMILAR_IVF_MIN_CASES = int(os.environ.get("SIMILAR_IVF_MIN_CASES", "200000"))
+SIMILAR_NPROBE = int(os.environ.get("SIMILAR_NPROBE", "8"))
+
+# -----------------------------
+# Training (train.py)
+# -----------------------------
+# features of the labeled training set, extracted once by `train.py extract`
+TRAIN_CACHE_DIR = os.environ.get("TRAIN_CACHE_DIR", os.path.join(BACKEND_DIR, "train_cache"))
+
+# -----------------------------
+# Streaming uploads (/api/upload/stream)
+# -----------------------------
+# a comment line is sent when no event went out for this long (keeps proxies from timing out)
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+
+# -----------------------------
+# Background jobs
+# -----------------------------
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "8"))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "600"))
+
+# -----------------------------
+# Parallelism
+# -----------------------------
+CPU_COUNT = os.cpu_count() or 1
+# web worker processes started by serve.py, they split THREAD_BUDGET between them
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+# cores the whole deployment may keep busy, and one web worker's share of them
+THREAD_BUDGET = int(os.environ.get("THREAD_BUDGET", str(CPU_COUNT)))
+WORKER_CPUS = max(1, THREAD_BUDGET // WEB_WORKERS)
+# part of a worker's share given to its 3DDFA processes, the rest is for MediaPipe
+RECON_CPU_SHARE = float(os.environ.get("RECON_CPU_SHARE", "0.5"))
+RECON_CPUS = max(1, round(WORKER_CPUS * RECON_CPU_SHARE))
+# resident 3DDFA workers, 2 lets the pre and post meshes of a comparison run side by side
+TDDFA_WORKERS = int(os.environ.get("TDDFA_WORKERS", "2"))
+# ONNX Runtime intra-op threads of each 3DDFA worker
+TDDFA_THREADS = int(os.environ.get("TDDFA_THREADS", str(max(1, RECON_CPUS // TDDFA_WORKERS))))
+# OpenCV's own pool; decode / resize / colour conversion already run on the pipeline threads
+OPENCV_THREADS = int(os.environ.get("OPENCV_THREADS", "1"))
+
+# MediaPipe FaceMesh instances shared by the pipeline threads (one per core of the MediaPipe share)
+FACE_MESH_POOL_SIZE = int(os.environ.get("FACE_MESH_POOL_SIZE", str(max(1, WORKER_CPUS - RECON_CPUS))))
+# threads used to fan out face detection and landmarking; they mostly wait on a
+# FaceMesh, so there is one per instance.  Reconstruction has its own TDDFA_WORKERS
+# threads, so meshes in flight never hold up landmarking.
+PIPELINE_THREADS = int(os.environ.get("PIPELINE_THREADS", str(FACE_MESH_POOL_SIZE)))
+# iris/lip/eye refinement; 0 is cheaper, see landmarks.create_face_mesh
+REFINE_LANDMARKS = os.environ.get("REFINE_LANDMARKS", "1") == "1"
+
+# detect the face once per image and hand FaceMesh / 3DDFA crops of it (see roi.py).
+# Cheaper on large photos, but FaceMesh then sees a rescaled crop, so landmarks
+# and scores shift slightly from the full-photo path the models were trained
+# on; off by default.  bulk_score.py and train.py follow the same setting.
+FACE_ROI = os.environ.get("FACE_ROI", "0") == "1"
+# detection runs on a copy downscaled to this many pixels on the long side
+DETECT_MAX_SIDE = int(os.environ.get("DETECT_MAX_SIDE", "640"))
+# crop = face box grown by MARGIN box sides on each side, downscaled to at most SIDE pixels
+FACE_MESH_ROI_MARGIN = float(os.environ.get("FACE_MESH_ROI_MARGIN", "0.25"))
+FACE_MESH_ROI_SIDE = int(os.environ.get("FACE_MESH_ROI_SIDE", "480"))
+RECON_ROI_MARGIN = float(os.environ.get("RECON_ROI_MARGIN", "0.6"))
+RECON_ROI_SIDE = int(os.environ.get("RECON_ROI_SIDE", "800"))
+
+# -----------------------------
+# Video / multi-frame capture (/api/upload/video, see video.py)
+# -----------------------------
+# every STRIDE-th frame is tracked, at most MAX_FRAMES of them, downscaled to MAX_SIDE pixels
+VIDEO_FRAME_STRIDE = int(os.environ.get("VIDEO_FRAME_STRIDE", "1"))
+VIDEO_MAX_FRAMES = int(os.environ.get("VIDEO_MAX_FRAMES", "600"))
+VIDEO_MAX_SIDE = int(os.environ.get("VIDEO_MAX_SIDE", "640"))
+# frames (sharpest, best posed) whose features are averaged per view
+VIDEO_TOP_FRAMES = int(os.environ.get("VIDEO_TOP_FRAMES", "8"))
+# upload cap per view (a clip, or all photos of a burst together)
+VIDEO_MAX_MB = float(os.environ.get("VIDEO_MAX_MB", "200"))
+# views tracked at once across all requests, each by its own FaceMesh in tracking mode
+VIDEO_TRACKERS = int(os.environ.get("VIDEO_TRACKERS", "2"))
+
+# -----------------------------
+# Per-image cache (landmarks, features, meshes keyed by content hash)
+# -----------------------------
+CACHE_ENTRIES = int(os.environ.get("CACHE_ENTRIES", "512"))
+CACHE_DIR = os.environ.get("CACHE_DIR", "")              # empty = memory only
+CACHE_DISK_MAX_MB = float(os.environ.get("CACHE_DISK_MAX_MB", "512"))
+
+# -----------------------------
+# Logging / instrumentation
+# -----------------------------
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# attach the per-stage timings to every upload response (same as ?debug=true)
+DEBUG_TIMINGS = os.environ.get("DEBUG_TIMINGS", "0") == "1"
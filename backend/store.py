@@ -0,0 +1,209 @@
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+import settings
+
+# =====================================================
+# Per-job results store
+# =====================================================
+#
+# Every analysis owns one directory, RESULTS_DIR/<job_id>/, holding
+#   inputs/<view>.<ext>      uploaded images (only when persist=true)
+#   landmarks.npz            the 15 landmarks of every view that was scored
+#   result.json              the response (scores, mesh names...)
+#   <view>.glb, <view>_uv_tex.jpg ...   meshes
+# All files are written to a temp name and renamed into place.  A background
+# reaper deletes jobs older than the TTL and, past the disk cap, the oldest
+# finished jobs first; jobs still being processed are never touched.  A job
+# in progress has an ACTIVE_MARKER file holding the owner's pid, so the
+# reapers of the other serve.py workers skip it too; the marker of a process
+# that died no longer protects its job.
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+ACTIVE_MARKER = ".active"
+
+log = logging.getLogger(__name__)
+
+
+class ResultStore:
+    def __init__(self, root=settings.RESULTS_DIR, ttl=settings.RESULTS_TTL,
+                 max_bytes=int(settings.RESULTS_MAX_MB * 1024 * 1024)):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+        self.counters = {"jobs_created": 0, "expired": 0, "evicted": 0}
+
+    # -----------------------------
+    # job directories
+    # -----------------------------
+    def create(self):
+        """Creates an empty job directory and returns its id."""
+        job_id = uuid.uuid4().hex
+        # the directory only appears under its job id once it carries the marker
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=f".{job_id}.")
+        with open(os.path.join(tmp, ACTIVE_MARKER), "w") as f:
+            f.write(str(os.getpid()))
+        os.rename(tmp, self.job_dir(job_id))
+        with self._lock:
+            self._active.add(job_id)
+            self.counters["jobs_created"] += 1
+        return job_id
+
+    def finish(self, job_id):
+        """The job is complete: from now on the reaper may remove it."""
+        with self._lock:
+            self._active.discard(job_id)
+        try:
+            os.remove(self.path(job_id, ACTIVE_MARKER))
+        except FileNotFoundError:
+            pass
+        os.utime(self.job_dir(job_id))
+
+    def discard(self, job_id):
+        """Drops a job that never got going (bad upload, queue full...)."""
+        with self._lock:
+            self._active.discard(job_id)
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def job_dir(self, job_id):
+        if not JOB_ID_RE.match(job_id):
+            raise ValueError(f"Invalid job id: {job_id!r}")
+        return os.path.join(self.root, job_id)
+
+    def path(self, job_id, name):
+        return os.path.join(self.job_dir(job_id), name)
+
+    # -----------------------------
+    # atomic writes
+    # -----------------------------
+    def write_bytes(self, job_id, name, data):
+        path = self.path(job_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+    def write_json(self, job_id, name, obj):
+        return self.write_bytes(job_id, name, json.dumps(obj, indent=2).encode())
+
+    def write_arrays(self, job_id, name, **arrays):
+        buf = io.BytesIO()
+        np.savez_compressed(buf, **arrays)
+        return self.write_bytes(job_id, name, buf.getvalue())
+
+    def link(self, job_id, name, src):
+        """Puts an existing file (e.g. a cached mesh of another job) into this job."""
+        path = self.path(job_id, name)
+        tmp = path + ".tmp"
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
+        return path
+
+    # -----------------------------
+    # retention
+    # -----------------------------
+    def _jobs(self):
+        """[(mtime, bytes, job_id)] of all job directories on disk."""
+        jobs = []
+        for job_id in os.listdir(self.root):
+            d = os.path.join(self.root, job_id)
+            if not JOB_ID_RE.match(job_id) or not os.path.isdir(d):
+                continue
+            size = 0
+            for dirpath, _, files in os.walk(d):
+                for f in files:
+                    try:
+                        size += os.path.getsize(os.path.join(dirpath, f))
+                    except OSError:
+                        pass
+            try:
+                jobs.append((os.path.getmtime(d), size, job_id))
+            except OSError:
+                pass
+        return jobs
+
+    def _in_progress(self, job_id):
+        """The job has a marker whose process is still alive (any worker)."""
+        try:
+            with open(self.path(job_id, ACTIVE_MARKER)) as f:
+                pid = int(f.read() or 0)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            return True
+        if pid <= 0:
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _remove(self, job_id, counter):
+        shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+        with self._lock:
+            self.counters[counter] += 1
+
+    def reap(self):
+        """One retention pass: TTL first, then the disk cap (oldest first)."""
+        with self._lock:
+            active = set(self._active)
+        all_jobs = self._jobs()
+        total = sum(size for _, size, _ in all_jobs)
+        jobs = sorted(j for j in all_jobs if j[2] not in active and not self._in_progress(j[2]))
+
+        cutoff = time.time() - self.ttl
+        for mtime, size, job_id in jobs:
+            if mtime < cutoff:
+                self._remove(job_id, "expired")
+                total -= size
+            elif total > self.max_bytes:
+                self._remove(job_id, "evicted")
+                total -= size
+        return total
+
+    def start_reaper(self, interval=settings.RESULTS_REAP_INTERVAL):
+        def _loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reap()
+                except Exception:
+                    log.exception("results reaper pass failed")
+
+        self._reaper = threading.Thread(target=_loop, name="results-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._stop.set()
+
+    def stats(self):
+        jobs = self._jobs()
+        with self._lock:
+            out = dict(self.counters)
+            out["active_jobs"] = len(self._active)
+        out.update({"jobs": len(jobs), "bytes": sum(size for _, size, _ in jobs),
+                    "max_bytes": self.max_bytes, "ttl_seconds": self.ttl})
+        return out
@@ -0,0 +1,149 @@
+"""
+Resident 3DDFA_V2 reconstruction worker.
+
+Runs inside the 3DDFA_V2 checkout (its own venv, cwd = TDDFA_DIR), loads the
+FaceBoxes + TDDFA ONNX sessions once and then serves reconstruction requests
+over a local multiprocessing.connection socket.  One landmark / dense mesh fit
+per image produces the mesh arrays (sent back raw, the backend writes them as
+.glb), the uv texture and optionally the legacy .obj (demo.py used to redo the
+whole fit for each output).
+
+Started and managed by reconstruction.py, not meant to be run by hand.
+"""
+import argparse
+import os
+import sys
+import traceback
+from multiprocessing.connection import Listener
+
+os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
+os.environ.setdefault("OMP_NUM_THREADS", "4")
+
+import numpy as np
+import yaml
+
+
+def limit_onnx_threads(threads):
+    """
+    3DDFA_V2 creates its ONNX Runtime sessions without options, i.e. with one
+    intra-op thread per core.  Gives them `threads` (the backend's budget) instead.
+    """
+    import onnxruntime
+
+    session_class = onnxruntime.InferenceSession
+
+    class InferenceSession(session_class):
+        def __init__(self, path_or_bytes, sess_options=None, *args, **kwargs):
+            if sess_options is None:
+                sess_options = onnxruntime.SessionOptions()
+                sess_options.intra_op_num_threads = threads
+                sess_options.inter_op_num_threads = 1
+            super().__init__(path_or_bytes, sess_options, *args, **kwargs)
+
+    onnxruntime.InferenceSession = InferenceSession
+
+
+def load_models(config):
+    sys.path.insert(0, os.getcwd())
+    limit_onnx_threads(int(os.environ["OMP_NUM_THREADS"]))
+
+    from FaceBoxes.FaceBoxes_ONNX import FaceBoxes_ONNX
+    from TDDFA_ONNX import TDDFA_ONNX
+
+    cfg = yaml.load(open(config), Loader=yaml.SafeLoader)
+    return FaceBoxes_ONNX(), TDDFA_ONNX(**cfg)
+
+
+def mesh_arrays(img, ver_lst, tri):
+    """
+    The same mesh ser_to_obj writes, as arrays: vertices with y flipped to
+    point up, nearest-pixel RGB colours and faces in the OBJ winding, all
+    fitted faces concatenated.
+    """
+    h, w = img.shape[:2]
+    tri = np.asarray(tri)
+    vertices, colors, faces = [], [], []
+    offset = 0
+    for ver in ver_lst:
+        v = np.asarray(ver, dtype=np.float32).T.copy()             # (N, 3)
+        xy = np.round(np.clip(v[:, :2], 0, [w - 1, h - 1])).astype(np.int64)
+        colors.append(img[xy[:, 1], xy[:, 0]][:, ::-1])             # BGR -> RGB
+        v[:, 1] = h - v[:, 1]
+        vertices.append(v)
+        faces.append(tri[:, ::-1] + offset)
+        offset += len(v)
+    return (np.concatenate(vertices), np.ascontiguousarray(np.concatenate(colors), dtype=np.uint8),
+            np.concatenate(faces).astype(np.uint32))
+
+
+def reconstruct(face_boxes, tddfa, img, stem, out_dir, write_obj=False, box=None):
+    from utils.serialization import ser_to_obj
+    from utils.uv import uv_tex
+
+    # the backend already found the face (and sent a crop around it)
+    boxes = [list(box) + [1.0]] if box is not None else face_boxes(img)
+    if len(boxes) == 0:
+        raise ValueError("No face detected")
+
+    # single fit shared by all outputs
+    param_lst, roi_box_lst = tddfa(img, boxes)
+    ver_lst = tddfa.recon_vers(param_lst, roi_box_lst, dense_flag=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    files = {"uv_tex": os.path.join(out_dir, f"{stem}_uv_tex.jpg")}
+    uv_tex(img, ver_lst, tddfa.tri, show_flag=False, wfp=files["uv_tex"])
+    if write_obj:
+        files["obj"] = os.path.join(out_dir, f"{stem}_obj.obj")
+        ser_to_obj(img, ver_lst, tddfa.tri, height=img.shape[0], wfp=files["obj"])
+
+    vertices, colors, faces = mesh_arrays(img, ver_lst, tddfa.tri)
+    mesh = {
+        "vertices": vertices.tobytes(), "colors": colors.tobytes(), "faces": faces.tobytes(),
+        "n_vertices": len(vertices), "n_faces": len(faces),
+    }
+    return files, mesh
+
+
+def handle(face_boxes, tddfa, msg):
+    if msg["op"] == "ping":
+        return {"ok": True}
+
+    if msg["op"] == "reconstruct":
+        # decoded BGR pixels arrive as a raw buffer (no numpy pickles across venvs)
+        img = np.frombuffer(msg["image"], dtype=msg["dtype"]).reshape(msg["shape"])
+        files, mesh = reconstruct(face_boxes, tddfa, img, msg["stem"], msg["out_dir"], msg.get("write_obj", False),
+                                  msg.get("box"))
+        return {"ok": True, "files": files, "mesh": mesh}
+
+    raise ValueError(f"Unknown op: {msg['op']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--config", default="configs/mb1_120x120.yml")
+    args = parser.parse_args()
+
+    authkey = bytes.fromhex(os.environ["TDDFA_WORKER_AUTHKEY"])
+    face_boxes, tddfa = load_models(args.config)
+
+    # the listener only appears once the models are loaded: that is the readiness signal
+    with Listener(args.address, family="AF_UNIX", authkey=authkey) as listener:
+        while True:
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        msg = conn.recv()
+                    except EOFError:
+                        break
+                    if msg["op"] == "shutdown":
+                        return
+                    try:
+                        conn.send(handle(face_boxes, tddfa, msg))
+                    except Exception as e:
+                        traceback.print_exc()
+                        conn.send({"ok": False, "error": str(e)})
+
+
+if __name__ == "__main__":
+    main()
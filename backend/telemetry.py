@@ -0,0 +1,109 @@
+import bisect
+import contextvars
+import logging
+import threading
+
+# =====================================================
+# Request ids, structured logs and Prometheus-style histograms
+# =====================================================
+#
+# Every request gets an id (taken from the X-Request-ID header or generated),
+# which is stamped on its log lines and carried by its Timings, so the stage
+# spans of one analysis can be tied together even when they run on pool threads.
+# Histograms are rendered in the Prometheus text format by /metrics.
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds record.request_id (from the context unless passed via extra=)."""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+def setup_logging(level="INFO"):
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s level=%(levelname)s logger=%(name)s request_id=%(request_id)s %(message)s"
+    ))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+
+
+# -----------------------------
+# Histograms
+# -----------------------------
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, [list(v[0]), v[1], v[2]]) for k, v in self._series.items())
+
+        for key, (counts, total, count) in series:
+            labels = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = ",".join(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {cumulative}")
+            le = ",".join(labels + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{{{le}}} {count}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return "\n".join(lines)
+
+
+def render_metrics():
+    return "\n".join(h.render() for h in REGISTRY) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "nose_stage_seconds", "Duration of one pipeline stage span.", ["stage"],
+)
+REQUEST_SECONDS = Histogram(
+    "nose_request_seconds", "HTTP request latency.", ["method", "route", "status"],
+)
+BATCH_ROWS = Histogram(
+    "nose_batch_rows", "Rows per micro-batched scorer call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+BATCH_QUEUE_SECONDS = Histogram(
+    "nose_batch_queue_seconds", "Time a scoring request waited for its batch to be flushed.",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
@@ -0,0 +1,48 @@
+"""The TorchScript / ONNX exports of the fused scorer give the eager models' scores."""
+import os
+
+import numpy as np
+import pytest
+import torch
+
+import settings
+from export_models import check, export_onnx, export_torchscript, sample_features
+from nose_models import EXPORT_FILES, load_exported_scorer, load_scorer
+
+
+@pytest.fixture(scope="module")
+def eager():
+    return load_scorer(settings.MODEL_DIR)
+
+
+@pytest.fixture(scope="module")
+def features(eager):
+    return sample_features(eager, 2048)
+
+
+def eager_scores(eager, features):
+    with torch.no_grad():
+        return eager(torch.from_numpy(features)).numpy().argmax(axis=2) + 1
+
+
+def test_torchscript_matches_eager(eager, features, tmp_path):
+    export_torchscript(eager, os.path.join(tmp_path, EXPORT_FILES["torchscript"]))
+    scorer = load_exported_scorer("torchscript", str(tmp_path))
+    np.testing.assert_array_equal(scorer.predict(features), eager_scores(eager, features))
+    assert check(eager, str(tmp_path), ["torchscript"], features)
+
+
+def test_onnx_matches_eager(eager, features, tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    export_onnx(eager, os.path.join(tmp_path, EXPORT_FILES["onnx"]))
+    scorer = load_exported_scorer("onnx", str(tmp_path))
+    np.testing.assert_array_equal(scorer.predict(features), eager_scores(eager, features))
+    assert check(eager, str(tmp_path), ["onnx"], features)
+
+
+def test_single_case_batch(eager, features, tmp_path):
+    """A batch of one (the usual request) goes through the dynamic batch axis."""
+    export_torchscript(eager, os.path.join(tmp_path, EXPORT_FILES["torchscript"]))
+    scorer = load_exported_scorer("torchscript", str(tmp_path))
+    np.testing.assert_array_equal(scorer.predict(features[:1]), eager_scores(eager, features[:1]))
@@ -0,0 +1,165 @@
+"""
+features_from_landmarks against the per-image extract_42_features / compute_features
+it replaced (ported below as it was, minus the MediaPipe part), row by row.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from geometry import LANDMARK_NAMES, NUM_LANDMARKS, features_from_landmarks, points_to_array
+
+
+# ---------------------------
+# The original per-image code
+# ---------------------------
+def dist(a, b):
+    return float(np.linalg.norm(a - b))
+
+
+def angle_between(u, v):
+    u = np.array(u, dtype=float)
+    v = np.array(v, dtype=float)
+    nu, nv = np.linalg.norm(u), np.linalg.norm(v)
+    if nu == 0 or nv == 0:
+        return float("nan")
+    cosang = np.clip(np.dot(u, v) / (nu * nv), -1.0, 1.0)
+    return float(math.degrees(math.acos(cosang)))
+
+
+def midpoint(a, b):
+    return (a + b) / 2.0
+
+
+def legacy_compute_features(pts):
+    def p(name):
+        return pts.get(name, None)
+
+    def guarded(fn):
+        try:
+            return fn()
+        except Exception:
+            return float("nan")
+
+    sbalmid = midpoint(p("Sbal_R"), p("Sbal_L")) if p("Sbal_R") is not None and p("Sbal_L") is not None else None
+
+    def ratio(a, b, c, d):
+        denom = dist(p(c), p(d))
+        return dist(p(a), p(b)) / denom if denom != 0 else float("nan")
+
+    return {
+        "Nasofrontal_angle_deg": guarded(lambda: angle_between(p("G") - p("N"), p("Prn") - p("N"))),
+        "Nasolabial_angle_deg": guarded(lambda: angle_between(p("Sn") - p("Ls"), sbalmid - p("Sn"))
+                                        if sbalmid is not None else float("nan")),
+        "Nasal_tip_angle_deg": guarded(lambda: angle_between(p("Ac_L") - p("Prn"), p("Ac_R") - p("Prn"))),
+        "Dorsal_angle_deg": guarded(lambda: angle_between(p("G") - p("N"), p("Prn") - p("N"))),
+        "Columellar_angle_deg": guarded(lambda: angle_between(p("Sn") - p("Prn"), sbalmid - p("Sn"))
+                                        if sbalmid is not None else float("nan")),
+        "Alar_base_width_px": guarded(lambda: dist(p("Al_L"), p("Al_R"))),
+        "Interalar_angle_deg": guarded(lambda: angle_between(p("Ac_L") - p("Prn"), p("Ac_R") - p("Prn"))),
+        "Projection_ratio": guarded(lambda: ratio("N", "Prn", "N", "Sn")),
+        "Tip_projection_index": guarded(lambda: ratio("Prn", "Sn", "Al_L", "Al_R")),
+        "Nasal_dorsum_angle_deg": guarded(lambda: angle_between(p("N") - p("Prn"), p("Sn") - p("Prn"))),
+        "Nasal_width_index": guarded(lambda: ratio("Al_L", "Al_R", "N", "Sn")),
+        "Nasal_height_ratio": guarded(lambda: ratio("G", "Sn", "Al_L", "Al_R")),
+    }
+
+
+def legacy_42_features(pts):
+    f12 = legacy_compute_features(pts)
+
+    def safe_dist(a, b):
+        return 0.0 if a is None or b is None else dist(a, b)
+
+    def safe_ang(a, b, c):
+        return 0.0 if a is None or b is None or c is None else angle_between(a - b, c - b)
+
+    def sym(a, b, center):
+        return 0.0 if a is None or b is None or center is None else abs(dist(a, center) - dist(b, center))
+
+    feats = [
+        safe_dist(pts["N"], pts["Prn"]), safe_dist(pts["Prn"], pts["Sn"]), safe_dist(pts["Al_L"], pts["Al_R"]),
+        safe_dist(pts["Ac_L"], pts["Prn"]), safe_dist(pts["Ac_R"], pts["Prn"]),
+        safe_dist(pts["Sbal_L"], pts["Sbal_R"]), safe_dist(pts["G"], pts["N"]), safe_dist(pts["G"], pts["Prn"]),
+        safe_dist(pts["N"], pts["Sn"]), safe_dist(pts["Prn"], pts["Ls"]),
+    ]
+    feats += [
+        safe_ang(pts["G"], pts["N"], pts["Prn"]), safe_ang(pts["N"], pts["Prn"], pts["Sn"]),
+        safe_ang(pts["Al_L"], pts["Prn"], pts["Al_R"]), safe_ang(pts["Ac_L"], pts["Prn"], pts["Ac_R"]),
+        safe_ang(pts["Sbal_L"], pts["Sn"], pts["Sbal_R"]), safe_ang(pts["G"], pts["Prn"], pts["Sn"]),
+        safe_ang(pts["G"], pts["Sn"], pts["Prn"]), safe_ang(pts["N"], pts["Sn"], pts["Prn"]),
+    ]
+    denom1 = safe_dist(pts["N"], pts["Sn"])
+    denom2 = safe_dist(pts["Al_L"], pts["Al_R"])
+    denom3 = safe_dist(pts["G"], pts["Sn"])
+    feats += [
+        safe_dist(pts["N"], pts["Prn"]) / (denom1 + 1e-6), safe_dist(pts["Prn"], pts["Sn"]) / (denom2 + 1e-6),
+        safe_dist(pts["G"], pts["Prn"]) / (denom3 + 1e-6), safe_dist(pts["G"], pts["N"]) / (denom3 + 1e-6),
+        safe_dist(pts["Sbal_L"], pts["Sbal_R"]) / (denom2 + 1e-6),
+        safe_dist(pts["Ac_L"], pts["Ac_R"]) / (denom2 + 1e-6),
+    ]
+    mid_n_prn = midpoint(pts["N"], pts["Prn"]) if pts["N"] is not None and pts["Prn"] is not None else None
+    feats += [
+        sym(pts["Al_L"], pts["Al_R"], pts["N"]), sym(pts["Ac_L"], pts["Ac_R"], pts["Prn"]),
+        sym(pts["Sbal_L"], pts["Sbal_R"], pts["Sn"]), sym(pts["En_L"], pts["En_R"], pts["G"]),
+        sym(pts["Tr_L"], pts["Tr_R"], mid_n_prn), sym(pts["Ac_L"], pts["Ac_R"], pts["Sn"]),
+    ]
+    for k in ["Nasofrontal_angle_deg", "Dorsal_angle_deg", "Nasal_dorsum_angle_deg", "Nasolabial_angle_deg",
+              "Columellar_angle_deg", "Nasal_tip_angle_deg", "Interalar_angle_deg", "Alar_base_width_px",
+              "Nasal_width_index", "Nasal_height_ratio", "Projection_ratio", "Tip_projection_index"]:
+        feats.append(float(f12.get(k, 0.0)))
+    return np.array(feats, dtype=np.float32)
+
+
+def to_points(landmarks):
+    """(15, 2) array with NaN rows -> the {name: point or None} dict of the old code."""
+    return {name: None if np.isnan(row).any() else row.astype(float) for name, row in zip(LANDMARK_NAMES, landmarks)}
+
+
+def assert_matches_legacy(batch):
+    vectorized = features_from_landmarks(batch)
+    assert vectorized.shape == (len(batch), 42) and vectorized.dtype == np.float32
+    for row, landmarks in zip(vectorized, batch):
+        expected = legacy_42_features(to_points(landmarks))
+        np.testing.assert_allclose(row, expected, rtol=1e-5, atol=1e-3, equal_nan=True)
+        # a single image goes through the same kernel
+        np.testing.assert_array_equal(features_from_landmarks(landmarks), row)
+
+
+# ---------------------------
+# Tests
+# ---------------------------
+def test_random_faces():
+    rng = np.random.default_rng(0)
+    assert_matches_legacy(rng.uniform(0, 1000, (256, NUM_LANDMARKS, 2)))
+
+
+def test_missing_landmarks():
+    rng = np.random.default_rng(1)
+    batch = rng.uniform(0, 1000, (256, NUM_LANDMARKS, 2))
+    batch[rng.random((256, NUM_LANDMARKS)) < 0.2] = np.nan
+    batch[0] = np.nan                              # no face at all
+    assert_matches_legacy(batch)
+
+
+@pytest.mark.parametrize("case", ["all_same", "pairs_coincide", "collinear", "integer_grid"])
+def test_degenerate_faces(case):
+    rng = np.random.default_rng(2)
+    batch = rng.uniform(0, 1000, (32, NUM_LANDMARKS, 2))
+    if case == "all_same":
+        batch[:] = batch[:, :1]                    # zero distances, undefined angles
+    elif case == "pairs_coincide":
+        for a, b in (("Al_L", "Al_R"), ("N", "Sn"), ("Ac_L", "Prn"), ("G", "N")):
+            batch[:, LANDMARK_NAMES.index(a)] = batch[:, LANDMARK_NAMES.index(b)]
+    elif case == "collinear":
+        batch[:, :, 1] = 500.0                     # angles of exactly 0 / 180 degrees
+    else:
+        batch = np.round(batch / 100.0) * 100.0    # many repeated points
+    assert_matches_legacy(batch)
+
+
+def test_points_to_array_round_trip():
+    rng = np.random.default_rng(3)
+    landmarks = rng.uniform(0, 1000, (NUM_LANDMARKS, 2))
+    landmarks[[2, 7]] = np.nan
+    np.testing.assert_array_equal(points_to_array(to_points(landmarks)), landmarks)
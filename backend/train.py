@@ -0,0 +1,489 @@
+"""
+Training and evaluation of the front / lateral / basal nose classifiers on CPU.
+
+    python train.py extract --manifest labels.csv --workers 8
+    python train.py fit --output-dir trained
+    python train.py evaluate --model-dir .                 # the shipped models
+
+The manifest is bulk_score.py's (CSV or JSONL with case_id,front,right,left,
+basal; relative paths are resolved against the manifest's folder) plus one
+column per score, named as in SCORE_NAMES, holding its 1-4 grade (empty = not
+graded).  JSONL rows may give the 12 grades as a "scores" list instead.
+
+extract   landmarks every case once, in bulk_score's process pool (one
+          FaceMesh per worker, cropping around the face when FACE_ROI is on,
+          exactly as the server does), and caches the features of the views the
+          models use in TRAIN_CACHE_DIR:
+            features.npy  (N, 4, 42) float32, NaN where a view has no face
+            labels.npy    (N, 12) int8 class indices 0-3, -1 = not graded
+            cases.jsonl   case id + extraction error, one line per row
+            meta.json     manifest signature, FaceMesh / ROI mode, timings
+          Both arrays are written and read through np.memmap.  An unchanged
+          manifest is not extracted again (--force redoes it).
+fit       fits the scaler on the training split, then trains the three
+          classifiers together: their weights are stacked the way
+          FusedNoseScorer stacks them, so a step is one bmm per backbone
+          layer for all three models, one bmm for all heads and a single
+          cross-entropy over the 12 tasks (ungraded tasks and views without
+          a face are masked out).  Writes the three .pth files and
+          scaler_mean.npy / scaler_scale.npy in MODEL_DIR's layout, reloads
+          them through load_scorer and writes training_report.json.
+evaluate  the same report for the models in --model-dir on the cached data
+          (validation split of the same --seed / --val-fraction as fit).
+
+The defaults are the hyperparameters of nose_models (batch 16, 200 epochs,
+lr 0.001): about 25 s for 1600 training cases on one core.  Steps are
+overhead-bound at that size; --batch-size 128 --lr 0.003 reached the same
+validation accuracy in about 6 s.
+
+Per task the report has the accuracy, the within-one-grade accuracy, the
+accuracy of always answering the training split's most common grade (majority
+baseline) and the number of graded cases it was measured on.
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import settings
+from bulk_score import init_worker, landmark_case
+from geometry import features_from_landmarks
+from nose_models import (BATCH_SIZE, EPOCHS, INPUT_FEATURES, LR, MODEL_CLASSES, MODEL_FILES, MODEL_TASKS,
+                         MODEL_VIEWS, NUM_CLASSES, NUM_TASKS, SCALER_FILES, SCORE_NAMES, load_scorer)
+from scoring import VIEW_ORDER
+
+MODEL_NAMES = list(MODEL_FILES)                                   # front, lateral, basal
+# for every model the view it consumes, for every task the model that owns it
+MODEL_VIEW_INDEX = [VIEW_ORDER.index(v) for v in MODEL_VIEWS]
+TASK_MODEL = np.repeat(np.arange(len(MODEL_NAMES)), MODEL_TASKS)
+USED_VIEWS = sorted(set(MODEL_VIEW_INDEX))
+
+CACHE_FILES = {"features": "features.npy", "labels": "labels.npy", "cases": "cases.jsonl", "meta": "meta.json"}
+REPORT_FILE = "training_report.json"
+
+
+# =====================================================
+# 1. Labeled manifest
+# =====================================================
+
+def _grade(value):
+    """1-4 grade -> class index 0-3, empty -> -1."""
+    if value is None or str(value).strip() == "":
+        return -1
+    grade = int(float(value))
+    if not 1 <= grade <= NUM_CLASSES:
+        raise ValueError(f"grade {value!r} is not in 1-{NUM_CLASSES}")
+    return grade - 1
+
+
+def read_manifest(path):
+    """-> list of (case_id, {view: path}, (12,) int8 class indices)"""
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        return os.path.join(base, p) if p and not os.path.isabs(p) else p
+
+    cases = []
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            grades = row.get("scores") or [row.get(name) for name in SCORE_NAMES]
+            if len(grades) != NUM_TASKS:
+                raise ValueError(f"case {row['case_id']}: {len(grades)} grades, expected {NUM_TASKS}")
+            labels = np.array([_grade(g) for g in grades], dtype=np.int8)
+            cases.append((str(row["case_id"]), {view: resolve(row.get(view)) for view in VIEW_ORDER}, labels))
+    return cases
+
+
+# =====================================================
+# 2. Feature cache (memory-mapped, extracted once)
+# =====================================================
+
+def _cache_path(cache_dir, name):
+    return os.path.join(cache_dir, CACHE_FILES[name])
+
+
+def manifest_signature(path, refine, roi):
+    st = os.stat(path)
+    return {"manifest": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime, "refine": refine,
+            "roi": roi}
+
+
+def extract(manifest, cache_dir, workers, refine=settings.REFINE_LANDMARKS, force=False, roi=settings.FACE_ROI):
+    """Landmarks + features of every case into cache_dir; returns the cache's meta."""
+    signature = manifest_signature(manifest, refine, roi)
+    meta_path = _cache_path(cache_dir, "meta")
+    if not force and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("signature") == signature:
+            print(f"{cache_dir} is up to date ({meta['cases']} cases)", file=sys.stderr)
+            return meta
+
+    cases = read_manifest(manifest)
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)            # an interrupted extraction must not look complete
+
+    n = len(cases)
+    features = np.lib.format.open_memmap(_cache_path(cache_dir, "features"), mode="w+", dtype=np.float32,
+                                         shape=(n, len(VIEW_ORDER), INPUT_FEATURES))
+    features[:] = np.nan
+    labels = np.lib.format.open_memmap(_cache_path(cache_dir, "labels"), mode="w+", dtype=np.int8,
+                                       shape=(n, NUM_TASKS))
+    for i, (_, _, grades) in enumerate(cases):
+        labels[i] = grades
+
+    errors = 0
+    t0 = last = time.perf_counter()
+    tasks = ((case_id, paths, USED_VIEWS) for case_id, paths, _ in cases)
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(workers, initializer=init_worker, initargs=(refine, roi)) as pool, \
+            open(_cache_path(cache_dir, "cases"), "w") as out:
+        for i, (case_id, landmarks, error) in enumerate(pool.imap(landmark_case, tasks, chunksize=4)):
+            if error is None:
+                features[i, USED_VIEWS] = features_from_landmarks(landmarks[USED_VIEWS])
+            else:
+                errors += 1
+            out.write(json.dumps({"case_id": case_id, "error": error}) + "\n")
+
+            now = time.perf_counter()
+            if now - last > 5:
+                print(f"{i + 1}/{n} cases, {(i + 1) * len(USED_VIEWS) / (now - t0):.1f} images/sec", file=sys.stderr)
+                last = now
+    features.flush()
+    labels.flush()
+    del features, labels
+
+    seconds = time.perf_counter() - t0
+    meta = {
+        "signature": signature,
+        "cases": n,
+        "errors": errors,
+        "views": [VIEW_ORDER[v] for v in USED_VIEWS],
+        "extract_seconds": round(seconds, 2),
+        "images_per_sec": round(n * len(USED_VIEWS) / seconds, 1) if seconds > 0 else None,
+    }
+    tmp = meta_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, meta_path)
+    print(f"extracted {n} cases ({errors} errors) in {seconds:.1f}s", file=sys.stderr)
+    return meta
+
+
+def load_cache(cache_dir):
+    """-> (features (N, 4, 42), labels (N, 12), case ids, meta); the arrays are read-only memmaps."""
+    meta_path = _cache_path(cache_dir, "meta")
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"no complete feature cache in {cache_dir}, run `train.py extract` first")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(_cache_path(cache_dir, "cases")) as f:
+        case_ids = [json.loads(line)["case_id"] for line in f]
+    features = np.load(_cache_path(cache_dir, "features"), mmap_mode="r")
+    labels = np.load(_cache_path(cache_dir, "labels"), mmap_mode="r")
+    return features, labels, case_ids, meta
+
+
+def model_inputs(features):
+    """(N, 4, 42) -> (N, M, 42) the features each model consumes, and (N, M) whether they are complete."""
+    x = np.asarray(features, dtype=np.float32)[:, MODEL_VIEW_INDEX]
+    return x, ~np.isnan(x).any(axis=2)
+
+
+def masked_labels(labels, present):
+    """labels with -1 for the tasks whose model has no features for that case."""
+    y = np.array(labels, dtype=np.int64)
+    y[~present[:, TASK_MODEL]] = -1
+    return y
+
+
+def split_rows(n, val_fraction, seed):
+    """Seeded random (train rows, validation rows)."""
+    order = np.random.default_rng(seed).permutation(n)
+    n_val = int(round(n * val_fraction))
+    return np.sort(order[n_val:]), np.sort(order[:n_val])
+
+
+def fit_scaler(x, present):
+    """StandardScaler over the complete feature rows of every model: (mean, scale), (42,) float64."""
+    rows = x[present].astype(np.float64)
+    if not len(rows):
+        raise ValueError("no case has complete features for any model")
+    mean = rows.mean(axis=0)
+    scale = rows.std(axis=0)
+    scale[scale == 0] = 1.0
+    return mean, scale
+
+
+# =====================================================
+# 3. Training: the three classifiers as stacked weights
+# =====================================================
+
+class StackedClassifiers(nn.Module):
+    """
+    Trainable counterpart of FusedNoseScorer: the backbones of the M models
+    as (M, in, out) parameters and all their heads as one (M, 64, T*C)
+    matrix, padded to the model with the most heads.  Initialized from
+    fresh NoseScoreClassifier2 / 3 / NoseBasalClassifier instances, and
+    turned back into them by to_models().
+    """
+
+    def __init__(self):
+        super().__init__()
+        models = [MODEL_CLASSES[name]() for name in MODEL_NAMES]
+        self.num_models = len(models)
+        self.max_tasks = max(MODEL_TASKS)
+
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for idx in (0, 2, 4):
+            self.weights.append(nn.Parameter(torch.stack([m.backbone[idx].weight.detach().t() for m in models])))
+            self.biases.append(nn.Parameter(torch.stack([m.backbone[idx].bias.detach().unsqueeze(0)
+                                                         for m in models])))
+
+        hidden = models[0].backbone[4].out_features
+        head_w = torch.zeros(self.num_models, hidden, self.max_tasks * NUM_CLASSES)
+        head_b = torch.zeros(self.num_models, 1, self.max_tasks * NUM_CLASSES)
+        task_index = []
+        for mi, m in enumerate(models):
+            for ti, head in enumerate(m.heads):
+                cols = slice(ti * NUM_CLASSES, (ti + 1) * NUM_CLASSES)
+                head_w[mi, :, cols] = head.weight.detach().t()
+                head_b[mi, 0, cols] = head.bias.detach()
+                task_index.append(mi * self.max_tasks + ti)
+        self.head_w = nn.Parameter(head_w)
+        self.head_b = nn.Parameter(head_b)
+        self.register_buffer("task_index", torch.tensor(task_index, dtype=torch.long))
+
+    def forward(self, h):
+        """h : (M, N, 42) scaled features of every model -> (N, 12, 4) logits"""
+        n = h.shape[1]
+        for w, b in zip(self.weights, self.biases):
+            h = torch.relu(torch.baddbmm(b, h, w))
+        out = torch.baddbmm(self.head_b, h, self.head_w)
+        out = out.view(self.num_models, n, self.max_tasks, NUM_CLASSES)
+        out = out.transpose(0, 1).reshape(n, self.num_models * self.max_tasks, NUM_CLASSES)
+        return out.index_select(1, self.task_index)
+
+    def to_models(self):
+        """The trained weights as the classifier modules load_model() expects."""
+        models = [MODEL_CLASSES[name]() for name in MODEL_NAMES]
+        with torch.no_grad():
+            for mi, m in enumerate(models):
+                for li, idx in enumerate((0, 2, 4)):
+                    m.backbone[idx].weight.copy_(self.weights[li][mi].t())
+                    m.backbone[idx].bias.copy_(self.biases[li][mi, 0])
+                for ti, head in enumerate(m.heads):
+                    cols = slice(ti * NUM_CLASSES, (ti + 1) * NUM_CLASSES)
+                    head.weight.copy_(self.head_w[mi, :, cols].t())
+                    head.bias.copy_(self.head_b[mi, 0, cols])
+                m.eval()
+        return models
+
+
+def train(x, y, epochs=EPOCHS, batch_size=BATCH_SIZE, lr=LR, seed=0):
+    """
+    x : (N, M, 42) scaled features (0 where missing), y : (N, 12) class indices, -1 = masked
+    Returns (StackedClassifiers, stats).
+    """
+    torch.manual_seed(seed)
+    model = StackedClassifiers()
+    try:
+        # one kernel for all parameters (CPU support since torch 2.4)
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr, fused=True)
+    except (RuntimeError, TypeError):
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr, foreach=True)
+    x = torch.from_numpy(np.ascontiguousarray(x.transpose(1, 0, 2)))       # (M, N, 42)
+    y = torch.from_numpy(y)
+    n = y.shape[0]
+
+    generator = torch.Generator().manual_seed(seed)
+    steps, losses = 0, []
+    t0 = time.perf_counter()
+    model.train()
+    for _ in range(epochs):
+        order = torch.randperm(n, generator=generator)
+        epoch_loss, batches = torch.zeros(()), 0
+        for start in range(0, n, batch_size):
+            idx = order[start:start + batch_size]
+            target = y[idx]
+            if not (target >= 0).any():
+                continue
+            logits = model(x[:, idx])
+            # every head of every model in one call; masked tasks are ignored
+            loss = F.cross_entropy(logits.reshape(-1, NUM_CLASSES), target.reshape(-1), ignore_index=-1)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.detach()
+            batches += 1
+            steps += 1
+        losses.append(epoch_loss.item() / max(batches, 1))
+    seconds = time.perf_counter() - t0
+    model.eval()
+    return model, {"epochs": epochs, "batch_size": batch_size, "lr": lr, "seed": seed, "steps": steps,
+                   "train_seconds": round(seconds, 2), "first_epoch_loss": round(losses[0], 4) if losses else None,
+                   "final_loss": round(losses[-1], 4) if losses else None}
+
+
+def save_models(models, mean, scale, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for name, model in zip(MODEL_NAMES, models):
+        torch.save(model.state_dict(), os.path.join(output_dir, MODEL_FILES[name]))
+    np.save(os.path.join(output_dir, SCALER_FILES["mean"]), mean)
+    np.save(os.path.join(output_dir, SCALER_FILES["scale"]), scale)
+
+
+# =====================================================
+# 4. Evaluation
+# =====================================================
+
+def majority_grades(y):
+    """(N, 12) training labels -> (12,) most common class per task, -1 where none is graded"""
+    majority = np.full(NUM_TASKS, -1, dtype=np.int64)
+    for t in range(NUM_TASKS):
+        graded = y[:, t][y[:, t] >= 0]
+        if len(graded):
+            majority[t] = np.bincount(graded, minlength=NUM_CLASSES).argmax()
+    return majority
+
+
+def task_report(pred, y, majority):
+    """
+    pred, y  : (N, 12) class indices, y = -1 where not graded
+    majority : (12,) training split's majority class per task (majority_grades)
+    -> one dict per task
+    """
+    tasks = []
+    for t, name in enumerate(SCORE_NAMES):
+        graded = y[:, t] >= 0
+        p, truth = pred[graded, t], y[graded, t]
+        count = int(graded.sum())
+        tasks.append({
+            "task": name,
+            "model": MODEL_NAMES[TASK_MODEL[t]],
+            "graded": count,
+            "accuracy": round(float(np.mean(p == truth)), 4) if count else None,
+            "within_one": round(float(np.mean(np.abs(p - truth) <= 1)), 4) if count else None,
+            "majority_baseline": round(float(np.mean(truth == majority[t])), 4) if count else None,
+        })
+    return tasks
+
+
+def evaluate(scorer, features, y, majority):
+    """Per-task report of a FusedNoseScorer on raw (N, 4, 42) features; majority from majority_grades."""
+    if not len(y):
+        return {"tasks": task_report(np.zeros((0, NUM_TASKS), dtype=np.int64), y, majority), "mean_accuracy": None}
+    pred = scorer.predict(np.nan_to_num(np.asarray(features, dtype=np.float32))) - 1
+    tasks = task_report(pred, y, majority)
+    measured = [t for t in tasks if t["graded"]]
+    return {
+        "tasks": tasks,
+        "mean_accuracy": round(float(np.mean([t["accuracy"] for t in measured])), 4) if measured else None,
+        "mean_majority_baseline": round(float(np.mean([t["majority_baseline"] for t in measured])), 4)
+        if measured else None,
+    }
+
+
+def print_report(report):
+    print(f"{'task':<28}{'model':<9}{'graded':>7}{'acc':>8}{'±1':>8}{'majority':>10}", file=sys.stderr)
+    for t in report["tasks"]:
+        cells = [f"{t[k]:.3f}" if t[k] is not None else "-" for k in ("accuracy", "within_one", "majority_baseline")]
+        print(f"{t['task']:<28}{t['model']:<9}{t['graded']:>7}{cells[0]:>8}{cells[1]:>8}{cells[2]:>10}",
+              file=sys.stderr)
+    print(f"mean accuracy {report['mean_accuracy']} (majority baseline {report.get('mean_majority_baseline')})",
+          file=sys.stderr)
+
+
+def fit(cache_dir, output_dir, val_fraction=0.2, epochs=EPOCHS, batch_size=BATCH_SIZE, lr=LR, seed=0,
+        overwrite=False):
+    existing = [f for f in list(MODEL_FILES.values()) + list(SCALER_FILES.values())
+                if os.path.exists(os.path.join(output_dir, f))]
+    if existing and not overwrite:
+        raise FileExistsError(f"{output_dir} already has {existing}, pass --overwrite to replace them")
+
+    features, labels, _, meta = load_cache(cache_dir)
+    x, present = model_inputs(features)
+    y = masked_labels(labels, present)
+    train_rows, val_rows = split_rows(len(y), val_fraction, seed)
+
+    mean, scale = fit_scaler(x[train_rows], present[train_rows])
+    x_scaled = np.where(present[:, :, None], (x - mean) / scale, 0.0).astype(np.float32)
+    model, stats = train(x_scaled[train_rows], y[train_rows], epochs, batch_size, lr, seed)
+    save_models(model.to_models(), mean, scale, output_dir)
+
+    # reload through the serving path, so the report is about the files written
+    scorer = load_scorer(output_dir)
+    majority = majority_grades(y[train_rows])
+    report = {
+        "cache": meta,
+        "cases": len(y),
+        "train_cases": len(train_rows),
+        "val_cases": len(val_rows),
+        "training": stats,
+        "train": evaluate(scorer, features[train_rows], y[train_rows], majority),
+        "validation": evaluate(scorer, features[val_rows], y[val_rows], majority),
+    }
+    with open(os.path.join(output_dir, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"trained {stats['steps']} steps in {stats['train_seconds']}s, wrote {output_dir}", file=sys.stderr)
+    print_report(report["validation"] if len(val_rows) else report["train"])
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train / evaluate the nose classifiers on a labeled image set.")
+    parser.add_argument("command", choices=("extract", "fit", "evaluate"))
+    parser.add_argument("--cache", default=settings.TRAIN_CACHE_DIR, help="feature cache folder")
+    parser.add_argument("--manifest", help="extract: labeled CSV or JSONL manifest")
+    parser.add_argument("--workers", type=int, default=settings.CPU_COUNT)
+    parser.add_argument("--no-refine", action="store_true", help="FaceMesh without iris/lip/eye refinement (faster)")
+    parser.add_argument("--force", action="store_true", help="extract again even if the cache is up to date")
+    parser.add_argument("--output-dir", help="fit: where the .pth files, scaler and report are written")
+    parser.add_argument("--overwrite", action="store_true", help="fit: replace model files in --output-dir")
+    parser.add_argument("--model-dir", default=settings.MODEL_DIR, help="evaluate: models to evaluate")
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lr", type=float, default=LR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads (the model is tiny, 1 is fastest)")
+    args = parser.parse_args(argv)
+
+    torch.set_num_threads(args.threads)
+    if args.command == "extract":
+        if not args.manifest:
+            parser.error("extract needs --manifest")
+        extract(args.manifest, args.cache, args.workers, settings.REFINE_LANDMARKS and not args.no_refine,
+                args.force)
+    elif args.command == "fit":
+        if not args.output_dir:
+            parser.error("fit needs --output-dir")
+        fit(args.cache, args.output_dir, args.val_fraction, args.epochs, args.batch_size, args.lr, args.seed,
+            args.overwrite)
+    else:
+        features, labels, _, _ = load_cache(args.cache)
+        x, present = model_inputs(features)
+        y = masked_labels(labels, present)
+        train_rows, val_rows = split_rows(len(y), args.val_fraction, args.seed)
+        rows = val_rows if len(val_rows) else train_rows
+        report = evaluate(load_scorer(args.model_dir), features[rows], y[rows], majority_grades(y[train_rows]))
+        print(json.dumps(report, indent=2))
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+import settings
+from geometry import features_from_landmarks
+from landmarks import create_face_mesh, detect_face
+
+# =====================================================
+# Video / multi-frame capture: FaceMesh tracking + frame selection
+# =====================================================
+#
+# A short clip (or a burst of photos) per view replaces the single photo:
+#   1. frames are read one at a time (FrameSource.frames is a generator),
+#      every VIDEO_FRAME_STRIDE-th one, downscaled to VIDEO_MAX_SIDE
+#   2. one FaceMesh in tracking mode (static_image_mode=False) follows the
+#      face, so only the first frame (or one after the face was lost) pays
+#      for a full detection
+#   3. per frame only a small record is kept: the 15 landmarks (full-size
+#      pixels), the sharpness of the face (variance of the Laplacian) and a
+#      head pose estimate from the mesh
+#   4. the VIDEO_TOP_FRAMES frames that are sharpest and best posed are
+#      selected, and their features (or landmarks) averaged before scoring
+# At most VIDEO_MAX_FRAMES frames are read; nothing but the current frame and
+# the records is held in memory.  The selected frame with the best quality
+# can be read again at full size (FrameSource.frame) for 3D reconstruction.
+
+# MediaPipe mesh indices used for the pose estimate
+NOSE_TIP, RIGHT_EYE_OUTER, LEFT_EYE_OUTER, CHIN = 1, 33, 263, 152
+
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+
+
+class FrameSource:
+    """A video file or a list of image files, read frame by frame."""
+
+    def __init__(self, video_path=None, images=None):
+        self.video_path = video_path
+        self.images = images
+
+    def frames(self, stride=settings.VIDEO_FRAME_STRIDE, max_frames=settings.VIDEO_MAX_FRAMES,
+               max_side=settings.VIDEO_MAX_SIDE):
+        """Yields (index, frame downscaled to max_side, scale) for every stride-th frame."""
+        if self.images is not None:
+            for index, path in enumerate(self.images[:max_frames * stride:stride]):
+                frame = cv2.imread(path, cv2.IMREAD_COLOR)
+                if frame is not None:
+                    yield (index * stride,) + _downscale(frame, max_side)
+            return
+
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            raise ValueError("Could not open the video")
+        try:
+            index = read = 0
+            while read < max_frames:
+                # grab() skips the decode of the frames we don't look at
+                if not cap.grab():
+                    break
+                if index % stride == 0:
+                    ok, frame = cap.retrieve()
+                    if not ok:
+                        break
+                    read += 1
+                    yield (index,) + _downscale(frame, max_side)
+                index += 1
+        finally:
+            cap.release()
+
+    def frame(self, index):
+        """One frame at full size."""
+        if self.images is not None:
+            return cv2.imread(self.images[index], cv2.IMREAD_COLOR)
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = cap.read()
+        finally:
+            cap.release()
+        return frame if ok else None
+
+    def fps(self):
+        if self.images is not None:
+            return None
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+        finally:
+            cap.release()
+        return fps or None
+
+
+def _downscale(frame, max_side):
+    h, w = frame.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    if scale < 1.0:
+        frame = cv2.resize(frame, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    return frame, scale
+
+
+def sharpness(frame, mesh):
+    """Variance of the Laplacian over the face's bounding box (higher = sharper)."""
+    x0, y0 = np.maximum(mesh.min(axis=0).astype(int), 0)
+    x1, y1 = mesh.max(axis=0).astype(int) + 1
+    face = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    if face.size == 0:
+        return 0.0
+    return float(cv2.Laplacian(face, cv2.CV_32F).var())
+
+
+def head_pose(mesh):
+    """
+    (yaw, pitch, roll) proxies from the mesh: yaw is the nose tip's offset
+    between the outer eye corners, pitch its height between the eyes and the
+    chin, roll the tilt of the eye line.  Yaw and roll are ~0 for a frontal face.
+    """
+    nose, right, left, chin = mesh[[NOSE_TIP, RIGHT_EYE_OUTER, LEFT_EYE_OUTER, CHIN]].astype(np.float64)
+    span = max(np.linalg.norm(left - right), 1e-6)
+    eyes = (left + right) / 2.0
+    yaw = (np.linalg.norm(nose - right) - np.linalg.norm(nose - left)) / span
+    pitch = (nose[1] - eyes[1]) / max(chin[1] - eyes[1], 1e-6)
+    roll = np.arctan2(left[1] - right[1], left[0] - right[0])
+    return yaw, pitch, roll
+
+
+def _percentile_ranks(values):
+    """0 for the smallest value .. 1 for the largest."""
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values, kind="stable")] = np.arange(len(values))
+    return ranks / max(len(values) - 1, 1)
+
+
+def select_frames(sharp, poses, frontal, top):
+    """
+    Indices of the `top` best frames: sharpness rank + pose rank.  The pose
+    error is the distance to (0, clip median pitch, 0) for a frontal view,
+    and to the clip's median pose otherwise (the pose the subject held).
+    """
+    target = np.median(poses, axis=0)
+    if frontal:
+        target[[0, 2]] = 0.0
+    pose_error = np.linalg.norm(poses - target, axis=1)
+    quality = _percentile_ranks(sharp) + (1.0 - _percentile_ranks(pose_error))
+    best = np.argsort(-quality, kind="stable")[:top]
+    return best, quality[best]
+
+
+def nanmean(a, axis=0):
+    """np.nanmean without the all-NaN warning (all-NaN -> NaN)."""
+    count = np.sum(~np.isnan(a), axis=axis)
+    total = np.nansum(a, axis=axis)
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def track_view(source, view, refine=settings.REFINE_LANDMARKS, top=settings.VIDEO_TOP_FRAMES,
+               aggregate="features", static=False):
+    """
+    Tracks the face through one view's frames and aggregates the best ones.
+    static=True runs FaceMesh on every frame from scratch (for comparison).
+    Returns {"landmarks": (15, 2), "features": (42,), "best_frame": index, "stats": {...}}.
+    """
+    t0 = time.perf_counter()
+    indices, landmarks, sharp, poses = [], [], [], []
+    frames_read = 0
+    face_mesh = create_face_mesh(refine, static_image_mode=static)
+    try:
+        for index, frame, scale in source.frames():
+            frames_read += 1
+            lm, mesh = detect_face(frame, face_mesh)
+            if mesh is None:
+                continue
+            indices.append(index)
+            landmarks.append(lm / scale)
+            sharp.append(sharpness(frame, mesh))
+            poses.append(head_pose(mesh))
+    finally:
+        face_mesh.close()
+    seconds = time.perf_counter() - t0
+
+    if not indices:
+        raise ValueError(f"No face found in the {view} frames")
+
+    best, quality = select_frames(np.asarray(sharp), np.asarray(poses), view == "front", top)
+    selected = np.stack(landmarks)[best]
+    mean_landmarks = nanmean(selected)
+    if aggregate == "landmarks":
+        features = features_from_landmarks(mean_landmarks[None])[0]
+    else:
+        features = nanmean(features_from_landmarks(selected))
+
+    fps = source.fps()
+    return {
+        "landmarks": mean_landmarks,
+        "features": features.astype(np.float32),
+        "best_frame": int(indices[best[0]]),
+        "stats": {
+            "frames_read": frames_read,
+            "frames_with_face": len(indices),
+            "selected_frames": [int(indices[i]) for i in best],
+            "quality": [round(float(q), 3) for q in quality],
+            "sharpness": round(float(np.median(np.asarray(sharp)[best])), 2),
+            "ms_per_frame": round(seconds * 1000.0 / max(frames_read, 1), 3),
+            # > 1: faster than the clip plays
+            "realtime_factor": round(frames_read * settings.VIDEO_FRAME_STRIDE / fps / seconds, 2)
+            if fps and seconds > 0 else None,
+        },
+    }
+
+
+def is_video(filename, content_type):
+    return (content_type or "").startswith("video/") or os.path.splitext(filename or "")[1].lower() in VIDEO_EXTS
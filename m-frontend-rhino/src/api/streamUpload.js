@@ -0,0 +1,48 @@
+// POSTs a FormData to one of the /stream upload endpoints and reads its
+// Server-Sent Events as they arrive (EventSource can only do GET requests).
+// onEvent(event, data) is called for every event; resolves with the data of
+// the final "result" event, rejects on an "error" event or a failed request.
+export default async function streamUpload(url, formData, onEvent) {
+  const response = await fetch(url, { method: "POST", body: formData });
+  if (!response.ok) {
+    let detail = response.statusText;
+    try {
+      const body = await response.json();
+      detail = typeof body.detail === "string" ? body.detail : JSON.stringify(body.detail);
+    } catch {
+      // not JSON, keep the status text
+    }
+    throw new Error(`Upload failed (${response.status}): ${detail}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // events are separated by a blank line
+    let end;
+    while ((end = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+
+      let event = "message";
+      const data = [];
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data.push(line.slice(5).trim());
+      }
+      if (data.length === 0) continue; // keep-alive comment
+
+      const payload = JSON.parse(data.join("\n"));
+      if (onEvent) onEvent(event, payload);
+      if (event === "result") return payload;
+      if (event === "error") throw new Error(payload.error);
+    }
+  }
+  throw new Error("The server closed the stream before sending a result");
+}
@@ -3,7 +3,7 @@ import { useNavigate } from "react-router-dom";
 import { Canvas, useLoader, useThree } from "@react-three/fiber";
 import { OrbitControls } from "three-stdlib";
 import * as THREE from "three";
-import { OBJLoader } from "three-stdlib";
+import { GLTFLoader } from "three-stdlib";
 import { Billboard, Html } from "@react-three/drei";
 
 /* =========================================
@@ -212,7 +212,8 @@ function HighlightSphere({ position, radius = 0.15, scaleX = 2, scaleY = 1.5, sc
 
 
 /* =========================================
-   OBJ MODEL & CALCULATION LOGIC
+   GLB MODEL & CALCULATION LOGIC
+   (backend serves the mesh as .glb, triangles in the old OBJ face order)
 ========================================= */
 
 function VertexColorModel({ 
@@ -221,10 +222,10 @@ function VertexColorModel({
   rotateY = 0, 
   onCalculated 
 }) {
-  const rawObj = useLoader(OBJLoader, objUrl);
+  const gltf = useLoader(GLTFLoader, objUrl);
 
-// Make the loaded OBJ stable
-  const obj = useMemo(() => rawObj, [rawObj]);
+// Make the loaded model stable
+  const obj = useMemo(() => gltf.scene, [gltf]);
 
 
   // Helper to extract a world position from a vertex index given the object transformations
@@ -232,12 +233,16 @@ function VertexColorModel({
   const geometry = mesh.geometry;
   const pos = geometry.attributes.position;
 
-  if (index >= pos.count) return [0, 0, 0];
+  // vertexIndex values are corners of the non-indexed OBJ geometry,
+  // corner i of the OBJ is vertex index[i] of the indexed glb
+  const corners = geometry.index ? geometry.index.count : pos.count;
+  if (index >= corners) return [0, 0, 0];
+  const vertex = geometry.index ? geometry.index.getX(index) : index;
 
   const v = new THREE.Vector3(
-    pos.getX(index),
-    pos.getY(index),
-    pos.getZ(index)
+    pos.getX(vertex),
+    pos.getY(vertex),
+    pos.getZ(vertex)
   );
   console.log(`Vertex ${index} local position:`, v.toArray());
 
@@ -330,9 +335,8 @@ useEffect(() => {
 export default function ThreeD_VertexColorViewer() {
   const navigate = useNavigate();
   let filename = localStorage.getItem("resultFilename");
-  filename = filename.replace(".obj", "_obj.obj");
-  //let filename = "a2ad9056bc7a46d2968a66669ebbfb07_obj.obj"; //for testing 
-  const url = `/results/${filename}`;
+  //let filename = "a2ad9056bc7a46d2968a66669ebbfb07.glb"; //for testing 
+  const url = `http://localhost:5000/api/results/${filename}`;
 
   const [showLandmarks, setShowLandmarks] = useState(false);
   const [showFeatures, setShowFeatures] = useState(false);
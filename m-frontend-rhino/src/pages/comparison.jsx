@@ -1,7 +1,7 @@
 import React, { useMemo, useEffect, useState, useCallback } from "react";
 import { useNavigate } from "react-router-dom";
 import { Canvas, useLoader, useThree } from "@react-three/fiber";
-import { OrbitControls, OBJLoader } from "three-stdlib";
+import { OrbitControls, GLTFLoader } from "three-stdlib";
 import * as THREE from "three";
 import { Billboard, Html } from "@react-three/drei";
 
@@ -130,19 +130,47 @@ function HighlightSphere({ position, radius = 0.15, scaleX = 2, scaleY = 1.5, sc
 }
 
 /* =========================================
-   OBJ MODEL & CALCULATION LOGIC
+   DISPLACEMENT HEATMAP
+   (per-vertex float32 buffer computed by the backend, same vertex order as the glb)
+========================================= */
+function applyHeatmap(geometry, displacement, maxValue) {
+  if (!geometry.userData.baseColor) {
+    geometry.userData.baseColor = geometry.attributes.color;
+  }
+  if (!displacement || displacement.length !== geometry.attributes.position.count) {
+    if (geometry.userData.baseColor) geometry.setAttribute("color", geometry.userData.baseColor);
+    return;
+  }
+
+  // blue (no change) -> red (>= maxValue)
+  const colors = new Float32Array(displacement.length * 3);
+  const scale = maxValue > 0 ? 1 / maxValue : 0;
+  for (let i = 0; i < displacement.length; i++) {
+    const t = Math.min(displacement[i] * scale, 1);
+    colors[3 * i] = t;
+    colors[3 * i + 1] = 0.2 * (1 - t);
+    colors[3 * i + 2] = 1 - t;
+  }
+  geometry.setAttribute("color", new THREE.BufferAttribute(colors, 3));
+}
+
+/* =========================================
+   GLB MODEL & CALCULATION LOGIC
+   (backend serves the mesh as .glb, triangles in the old OBJ face order)
 ========================================= */
 
 function VertexColorModel({ 
   objUrl, 
   flipFront = false, 
   rotateY = 0, 
-  onCalculated 
+  onCalculated,
+  heatmap = null,
+  heatmapMax = 1
 }) {
-  const rawObj = useLoader(OBJLoader, objUrl);
+  const gltf = useLoader(GLTFLoader, objUrl);
 
-// Make the loaded OBJ stable
-  const obj = useMemo(() => rawObj, [rawObj]);
+// Make the loaded model stable
+  const obj = useMemo(() => gltf.scene, [gltf]);
 
 
   // Helper to extract a world position from a vertex index given the object transformations
@@ -150,12 +178,16 @@ function VertexColorModel({
   const geometry = mesh.geometry;
   const pos = geometry.attributes.position;
 
-  if (index >= pos.count) return [0, 0, 0];
+  // vertexIndex values are corners of the non-indexed OBJ geometry,
+  // corner i of the OBJ is vertex index[i] of the indexed glb
+  const corners = geometry.index ? geometry.index.count : pos.count;
+  if (index >= corners) return [0, 0, 0];
+  const vertex = geometry.index ? geometry.index.getX(index) : index;
 
   const v = new THREE.Vector3(
-    pos.getX(index),
-    pos.getY(index),
-    pos.getZ(index)
+    pos.getX(vertex),
+    pos.getY(vertex),
+    pos.getZ(vertex)
   );
   console.log(`Vertex ${index} local position:`, v.toArray());
 
@@ -237,6 +269,12 @@ useEffect(() => {
   }
 }, [obj, flipFront, rotateY, stableOnCalculated]); // now stable
 
+useEffect(() => {
+  obj.traverse((child) => {
+    if (child.isMesh) applyHeatmap(child.geometry, heatmap, heatmapMax);
+  });
+}, [obj, heatmap, heatmapMax]);
+
   return <primitive object={obj} />;
 }
 /* =========================================
@@ -252,18 +290,29 @@ export default function ThreeD_PrePostComparison() {
   console.log("Loaded filename post:", filename_post);
   let scores = localStorage.getItem("nose_scores");
   console.log("Loaded scores:", scores);
-  filename_pre = filename_pre.replace(".obj", "_obj.obj");
-  filename_post = filename_post.replace(".obj", "_obj.obj");
   const preOpFilename = filename_pre;
   const postOpFilename = filename_post;
-  const preOpUrl = `/results/${preOpFilename}`;
-  const postOpUrl = `/results/${postOpFilename}`;
+  const preOpUrl = `http://localhost:5000/api/results/${preOpFilename}`;
+  const postOpUrl = `http://localhost:5000/api/results/${postOpFilename}`;
 
   const [preOpData, setPreOpData] = useState({ landmarks: [], features: [] });
   const [postOpData, setPostOpData] = useState({ landmarks: [], features: [] });
   const [selectedFeature, setSelectedFeature] = useState(null);
   const [showPanel, setShowPanel] = useState(true);
 
+  // displacement of the post-op mesh vs the pre-op one, drawn on the pre-op model
+  const meshDiff = useMemo(() => JSON.parse(localStorage.getItem("mesh_diff") || "null"), []);
+  const [showHeatmap, setShowHeatmap] = useState(false);
+  const [displacement, setDisplacement] = useState(null);
+
+  useEffect(() => {
+    if (!showHeatmap || displacement || !meshDiff) return;
+    fetch(`http://localhost:5000/api/results/${meshDiff.buffer}`)
+      .then((response) => response.arrayBuffer())
+      .then((buffer) => setDisplacement(new Float32Array(buffer)))
+      .catch((err) => console.error("Could not load displacement buffer:", err));
+  }, [showHeatmap, displacement, meshDiff]);
+
 
  return (
   <div className="min-h-screen w-full bg-gradient-to-b from-gray-100 to-gray-300 flex flex-col items-center justify-center">
@@ -276,6 +325,14 @@ export default function ThreeD_PrePostComparison() {
       >
         Back to Analysis
       </button>
+      {meshDiff && (
+        <button
+          onClick={() => setShowHeatmap(!showHeatmap)}
+          className="px-4 py-2 bg-white text-blue-600 font-semibold rounded-xl shadow-md hover:bg-blue-50 hover:text-blue-700 transition-all duration-200"
+        >
+          {showHeatmap ? "Hide Change Heatmap" : "Show Change Heatmap"}
+        </button>
+      )}
     </div>
 
     <div
@@ -297,6 +354,8 @@ export default function ThreeD_PrePostComparison() {
             objUrl={preOpUrl}
             rotateY={Math.PI / 2}
             onCalculated={setPreOpData}
+            heatmap={showHeatmap ? displacement : null}
+            heatmapMax={meshDiff ? meshDiff.p95 : 1}
           />
 
           <HorizontalControls />
@@ -364,6 +423,18 @@ export default function ThreeD_PrePostComparison() {
             </div>
           );
         })}
+
+        {meshDiff && (
+          <>
+            <h2 className="font-bold text-lg mt-4 mb-2">Surface Change</h2>
+            {Object.entries(meshDiff.regions).map(([name, r]) => (
+              <div key={name} className="flex justify-between mb-1">
+                <span className="capitalize">{name}</span>
+                <span>mean {r.mean.toFixed(2)} / max {r.max.toFixed(2)}</span>
+              </div>
+            ))}
+          </>
+        )}
       </>
     );
   })()}
@@ -1,6 +1,6 @@
 import React, { useState } from "react";
-import axios from "axios";
 import { useNavigate } from "react-router-dom";
+import streamUpload from "../api/streamUpload";
 
 export default function ComparisonUploadPage() {
   const navigate = useNavigate();
@@ -32,6 +32,23 @@ export default function ComparisonUploadPage() {
 
   const [loading, setLoading] = useState(false);
 
+  // filled in by the streamed events: scores per case ("pre" / "post"), then the meshes
+  const emptyProgress = { landmarks: 0, scores: { pre: {}, post: {} }, meshes: [] };
+  const [progress, setProgress] = useState(emptyProgress);
+
+  const handleEvent = (event, data) => {
+    if (event === "landmarks") {
+      setProgress((prev) => ({ ...prev, landmarks: prev.landmarks + 1 }));
+    } else if (event === "scores") {
+      setProgress((prev) => ({
+        ...prev,
+        scores: { ...prev.scores, [data.case]: { ...prev.scores[data.case], ...data.scores } },
+      }));
+    } else if (event === "mesh") {
+      setProgress((prev) => ({ ...prev, meshes: [...prev.meshes, data.case] }));
+    }
+  };
+
   const handleImageChange = (e, key) => {
     const file = e.target.files[0];
     if (file) {
@@ -53,16 +70,18 @@ export default function ComparisonUploadPage() {
 
     try {
       setLoading(true);
-      const response = await axios.post(
-        "http://localhost:5000/api/upload_comparison",
+      setProgress(emptyProgress);
+      const result = await streamUpload(
+        "http://localhost:5000/api/upload_comparison/stream",
         formData,
-        { headers: { "Content-Type": "multipart/form-data" } }
+        handleEvent
       );
 
-      localStorage.setItem("nose_scores", JSON.stringify(response.data["nose_scores"]));
-      localStorage.setItem("resultFilename_pre", response.data["3d_results_pre"]);
-      localStorage.setItem("resultFilename_post", response.data["3d_results_post"]);
-      console.log("Received response:", response.data);
+      localStorage.setItem("nose_scores", JSON.stringify(result["nose_scores"]));
+      localStorage.setItem("resultFilename_pre", result["3d_results_pre"]);
+      localStorage.setItem("resultFilename_post", result["3d_results_post"]);
+      localStorage.setItem("mesh_diff", JSON.stringify(result["mesh_diff"]));
+      console.log("Received response:", result);
 
       alert("Upload successful! Redirecting to comparison page...");
       navigate("/comparison");
@@ -131,6 +150,41 @@ export default function ComparisonUploadPage() {
       >
         {loading ? "Uploading..." : "Upload & Compare"}
       </button>
+
+      {loading && (
+        <div className="mt-8 bg-white/10 rounded-2xl shadow-lg p-6 w-full max-w-4xl">
+          <p className="text-sm opacity-80 mb-3">
+            {progress.landmarks > 0 ? `Landmarks found on ${progress.landmarks} images` : "Detecting facial landmarks..."}
+          </p>
+
+          {Object.keys(progress.scores.pre).length > 0 && (
+            <table className="w-full text-sm mb-3">
+              <thead>
+                <tr className="text-left opacity-80">
+                  <th className="py-1">Feature</th>
+                  <th className="py-1">Pre-Op</th>
+                  <th className="py-1">Post-Op</th>
+                </tr>
+              </thead>
+              <tbody>
+                {Object.keys(progress.scores.pre).map((name) => (
+                  <tr key={name} className="border-t border-white/20">
+                    <td className="py-1">{name}</td>
+                    <td className="py-1 font-semibold">{progress.scores.pre[name]}</td>
+                    <td className="py-1 font-semibold">{progress.scores.post[name] ?? "..."}</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          )}
+
+          <p className="text-sm opacity-80">
+            {progress.meshes.length < 2
+              ? `Building the 3D models (${progress.meshes.length}/2)...`
+              : "Comparing the meshes..."}
+          </p>
+        </div>
+      )}
     </div>
   );
 }
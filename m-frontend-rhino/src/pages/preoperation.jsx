@@ -1,6 +1,6 @@
 import React, { useState } from "react";
-import axios from "axios";
-import { useNavigate } from "react-router-dom"; 
+import { useNavigate } from "react-router-dom";
+import streamUpload from "../api/streamUpload";
 
 export default function PreOperationPage() {
   const navigate = useNavigate();  
@@ -20,6 +20,20 @@ export default function PreOperationPage() {
 
   const [loading, setLoading] = useState(false);
 
+  // filled in by the streamed events while the upload is being analyzed
+  const emptyProgress = { landmarks: [], scores: {}, mesh: null };
+  const [progress, setProgress] = useState(emptyProgress);
+
+  const handleEvent = (event, data) => {
+    if (event === "landmarks") {
+      setProgress((prev) => ({ ...prev, landmarks: [...prev.landmarks, data.view] }));
+    } else if (event === "scores") {
+      setProgress((prev) => ({ ...prev, scores: { ...prev.scores, ...data.scores } }));
+    } else if (event === "mesh") {
+      setProgress((prev) => ({ ...prev, mesh: data["3d_results"] }));
+    }
+  };
+
   const handleImageChange = (e, view) => {
     const file = e.target.files[0];
     if (file) {
@@ -42,16 +56,14 @@ export default function PreOperationPage() {
 
     try {
       setLoading(true);
-      const response = await axios.post("http://localhost:5000/api/upload", formData, {
-        headers: {
-          "Content-Type": "multipart/form-data",
-        },
-      });
-
-      console.log("Upload successful:", response.data);
-      localStorage.setItem("resultFilename", response.data["3d_results"]);
-      localStorage.setItem("noseScores", JSON.stringify(response.data["nose_scores"]));
-      console.log("Stored filename in localStorage:", response.data["3d_results"]);
+      setProgress(emptyProgress);
+      // scores arrive as soon as they are ready, the mesh follows
+      const result = await streamUpload("http://localhost:5000/api/upload/stream", formData, handleEvent);
+
+      console.log("Upload successful:", result);
+      localStorage.setItem("resultFilename", result["3d_results"]);
+      localStorage.setItem("noseScores", JSON.stringify(result["nose_scores"]));
+      console.log("Stored filename in localStorage:", result["3d_results"]);
       alert("Images uploaded successfully!");
       navigate("/success");
     } catch (error) {
@@ -114,6 +126,31 @@ export default function PreOperationPage() {
       >
         {loading ? "Uploading..." : "Upload All"}
       </button>
+
+      {loading && (
+        <div className="mt-8 bg-white/10 rounded-2xl shadow-lg p-6 w-full max-w-3xl">
+          <p className="text-sm opacity-80 mb-3">
+            {progress.landmarks.length > 0
+              ? `Landmarks found: ${progress.landmarks.join(", ")}`
+              : "Detecting facial landmarks..."}
+          </p>
+
+          {Object.keys(progress.scores).length > 0 && (
+            <div className="grid grid-cols-2 sm:grid-cols-3 gap-2 mb-3">
+              {Object.entries(progress.scores).map(([name, score]) => (
+                <div key={name} className="bg-white/10 rounded-lg px-3 py-2 text-sm flex justify-between">
+                  <span>{name}</span>
+                  <span className="font-semibold">{score}</span>
+                </div>
+              ))}
+            </div>
+          )}
+
+          <p className="text-sm opacity-80">
+            {progress.mesh ? "3D model ready, opening the viewer..." : "Building the 3D model..."}
+          </p>
+        </div>
+      )}
     </div>
   );
 }